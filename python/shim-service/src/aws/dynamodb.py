@@ -2,16 +2,51 @@ import abc
 import json
 import sys
 import threading
-import time
 from collections import namedtuple, defaultdict
-from io import StringIO
+from queue import Queue, Empty, Full
 from typing import Any, Callable, Tuple, Union, Optional, List, Mapping, Dict, Collection, Iterable
 
 from aws import is_not_found_exception, is_exception
-from utils import date_utils, exception_utils, object_utils, threading_utils
+from aws import dynamodb_expressions, dynamodb_accounting
+from aws.dynamodb_accounting import DynamoDbAccounting
+from aws.dynamodb_codec import ItemCodec
+from aws.dynamodb_throttling import DynamoDbThrottler, ThrottleStats
+from utils import date_utils, exception_utils, object_utils, threading_utils, collection_utils
+from utils.threading_utils import SingleFlight
 from utils.dict_utils import get_or_create
 from utils.exception_utils import dump_ex
 
+#
+# Max number of keys DynamoDB allows in a single BatchGetItem request
+#
+MAX_BATCH_GET_KEYS = 100
+
+#
+# Max number of items DynamoDB allows in a single BatchWriteItem request
+#
+MAX_BATCH_WRITE_ITEMS = 25
+
+#
+# Max number of items DynamoDB allows in a single TransactWriteItems request
+#
+MAX_TRANSACTION_ITEMS = 100
+
+#
+# Max number of times a batch write is sent while items come back unprocessed
+#
+MAX_BATCH_WRITE_ATTEMPTS = 10
+
+#
+# Max number of threads used to submit batch requests in parallel
+#
+DEFAULT_MAX_BATCH_THREADS = 8
+
+#
+# Parallel scan defaults
+#
+DEFAULT_MAX_SCAN_THREADS = 16
+DEFAULT_MAX_QUEUED_SCAN_PAGES = 8
+
 DynamoDbRow = Dict[str, Any]
 DynamoDbItem = Dict[str, Dict[str, Any]]
 
@@ -44,25 +79,35 @@ def not_exists_filter(name: str) -> FilterOperation:
 def _build_filter_expression(filters: Union[FilterOperation, Collection[FilterOperation]],
                              expr_attributes: DynamoDbItem,
                              expr_attribute_names: Dict[str, str]):
-    io = StringIO()
-    counter = 1
     if not isinstance(filters, Collection):
         filters = [filters]
 
-    for fo in filters:
-        if io.tell() > 0:
-            io.write(" AND ")
-        if fo.operation == '!exists':
-            io.write(f"attribute_not_exists({fo.name})")
-        else:
-            key = f":f{counter}"
-            att_name_key = f"#e{counter}"
-            io.write(f"{att_name_key} {fo.operation} {key}")
+    expression, binds = dynamodb_expressions.filter_template(tuple((fo.name, fo.operation) for fo in filters))
+    for fo, bind in zip(filters, binds):
+        if bind is not None:
+            key, att_name_key = bind
             expr_attributes[key] = _to_attribute_value_dict(fo.value)
             expr_attribute_names[att_name_key] = fo.name
-            counter += 1
 
-    return io.getvalue()
+    return expression
+
+
+def _build_update_expression(item: DynamoDbRow, keys: Mapping[str, Any]) -> Tuple[Optional[str], DynamoDbItem]:
+    names = tuple(name for name in item if name not in keys)
+    template = dynamodb_expressions.update_template(names)
+    if template is None:
+        return None, {}
+    expression, bind_names = template
+    ddb_item = _to_ddb_item(item)
+    return expression, {bind_name: ddb_item[name] for name, bind_name in zip(names, bind_names)}
+
+
+def _and(statement: str, expression: str) -> str:
+    if len(statement) == 0:
+        return expression
+    if len(expression) == 0:
+        return statement
+    return f"{statement} AND {expression}"
 
 
 class PrimaryKeyViolationException(Exception):
@@ -91,6 +136,11 @@ class ThrottlingException(Exception):
         super(Exception, self).__init__(exception_utils.get_exception_message(ex))
 
 
+class UnprocessedItemsException(Exception):
+    def __init__(self, count: int):
+        super(UnprocessedItemsException, self).__init__(f"{count} item(s) were not processed")
+
+
 class DynamoDbValidationException(Exception):
     def __init__(self, message: str):
         super(DynamoDbValidationException, self).__init__(message)
@@ -163,7 +213,7 @@ def build_map(entry: dict) -> dict:
 
 
 def from_ddb_item(item: DynamoDbItem) -> DynamoDbRow:
-    return build_map(item)
+    return _CODEC.decode(item)
 
 
 def _to_attribute_value_map(entry: DynamoDbRow) -> DynamoDbItem:
@@ -208,15 +258,28 @@ def _to_attribute_value_dict(value: Any):
     return {name: value}
 
 
+_CODEC = ItemCodec(_to_attribute_value_dict, convert_value)
+
+
 def _to_ddb_item(entry: DynamoDbRow) -> DynamoDbItem:
-    return _to_attribute_value_map(entry)
+    return _CODEC.encode(entry)
+
+
+_THROTTLING_ERROR_CODES = ("ThrottlingException", "ProvisionedThroughputExceededException", "RequestLimitExceeded")
+
+
+def _is_throttling_exception(ex: Any) -> bool:
+    for code in _THROTTLING_ERROR_CODES:
+        if is_exception(ex, 400, code):
+            return True
+    return False
 
 
 def _handle_client_error(ex):
     code = ex.response['Error']['Code']
     if code == "ValidationException":
         raise DynamoDbValidationException(exception_utils.get_exception_message(ex))
-    if code == "ThrottlingException":
+    if code in _THROTTLING_ERROR_CODES:
         raise ThrottlingException(ex)
     raise ClientError(ex)
 
@@ -225,6 +288,9 @@ def _handle_exception(ex: Any):
     if is_not_found_exception(ex):
         raise ResourceNotFoundException()
 
+    if _is_throttling_exception(ex):
+        raise ThrottlingException(ex)
+
     if is_exception(ex, 400, "TransactionCanceledException"):
         raise TransactionCancelledException(ex.response['CancellationReasons'])
 
@@ -247,17 +313,9 @@ def _process_condition(condition: Union[dict, Tuple[str, dict]], params: dict):
         bind_vars = _to_ddb_item(condition[1])
         statement = condition[0]
     else:
-        counter = 1
-        expr = ""
-        bind_vars = {}
-        for key, value in _to_ddb_item(condition).items():
-            if counter > 1:
-                expr += " AND "
-            bind_name = f":c{counter}"
-            expr += f"{key} = {bind_name}"
-            bind_vars[bind_name] = value
-            counter += 1
-        statement = expr
+        ddb_condition = _to_ddb_item(condition)
+        statement, bind_names = dynamodb_expressions.equals_template(tuple(ddb_condition), ":c", 1)
+        bind_vars = dict(zip(bind_names, ddb_condition.values()))
 
     params['ConditionExpression'] = statement
     params['ExpressionAttributeValues'] = bind_vars
@@ -265,25 +323,16 @@ def _process_condition(condition: Union[dict, Tuple[str, dict]], params: dict):
 
 def _merge_key_condition(keys: Iterable[str], params: dict):
     statement = params.pop('ConditionExpression', "")
-
-    for key in keys:
-        if len(statement) > 0:
-            statement += " AND "
-        statement += f"attribute_exists({key})"
-    params['ConditionExpression'] = statement
+    params['ConditionExpression'] = _and(statement, dynamodb_expressions.exists_template(tuple(keys)))
 
 
 def _merge_key_attributes(keys: Dict[str, Any], params: dict):
     statement = params.pop('ConditionExpression', "")
     bind_vars = params.get('ExpressionAttributeValues', {})
 
-    for key, value in keys.items():
-        if len(statement) > 0:
-            statement += " AND "
-        bind_name = f":k{len(bind_vars)}"
-        bind_vars[bind_name] = value
-        statement += f"{key} = {bind_name}"
-    params['ConditionExpression'] = statement
+    expression, bind_names = dynamodb_expressions.equals_template(tuple(keys), ":k", len(bind_vars))
+    bind_vars.update(zip(bind_names, keys.values()))
+    params['ConditionExpression'] = _and(statement, expression)
     params['ExpressionAttributeValues'] = bind_vars
 
 
@@ -296,14 +345,38 @@ def _merge_attributes(params: dict, attributes: dict):
         existing[key] = value
 
 
+def _single_table_name(table_requests: Mapping[str, Any]) -> Optional[str]:
+    return next(iter(table_requests)) if len(table_requests) == 1 else None
+
+
+def _to_flight_key(ddb_keys: DynamoDbItem) -> Tuple:
+    return tuple(sorted((name, att_type, att_value)
+                        for name, value in ddb_keys.items()
+                        for att_type, att_value in value.items()))
+
+
+def _transaction_item_key(item: Dict[str, Any]) -> DynamoDbItem:
+    params = next(iter(item.values()))
+    return params.get('Key') or params['Item']
+
+
+def _batch_write_item_key(request: Dict[str, Any]) -> DynamoDbItem:
+    put_request = request.get('PutRequest')
+    return put_request['Item'] if put_request is not None else request['DeleteRequest']['Key']
+
+
 class DynamoResponse:
-    def __init__(self, start_time: int, response: Mapping, throttle_count: int):
+    def __init__(self, start_time: int, response: Mapping, throttle_count: int, throttle_sleep_millis: int = 0):
         self.start_time = start_time
         self.elapsed_time = date_utils.get_system_time_in_millis() - start_time
         self.throttle_count = throttle_count
+        self.throttle_sleep_millis = throttle_sleep_millis
         if response is not None:
             cc = response.get('ConsumedCapacity')
-            self.capacity_units = cc.get('CapacityUnits') if cc is not None else None
+            if isinstance(cc, list):
+                self.capacity_units = sum(map(lambda c: c.get('CapacityUnits', 0), cc))
+            else:
+                self.capacity_units = cc.get('CapacityUnits') if cc is not None else None
             self.retry_attempts = response.get('RetryAttempts', 0)
         else:
             self.capacity_units = self.retry_attempts = 0
@@ -412,22 +485,8 @@ class UpdateItemRequest(TransactionRequest):
         self.condition = condition
 
     def to_ddb_request(self) -> Dict[str, Any]:
-        ddb_item = _to_ddb_item(self.item)
         ddb_key = _to_ddb_item(self.keys)
-        update_expression = None
-        expression_values = {}
-        counter = 1
-        for key, value in ddb_item.items():
-            if key in self.keys:
-                continue
-            if update_expression is None:
-                update_expression = "SET "
-            else:
-                update_expression += ", "
-            bind_name = f":v{counter}"
-            counter += 1
-            update_expression += f"{key} = {bind_name}"
-            expression_values[bind_name] = value
+        update_expression, expression_values = _build_update_expression(self.item, self.keys)
 
         params = {
             "TableName": self.table_name,
@@ -480,34 +539,168 @@ class DeleteItemRequest(TransactionRequest, BatchCapableRequest):
         return {'DeleteRequest': {'Key': ddb_key}}
 
 
+class ConditionCheckRequest(TransactionRequest):
+    """
+    Checks a condition on an item without writing it, so that a transaction only goes through if the item is in
+    the expected state.
+    """
+
+    def __init__(self,
+                 table_name: str,
+                 keys: dict,
+                 condition: Union[dict, Tuple[str, dict]] = None,
+                 must_exist: bool = True,
+                 virtual_table_name: str = None
+                 ):
+        super(ConditionCheckRequest, self).__init__()
+        assert condition is not None or must_exist
+        self.virtual_table_name = virtual_table_name
+        self.table_name = table_name
+        self.keys = keys
+        self.condition = condition
+        self.must_exist = must_exist
+
+    def to_ddb_request(self) -> Dict[str, Any]:
+        params = {
+            "TableName": self.table_name,
+            "Key": _to_ddb_item(self.keys)
+        }
+
+        if self.condition is not None:
+            _process_condition(self.condition, params)
+
+        if self.must_exist:
+            _merge_key_condition(self.keys.keys(), params)
+
+        return {'ConditionCheck': params}
+
+
+class BatchWriteOutcome:
+    """
+    The outcome of a single item in a batch write.
+    """
+
+    def __init__(self, source: Any, table_name: str, request: Dict[str, Any]):
+        self.source = source
+        self.table_name = table_name
+        self.request = request
+        self.processed = False
+        self.error: Optional[BaseException] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.processed and self.error is None
+
+
+class BatchWriteResult:
+    def __init__(self, outcomes: List[BatchWriteOutcome], iterations: int):
+        self.outcomes = outcomes
+        self.iterations = iterations
+
+    @property
+    def failures(self) -> List[BatchWriteOutcome]:
+        return list(filter(lambda o: not o.succeeded, self.outcomes))
+
+    @property
+    def succeeded(self) -> bool:
+        return all(map(lambda o: o.succeeded, self.outcomes))
+
+    def raise_if_failed(self):
+        for outcome in self.outcomes:
+            if outcome.error is not None:
+                raise outcome.error
+        if not self.succeeded:
+            raise UnprocessedItemsException(len(self.failures))
+
+
 class DynamoDb:
-    def __init__(self, client):
+    def __init__(self, client,
+                 throttler: DynamoDbThrottler = None,
+                 accounting: DynamoDbAccounting = None,
+                 coalesce_reads: bool = True):
+        """
+        :param client: the boto3 DynamoDB client.
+        :param throttler: used to handle throttling.
+        :param accounting: used to record usage.
+        :param coalesce_reads: True to have concurrent get_item calls for the same key share one request.
+        Consistent reads are never shared, since the request in flight may have been sent before the caller's write.
+        """
         self.__client = client
         self.__thread_local = threading.local()
+        self.__throttler = throttler or DynamoDbThrottler()
+        self.__accounting = accounting or DynamoDbAccounting()
+        self.__read_flights: Optional[SingleFlight[Tuple[Dict[str, Any], DynamoResponse]]] = \
+            SingleFlight() if coalesce_reads else None
+
+    @property
+    def throttler(self) -> DynamoDbThrottler:
+        return self.__throttler
+
+    @property
+    def accounting(self) -> DynamoDbAccounting:
+        return self.__accounting
+
+    @property
+    def read_flights(self) -> Optional[SingleFlight]:
+        """
+        The coalescer for get_item calls, hits are calls that shared a request already in flight.
+        """
+        return self.__read_flights
 
     def get_last_response(self) -> Union[DynamoResponse, None]:
         if hasattr(self.__thread_local, 'last_response'):
             return self.__thread_local.last_response
         return None
 
-    def _handle_throttling(self, function_to_call) -> Any:
-        self.__thread_local.throttle_count = 0
+    def _handle_throttling(self, function_to_call, table_name: Optional[str] = None) -> Any:
+        stats = ThrottleStats()
+        self.__thread_local.throttle_stats = stats
+        throttler = self.__throttler
+        bucket = throttler.get_bucket(table_name)
+        delay = 0
         while True:
+            throttler.wait_for_token(bucket, stats)
             try:
                 try:
-                    return function_to_call()
+                    result = function_to_call()
                 except Exception as ex:
                     _handle_exception(ex)
                     return None
-            except ThrottlingException:
-                self.__thread_local.throttle_count += 1
-                time.sleep(1)
+                throttler.on_success(bucket)
+                return result
+            except ThrottlingException as ex:
+                delay = throttler.on_throttle(bucket, stats, delay)
+                if delay is None:
+                    raise ex
+
+    def _execute_and_wrap(self, function_to_call: Callable,
+                          table_name: Optional[str] = None,
+                          ddb_operation: str = None,
+                          keys: Iterable[DynamoDbItem] = ()):
+        """
+        Calls DynamoDB, handling throttling and recording the call with our accounting.
 
-    def _execute_and_wrap(self, function_to_call: Callable):
+        :param function_to_call: the function that calls the client.
+        :param table_name: the table name, None if the call is for multiple tables.
+        :param ddb_operation: the DynamoDB operation name, i.e. "GetItem".
+        :param keys: the keys of the items involved, used to resolve the virtual table name.
+        :return: the response.
+        """
         start = date_utils.get_system_time_in_millis()
-        resp = self._handle_throttling(function_to_call)
+        resp = None
+        failed = True
+        try:
+            resp = self._handle_throttling(function_to_call, table_name)
+            failed = False
+        finally:
+            stats: ThrottleStats = self.__thread_local.throttle_stats
+            virtual_table_name = self.__accounting.resolve_virtual_table(table_name, keys)
+            self.__accounting.record(ddb_operation, table_name, virtual_table_name,
+                                     date_utils.get_system_time_in_millis() - start,
+                                     resp, stats, failed=failed)
         if resp is not None:
-            self.__thread_local.last_response = DynamoResponse(start, resp, self.__thread_local.throttle_count)
+            self.__thread_local.last_response = DynamoResponse(start, resp, stats.throttle_count,
+                                                               stats.sleep_millis)
         return resp
 
     def find_item(self, table_name: str,
@@ -531,7 +724,19 @@ class DynamoDb:
         if consistent:
             params['ConsistentRead'] = True
 
-        record = self._execute_and_wrap(lambda: self.__client.get_item(**params))
+        params['ReturnConsumedCapacity'] = "TOTAL"
+
+        def fetch():
+            resp = self._execute_and_wrap(lambda: self.__client.get_item(**params), table_name, "GetItem",
+                                          (ddb_keys,))
+            return resp, self.__thread_local.last_response
+
+        if self.__read_flights is None or consistent:
+            record = fetch()[0]
+        else:
+            flight_key = (table_name, _to_flight_key(ddb_keys), tuple(attributes_to_get) if attributes_to_get else None)
+            record, self.__thread_local.last_response = self.__read_flights.call(flight_key, fetch)
+        # Each caller gets its own copy of the item, since the response may be shared
         item = record.get('Item')
         if item is None:
             raise ResourceNotFoundException()
@@ -562,7 +767,8 @@ class DynamoDb:
             _process_condition(condition, params)
 
         try:
-            return self._execute_and_wrap(lambda: self.__client.put_item(**params))
+            return self._execute_and_wrap(lambda: self.__client.put_item(**params), table_name, "PutItem",
+                                          (ddb_item,))
         except PreconditionFailedException as ex:
             if condition is None:
                 raise PrimaryKeyViolationException()
@@ -575,44 +781,23 @@ class DynamoDb:
                     condition: Union[dict, Tuple[str, dict]] = None) -> bool:
         params = {"TableName": table_name,
                   "Key": _to_ddb_item(keys),
-                  "ReturnValues": "ALL_OLD"}
+                  "ReturnValues": "ALL_OLD",
+                  "ReturnConsumedCapacity": "TOTAL"}
         if condition is not None:
             _process_condition(condition, params)
-        resp = self._execute_and_wrap(lambda: self.__client.delete_item(**params))
+        resp = self._execute_and_wrap(lambda: self.__client.delete_item(**params), table_name, "DeleteItem",
+                                      (params['Key'],))
         return resp.get('Attributes') is not None
 
     def delete_items(self, table_name: str,
                      keys: List[Dict[str, Any]]):
-        items = []
-        req = {table_name: items}
-        for key in keys:
-            item = {
-                'DeleteRequest': {
-                    'Key': _to_ddb_item(key)
-                }
-            }
-            items.append(item)
-        self._execute_and_wrap(lambda: self.__client.batch_write_item(RequestItems=req))
+        self.batch_delete_from_table(table_name, keys).raise_if_failed()
 
     def update_item(self, table_name: str,
                     keys: dict,
                     item: DynamoDbRow,
                     condition: Union[dict, Tuple[str, dict]] = None):
-        ddb_item = _to_ddb_item(item)
-        update_expression = None
-        expression_values = {}
-        counter = 1
-        for key, value in ddb_item.items():
-            if key in keys:
-                continue
-            if update_expression is None:
-                update_expression = "SET "
-            else:
-                update_expression += ", "
-            bind_name = f":v{counter}"
-            counter += 1
-            update_expression += f"{key} = {bind_name}"
-            expression_values[bind_name] = value
+        update_expression, expression_values = _build_update_expression(item, keys)
 
         params = {"TableName": table_name,
                   "ReturnConsumedCapacity": "TOTAL",
@@ -627,29 +812,54 @@ class DynamoDb:
 
         _merge_attributes(params, expression_values)
 
-        resp = self._execute_and_wrap(lambda: self.__client.update_item(**params))
+        resp = self._execute_and_wrap(lambda: self.__client.update_item(**params), table_name, "UpdateItem",
+                                      (params['Key'],))
         return resp
 
+    def increment(self, table_name: str,
+                  keys: dict,
+                  attribute_name: str,
+                  amount: int = 1) -> int:
+        """
+        Atomically adds the amount to a numeric attribute, using an ADD update expression. The item, and the
+        attribute, are created if they do not exist (starting at 0).
+
+        :param table_name: the table name.
+        :param keys: the keys for the item.
+        :param attribute_name: the name of the attribute to increment.
+        :param amount: the amount to add.
+        :return: the new value.
+        """
+        params = {"TableName": table_name,
+                  "ReturnConsumedCapacity": "TOTAL",
+                  "ReturnValues": "UPDATED_NEW",
+                  "Key": _to_ddb_item(keys),
+                  "UpdateExpression": f"ADD {attribute_name} :a",
+                  "ExpressionAttributeValues": {':a': {'N': str(amount)}}}
+
+        resp = self._execute_and_wrap(lambda: self.__client.update_item(**params), table_name, "UpdateItem",
+                                      (params['Key'],))
+        return int(from_ddb_item(resp['Attributes'])[attribute_name])
+
     @staticmethod
     def has_attributes(resp: Dict[str, Any]) -> bool:
         return 'Attributes' in resp
 
     def transact_write(self, items: List[TransactionRequest]):
         item_list = list(map(lambda item: item.to_ddb_request(), items))
-        return self._execute_and_wrap(lambda: self.__client.transact_write_items(TransactItems=item_list))
+        table_name = _single_table_name({item.table_name: item for item in items})
+        return self._execute_and_wrap(lambda: self.__client.transact_write_items(TransactItems=item_list,
+                                                                                 ReturnConsumedCapacity="TOTAL"),
+                                      table_name, "TransactWriteItems",
+                                      map(_transaction_item_key, item_list))
 
-    def batch_delete_from_table(self, table_name: str, row_keys: List[DynamoDbRow]):
-        requests = []
-
-        for item in row_keys:
-            requests.append({'DeleteRequest': {'Key': _to_ddb_item(item)}})
-
-        table_requests = {table_name: requests}
-        return self.__process_batch_write(table_requests)
+    def batch_delete_from_table(self, table_name: str, row_keys: List[DynamoDbRow]) -> BatchWriteResult:
+        return self.__bulk_write(row_keys, lambda key: (table_name, {'DeleteRequest': {'Key': _to_ddb_item(key)}}))
 
     def batch_delete(self, table_and_keys: Iterable[TableAndKey],
                      on_submit: Callable[[List[TableAndKey]], None] = None,
-                     on_error: Callable[[BaseException], None] = None):
+                     on_error: Callable[[BaseException], None] = None,
+                     max_threads: int = DEFAULT_MAX_BATCH_THREADS) -> BatchWriteResult:
         """
         Performs a batch delete. If the number of items exceeds 25, then the batch is split into multiple batches
         and submitted in parallel.
@@ -657,78 +867,189 @@ class DynamoDb:
         :param table_and_keys: the list of table and keys to delete.
         :param on_submit: optional caller to call when submitting a batch
         :param on_error: optional caller to call when an error occurs
+        :param max_threads: the max number of threads to use.
+        :return: the result, with an outcome for each key.
         """
 
-        def submit(list_of_keys: List[TableAndKey]):
-            table_requests: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-            for item in list_of_keys:
-                table_requests[item[0]].append({'DeleteRequest': {'Key': _to_ddb_item(item[1])}})
+        def to_request(item: TableAndKey):
+            return item[0], {'DeleteRequest': {'Key': _to_ddb_item(item[1])}}
+
+        result = self.__bulk_write(table_and_keys, to_request, max_threads=max_threads, on_submit=on_submit)
+        errors = []
+        for outcome in result.failures:
+            if outcome.error is not None and outcome.error not in errors:
+                errors.append(outcome.error)
+        for ex in errors:
+            if on_error is not None:
+                on_error(ex)
+            else:
+                print(f"Error deleting batch: {dump_ex(ex)}", file=sys.stderr)
+        return result
 
-            if on_submit is not None:
-                on_submit(list_of_keys)
+    def __bulk_write(self, objects: Iterable[Any],
+                     to_request: Callable[[Any], Tuple[str, Dict[str, Any]]],
+                     max_threads: int = DEFAULT_MAX_BATCH_THREADS,
+                     on_submit: Callable[[List[Any]], None] = None) -> BatchWriteResult:
+        """
+        The pipeline used for all batch writes. Splits the objects into MAX_BATCH_WRITE_ITEMS sized batches and
+        submits them in parallel, retrying unprocessed items with backoff.
+
+        :param objects: the source objects.
+        :param to_request: used to convert a source object to its table name and batch write request.
+        :param max_threads: the max number of threads to use.
+        :param on_submit: optional caller to call with the source objects for each batch.
+        :return: the result, with an outcome for each source object.
+        """
+
+        def to_outcome(source: Any) -> BatchWriteOutcome:
+            table_name, request = to_request(source)
+            return BatchWriteOutcome(source, table_name, request)
 
+        outcomes = list(map(to_outcome, objects))
+        if len(outcomes) == 0:
+            return BatchWriteResult(outcomes, 0)
+        batches = collection_utils.partition(outcomes, MAX_BATCH_WRITE_ITEMS)
+
+        def submit(batch: List[BatchWriteOutcome]) -> int:
+            if on_submit is not None:
+                on_submit(list(map(lambda o: o.source, batch)))
             try:
-                self.__process_batch_write(table_requests)
+                return self.__process_batch_write(batch)
             except BaseException as ex:
-                if on_error is not None:
-                    on_error(ex)
-                else:
-                    print(f"Error deleting batch {list_of_keys}: {dump_ex(ex)}", file=sys.stderr)
+                for o in batch:
+                    if not o.processed:
+                        o.error = ex
+                return 1
 
-        threading_utils.submit_blocks_in_parallel(
-            table_and_keys,
-            25,
-            25,
-            submit
-        )
+        iterations = threading_utils.map_in_parallel(batches, max_threads, dynamodb_accounting.bind(submit))
+        return BatchWriteResult(outcomes, sum(iterations))
 
-    def __process_batch_write(self, table_requests: Dict[str, List[Dict[str, Any]]]) -> int:
+    def __process_batch_write(self, batch: List[BatchWriteOutcome]) -> int:
+        pending = batch
         count = 0
-        while len(table_requests) > 0:
-            resp = self._execute_and_wrap(lambda: self.__client.batch_write_item(RequestItems=table_requests))
-            table_requests = resp['UnprocessedItems']
+        delay = 0
+        while len(pending) > 0 and count < MAX_BATCH_WRITE_ATTEMPTS:
+            if count > 0:
+                delay = self.__throttler.backoff(delay)
+            table_requests: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+            for outcome in pending:
+                table_requests[outcome.table_name].append(outcome.request)
+            resp = self._execute_and_wrap(lambda: self.__client.batch_write_item(RequestItems=table_requests,
+                                                                                 ReturnConsumedCapacity="TOTAL"),
+                                          _single_table_name(table_requests), "BatchWriteItem",
+                                          map(lambda o: _batch_write_item_key(o.request), pending))
             count += 1
+            unprocessed: Dict[str, List[Dict[str, Any]]] = resp.get('UnprocessedItems') or {}
+            still_pending = []
+            for outcome in pending:
+                if outcome.request in unprocessed.get(outcome.table_name, ()):
+                    still_pending.append(outcome)
+                else:
+                    outcome.processed = True
+            pending = still_pending
         return count
 
-    def batch_write(self, items: List[BatchCapableRequest]):
+    def batch_write(self, items: Iterable[BatchCapableRequest],
+                    max_threads: int = DEFAULT_MAX_BATCH_THREADS) -> BatchWriteResult:
+        """
+        Performs a batch write. Any number of items is allowed, they are split into batches of 25 which are
+        submitted in parallel.
+
+        :param items: the BatchCapableRequest items to write.
+        :param max_threads: the max number of threads to use.
+        :return: the result, with an outcome for each item.
+        :raises UnprocessedItemsException: if any items could not be written.
         """
-        Performs a batch write.
+        result = self.try_batch_write(items, max_threads=max_threads)
+        result.raise_if_failed()
+        return result
+
+    def try_batch_write(self, items: Iterable[BatchCapableRequest],
+                        max_threads: int = DEFAULT_MAX_BATCH_THREADS) -> BatchWriteResult:
+        """
+        Same as batch_write(), except failures are returned in the result instead of being raised.
+
+        :param items: the BatchCapableRequest items to write.
+        :param max_threads: the max number of threads to use.
+        :return: the result, with an outcome for each item.
+        """
+        return self.__bulk_write(items, lambda item: (item.table_name, item.to_ddb_batch_request()),
+                                 max_threads=max_threads)
+
+    def batch_get(self, requests: List[GetItemRequest],
+                  max_threads: int = DEFAULT_MAX_BATCH_THREADS) -> Dict[str, List[DynamoDbRow]]:
+        """
+        Performs a batch get. Requests with more than MAX_BATCH_GET_KEYS keys are split into chunks, which are
+        submitted in parallel.
 
-        :param items: the list of BatchCapableRequest items to write.
-        :return: the number of iterations required to perform the batch write
-        (due to 'unprocessed items' being returned)
+        :param requests: the get requests.
+        :param max_threads: the max number of threads to use when there are multiple chunks.
+        :return: the rows found, by table name.
         """
-        table_requests: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-        for item in items:
-            table_requests[item.table_name].append(item.to_ddb_batch_request())
+        chunks = collection_utils.partition(requests, MAX_BATCH_GET_KEYS)
+        if len(chunks) == 1:
+            return self.__batch_get_chunk(chunks[0])
 
-        return self.__process_batch_write(table_requests)
+        results = {}
+        for chunk_results in threading_utils.map_in_parallel(chunks, max_threads,
+                                                             dynamodb_accounting.bind(self.__batch_get_chunk)):
+            for table_name, rows in chunk_results.items():
+                get_or_create(results, table_name, list).extend(rows)
+        return results
 
-    def batch_get(self, requests: List[GetItemRequest]) -> Dict[str, List[DynamoDbRow]]:
-        table_requests: Dict[str, Dict[str, Any]] = {}
+    def __batch_get_chunk(self, requests: List[GetItemRequest]) -> Dict[str, List[DynamoDbRow]]:
+        # A projection applies to every key requested for a table, so keys for the same table with different
+        # projections go in separate RequestItems, which are submitted in parallel.
+        groups: Dict[Tuple[str, Optional[Tuple[str, ...]]], Dict[str, Any]] = {}
         for request in requests:
-            table_request: Dict[str, Any] = get_or_create(table_requests, request.table_name, dict)
+            projection = tuple(request.attributes_to_get) if request.attributes_to_get is not None else None
+            table_request: Dict[str, Any] = get_or_create(groups, (request.table_name, projection), dict)
             keys: List[Dict[str, Any]] = get_or_create(table_request, 'Keys', list)
             keys.append(request.ddb_keys)
             if request.consistent:
                 table_request['ConsistentRead'] = True
-            if request.attributes_to_get is not None:
-                table_request['ProjectionExpression'] = ",".join(request.attributes_to_get)
+            if projection is not None:
+                table_request['ProjectionExpression'] = ",".join(projection)
+
+        request_items_list: List[Dict[str, Dict[str, Any]]] = []
+        for (table_name, _), table_request in groups.items():
+            request_items = next((r for r in request_items_list if table_name not in r), None)
+            if request_items is None:
+                request_items = {}
+                request_items_list.append(request_items)
+            request_items[table_name] = table_request
+
+        if len(request_items_list) <= 1:
+            return self.__batch_get_items(request_items_list[0]) if len(request_items_list) == 1 else {}
 
         results = {}
+        for items_results in threading_utils.map_in_parallel(request_items_list, len(request_items_list),
+                                                             dynamodb_accounting.bind(self.__batch_get_items)):
+            for table_name, rows in items_results.items():
+                get_or_create(results, table_name, list).extend(rows)
+        return results
+
+    def __batch_get_items(self, table_requests: Dict[str, Dict[str, Any]]) -> Dict[str, List[DynamoDbRow]]:
+        results = {}
+        delay = 0
         while len(table_requests) > 0:
-            resp = self._execute_and_wrap(lambda: self.__client.batch_get_item(RequestItems=table_requests))
+            resp = self._execute_and_wrap(lambda: self.__client.batch_get_item(RequestItems=table_requests,
+                                                                               ReturnConsumedCapacity="TOTAL"),
+                                          _single_table_name(table_requests), "BatchGetItem",
+                                          (key for r in table_requests.values() for key in r['Keys']))
             responses: Dict[str, List[DynamoDbItem]] = resp['Responses']
             for table_name, row_items in responses.items():
                 rows: List[DynamoDbRow] = get_or_create(results, table_name, list)
                 rows.extend(map(lambda m: from_ddb_item(m), row_items))
             table_requests = resp['UnprocessedKeys']
+            if len(table_requests) > 0:
+                delay = self.__throttler.backoff(delay)
 
         return results
 
-    def scan(self, table_name: str, select_attributes: str = None):
+    def scan(self, table_name: str, select_attributes: str = None, prefetch: int = 0):
 
-        props = {'TableName': table_name}
+        props = {'TableName': table_name, 'ReturnConsumedCapacity': "TOTAL"}
         if select_attributes is None:
             props['Select'] = "ALL_ATTRIBUTES"
         else:
@@ -736,13 +1057,70 @@ class DynamoDb:
 
         def query_function(next_key: dict):
             if next_key is None:
-                response = self.__client.scan(**props)
+                response = self._execute_and_wrap(lambda: self.__client.scan(**props), table_name, "Scan")
             else:
-                response = self.__client.scan(ExclusiveStartKey=next_key, **props)
+                response = self._execute_and_wrap(lambda: self.__client.scan(ExclusiveStartKey=next_key, **props),
+                                                  table_name, "Scan")
             items = response["Items"]
             return items, response.get("LastEvaluatedKey"), response.get('Count')
 
-        return ResultSet(query_function)
+        return ResultSet(dynamodb_accounting.bind(query_function), prefetch)
+
+    def parallel_scan(self, table_name: str,
+                      total_segments: int,
+                      select_attributes: str = None,
+                      filter_operations: Union[FilterOperation, Collection[FilterOperation]] = None,
+                      max_threads: int = None,
+                      max_queued_pages: int = DEFAULT_MAX_QUEUED_SCAN_PAGES,
+                      page_size: int = None) -> 'ParallelScanResultSet':
+        """
+        Scans the table using multiple segments in parallel.
+
+        Pages are handed to the caller as they arrive, in no particular order. At most max_queued_pages are held
+        before the scanning threads block, so a slow consumer does not cause the whole table to be buffered.
+
+        :param table_name: the table name.
+        :param total_segments: the number of segments to split the table into.
+        :param select_attributes: optional projection expression.
+        :param filter_operations: optional filter(s).
+        :param max_threads: the max number of threads to scan with, defaults to total_segments (capped).
+        :param max_queued_pages: the max number of pages to hold before blocking.
+        :param page_size: optional limit for the number of items evaluated per page.
+        :return: the result set. next_key cannot be used to resume a parallel scan.
+        """
+        assert total_segments > 0
+        assert max_queued_pages > 0
+        props = {'TableName': table_name, 'TotalSegments': total_segments, 'ReturnConsumedCapacity': "TOTAL"}
+        if select_attributes is None:
+            props['Select'] = "ALL_ATTRIBUTES"
+        else:
+            props["ProjectionExpression"] = select_attributes
+
+        if filter_operations is not None:
+            expression_atts = {}
+            expression_attribute_names = {}
+            props['FilterExpression'] = _build_filter_expression(filter_operations, expression_atts,
+                                                                 expression_attribute_names)
+            if len(expression_atts) > 0:
+                props['ExpressionAttributeValues'] = expression_atts
+            if len(expression_attribute_names) > 0:
+                props['ExpressionAttributeNames'] = expression_attribute_names
+
+        if page_size is not None:
+            props['Limit'] = page_size
+
+        if max_threads is None:
+            max_threads = min(total_segments, DEFAULT_MAX_SCAN_THREADS)
+
+        def scan_segment(params: Dict[str, Any]):
+            return self._execute_and_wrap(lambda: self.__client.scan(**params), table_name, "Scan")
+
+        scanner = _ParallelScanner(dynamodb_accounting.bind(scan_segment),
+                                   props,
+                                   total_segments,
+                                   min(max_threads, total_segments),
+                                   max_queued_pages)
+        return ParallelScanResultSet(scanner)
 
     def query(self, table_name: str,
               partition_key_attribute: str,
@@ -753,8 +1131,9 @@ class DynamoDb:
               last_evaluated_key: Any = None,
               consistent: bool = False,
               filter_operations: Union[FilterOperation, Collection[FilterOperation]] = None,
-              count_only: bool = False) -> 'ResultSet':
-        props = {'TableName': table_name}
+              count_only: bool = False,
+              prefetch: int = 0) -> 'ResultSet':
+        props = {'TableName': table_name, 'ReturnConsumedCapacity': "TOTAL"}
         if select_attributes is None:
             props['Select'] = "ALL_ATTRIBUTES" if not count_only else "COUNT"
         else:
@@ -771,6 +1150,7 @@ class DynamoDb:
             expression_atts[':rangeval'] = _to_attribute_value_dict(range_key_qualifier.value)
 
         props['KeyConditionExpression'] = stmt
+        partition_key = {partition_key_attribute: expression_atts[':keyval']}
 
         expression_attribute_names = {}
         if filter_operations is not None:
@@ -794,20 +1174,79 @@ class DynamoDb:
                 props['Limit'] = limit
 
             if next_key is None:
-                response = self.__client.query(**props)
+                response = self._execute_and_wrap(lambda: self.__client.query(**props), table_name, "Query",
+                                                  (partition_key,))
             else:
-                response = self.__client.query(ExclusiveStartKey=next_key, **props)
+                response = self._execute_and_wrap(lambda: self.__client.query(ExclusiveStartKey=next_key, **props),
+                                                  table_name, "Query", (partition_key,))
             items = response.get("Items", [])
             if limit is not None:
                 limit -= len(items)
 
             return items, response.get("LastEvaluatedKey"), response.get('Count')
 
-        return ResultSet(query_function)
+        return ResultSet(dynamodb_accounting.bind(query_function), prefetch)
+
+
+class _PageReader:
+    """
+    Reads pages ahead of the caller on a background thread.
+    """
+
+    def __init__(self, query_function: Callable[[Any], Tuple[List[DynamoDbItem], Any, int]], depth: int):
+        self.__query_function = query_function
+        self.__pages = Queue(maxsize=depth)
+        self.__thread: Optional[threading.Thread] = None
+        self.__closed = False
+
+    def __put(self, entry: Any):
+        while not self.__closed:
+            try:
+                self.__pages.put(entry, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def __reader(self, next_key: Any):
+        while not self.__closed:
+            try:
+                page = self.__query_function(next_key)
+            except BaseException as ex:
+                # This includes StopIteration
+                self.__put(ex)
+                return
+            self.__put(page)
+            next_key = page[1]
+            if next_key is None:
+                return
+
+    def read(self, next_key: Any) -> Tuple[List[DynamoDbItem], Any, int]:
+        if self.__thread is None:
+            self.__thread = threading_utils.start_thread(lambda: self.__reader(next_key), name="page-reader")
+        entry = self.__pages.get()
+        if isinstance(entry, BaseException):
+            raise entry
+        return entry
+
+    def close(self):
+        self.__closed = True
+
+    def join(self, timeout: float = None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
 
 
 class ResultSet:
-    def __init__(self, query_function):
+    def __init__(self, query_function, prefetch: int = 0):
+        """
+        :param query_function: function used to query a page.
+        :param prefetch: the number of pages to read ahead on a background thread, 0 to disable.
+        """
+        if prefetch > 0:
+            self.__reader = _PageReader(query_function, prefetch)
+            query_function = self.__reader.read
+        else:
+            self.__reader = None
         self.__query_function = query_function
         self.__next_key = None
         self.__items = None
@@ -815,6 +1254,16 @@ class ResultSet:
         self.__done = False
         self.__count_returned = None
 
+    def close(self):
+        """
+        Stops reading ahead, should be called if prefetching and the result set is not fully consumed.
+        """
+        if self.__reader is not None:
+            self.__reader.close()
+
+    def __del__(self):
+        self.close()
+
     @property
     def count_returned(self):
         return self.__count_returned
@@ -858,3 +1307,96 @@ class ResultSet:
         item = from_ddb_item(self.__items[self.__counter])
         self.__counter += 1
         return item
+
+
+class _ParallelScanner:
+    def __init__(self, scan_function: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 props: Dict[str, Any],
+                 total_segments: int,
+                 max_threads: int,
+                 max_queued_pages: int):
+        self.__scan_function = scan_function
+        self.__props = props
+        self.__remaining = total_segments
+        self.__segments = Queue()
+        for segment in range(total_segments):
+            self.__segments.put(segment)
+        self.__pages = Queue(maxsize=max_queued_pages)
+        self.__closed = False
+        self.__threads = [threading_utils.start_thread(self.__worker, name=f"scan-{i}") for i in range(max_threads)]
+
+    def __put(self, entry: Any):
+        while not self.__closed:
+            try:
+                self.__pages.put(entry, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def __scan_segment(self, segment: int):
+        next_key = None
+        while not self.__closed:
+            params = dict(self.__props)
+            params['Segment'] = segment
+            if next_key is not None:
+                params['ExclusiveStartKey'] = next_key
+            response = self.__scan_function(params)
+            next_key = response.get('LastEvaluatedKey')
+            items = response.get('Items', [])
+            if len(items) > 0:
+                self.__put((items, response.get('Count')))
+            if next_key is None:
+                break
+
+    def __worker(self):
+        while not self.__closed:
+            try:
+                segment = self.__segments.get_nowait()
+            except Empty:
+                return
+            try:
+                self.__scan_segment(segment)
+            except BaseException as ex:
+                self.__put(ex)
+                return
+            # None signals the segment is done
+            self.__put(None)
+
+    def next_page(self, next_key: Any) -> Tuple[List[DynamoDbItem], Any, int]:
+        while self.__remaining > 0:
+            entry = self.__pages.get()
+            if entry is None:
+                self.__remaining -= 1
+                continue
+            if isinstance(entry, BaseException):
+                self.close()
+                raise entry
+            items, count = entry
+            # The returned key only signals there may be more pages, it cannot be used to resume the scan
+            return items, {'remainingSegments': self.__remaining}, count
+        raise StopIteration()
+
+    def close(self):
+        self.__closed = True
+
+    def join(self, timeout: float = None):
+        for t in self.__threads:
+            t.join(timeout)
+
+
+class ParallelScanResultSet(ResultSet):
+    def __init__(self, scanner: _ParallelScanner):
+        super(ParallelScanResultSet, self).__init__(scanner.next_page)
+        self.__scanner = scanner
+
+    def close(self):
+        """
+        Stops the scanning threads, required when the result set is not fully consumed.
+        """
+        self.__scanner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,313 @@
+import functools
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import RLock
+from typing import Any, Callable, Dict, Optional, Tuple, Iterable, List, Union
+
+from aws.dynamodb_throttling import ThrottleStats
+
+#
+# Upper bounds for the latency histogram buckets, in milliseconds. Anything slower goes into the last bucket.
+#
+LATENCY_BUCKETS_MILLIS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+#
+# Used as the logical operation name for calls made outside any operation() block
+#
+NO_OPERATION = "-"
+
+# Operations whose consumed capacity is reported as read capacity when DynamoDB only returns CapacityUnits
+_READ_OPERATIONS = frozenset(("GetItem", "BatchGetItem", "Query", "Scan", "TransactGetItems"))
+
+# Given the table name and the key (DynamoDB format) of an item, returns the virtual table name, if any
+VirtualTableResolver = Callable[[str, Dict[str, Any]], Optional[str]]
+
+# Logical operation, DynamoDB operation, table name, virtual table name
+StatsKey = Tuple[str, str, Optional[str], Optional[str]]
+
+# Logical operation, call site, read consistency
+ReadStatsKey = Tuple[str, str, str]
+
+_local = threading.local()
+
+
+def current_operation() -> str:
+    """
+    :return: the name of the logical operation the current thread is running, or NO_OPERATION.
+    """
+    return getattr(_local, 'operation', NO_OPERATION)
+
+
+@contextmanager
+def operation(name: str):
+    """
+    Attributes all DynamoDB calls made by the current thread inside the block to the given logical operation, i.e.
+    "create_session". Operations can be nested, the innermost one wins.
+    """
+    previous = current_operation()
+    _local.operation = name
+    try:
+        yield
+    finally:
+        _local.operation = previous
+
+
+def accounted(name: str):
+    """
+    Decorator that runs the function inside operation(name).
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with operation(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bind(function: Callable) -> Callable:
+    """
+    Binds the function to the current logical operation, so calls it makes from other threads (i.e. batch or
+    page reader threads) are attributed to the operation that started them.
+    """
+    name = current_operation()
+
+    def wrapper(*args, **kwargs):
+        with operation(name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+class LatencyHistogram:
+    def __init__(self, bounds: Tuple[int, ...] = LATENCY_BUCKETS_MILLIS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_millis = 0
+        self.max_millis = 0
+
+    def add(self, millis: int):
+        self.counts[bisect_left(self.bounds, millis)] += 1
+        self.count += 1
+        self.total_millis += millis
+        if millis > self.max_millis:
+            self.max_millis = millis
+
+    def to_record(self) -> Dict[str, Any]:
+        buckets = {}
+        for index, count in enumerate(self.counts):
+            if count > 0:
+                if index < len(self.bounds):
+                    buckets[f"<={self.bounds[index]}"] = count
+                else:
+                    buckets[f">{self.bounds[-1]}"] = count
+        return {
+            'count': self.count,
+            'totalMillis': self.total_millis,
+            'maxMillis': self.max_millis,
+            'buckets': buckets
+        }
+
+
+class OperationStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.read_capacity_units = 0.0
+        self.write_capacity_units = 0.0
+        self.throttles = 0
+        self.retries = 0
+        self.latency = LatencyHistogram()
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'readCapacityUnits': self.read_capacity_units,
+            'writeCapacityUnits': self.write_capacity_units,
+            'throttles': self.throttles,
+            'retries': self.retries,
+            'latency': self.latency.to_record()
+        }
+
+
+class ReadStats:
+    """
+    Counts the reads made through a repo consistency policy. Stale reads are the ones that had to be read again
+    with a consistent read.
+    """
+
+    def __init__(self):
+        self.reads = 0
+        self.stale_reads = 0
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            'reads': self.reads,
+            'staleReads': self.stale_reads
+        }
+
+
+def _parse_capacity(ddb_operation: str,
+                    consumed: Union[None, Dict[str, Any], List[Dict[str, Any]]]) -> Tuple[float, float]:
+    if consumed is None:
+        return 0.0, 0.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    read_units = 0.0
+    write_units = 0.0
+    for entry in consumed:
+        if 'ReadCapacityUnits' in entry or 'WriteCapacityUnits' in entry:
+            read_units += entry.get('ReadCapacityUnits', 0.0)
+            write_units += entry.get('WriteCapacityUnits', 0.0)
+        elif ddb_operation in _READ_OPERATIONS:
+            read_units += entry.get('CapacityUnits', 0.0)
+        else:
+            write_units += entry.get('CapacityUnits', 0.0)
+    return read_units, write_units
+
+
+class DynamoDbAccounting:
+    """
+    Aggregates DynamoDB usage by logical operation, DynamoDB operation and table. Meant to be reset per Lambda
+    invocation, see summarize().
+    """
+
+    def __init__(self, virtual_table_resolver: VirtualTableResolver = None):
+        self.__virtual_table_resolver = virtual_table_resolver
+        self.__stats: Dict[StatsKey, OperationStats] = {}
+        self.__read_stats: Dict[ReadStatsKey, ReadStats] = {}
+        self.__mutex = RLock()
+
+    def resolve_virtual_table(self, table_name: Optional[str], keys: Iterable[Dict[str, Any]]) -> Optional[str]:
+        """
+        Resolves the virtual table name for the given keys.
+
+        :param table_name: the table name.
+        :param keys: the keys, in DynamoDB format.
+        :return: the virtual table name, or None if there is none or the keys are for more than one.
+        """
+        resolver = self.__virtual_table_resolver
+        if resolver is None or table_name is None:
+            return None
+        result = None
+        for key in keys:
+            name = resolver(table_name, key)
+            if name is None or (result is not None and name != result):
+                return None
+            result = name
+        return result
+
+    def record(self, ddb_operation: str,
+               table_name: Optional[str],
+               virtual_table_name: Optional[str],
+               elapsed_millis: int,
+               response: Optional[Dict[str, Any]],
+               throttle_stats: Optional[ThrottleStats],
+               failed: bool = False):
+        read_units, write_units = _parse_capacity(ddb_operation,
+                                                  response.get('ConsumedCapacity') if response is not None else None)
+        retries = 0
+        if response is not None:
+            retries += response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        key = (current_operation(), ddb_operation, table_name, virtual_table_name)
+        with self.__mutex:
+            stats = self.__stats.get(key)
+            if stats is None:
+                stats = self.__stats[key] = OperationStats()
+            stats.calls += 1
+            if failed:
+                stats.errors += 1
+            stats.read_capacity_units += read_units
+            stats.write_capacity_units += write_units
+            if throttle_stats is not None:
+                stats.throttles += throttle_stats.throttle_count
+                retries += max(throttle_stats.attempts - 1, 0)
+            stats.retries += retries
+            stats.latency.add(elapsed_millis)
+
+    def record_read(self, call_site: str, consistency: str, stale: bool = False):
+        """
+        Records a read made through a repo consistency policy. The capacity is recorded with the DynamoDB calls.
+
+        :param call_site: the call site.
+        :param consistency: the read consistency used.
+        :param stale: True if the item had to be read again with a consistent read.
+        """
+        key = (current_operation(), call_site, consistency)
+        with self.__mutex:
+            stats = self.__read_stats.get(key)
+            if stats is None:
+                stats = self.__read_stats[key] = ReadStats()
+            stats.reads += 1
+            if stale:
+                stats.stale_reads += 1
+
+    def get_stats(self) -> Dict[StatsKey, OperationStats]:
+        with self.__mutex:
+            return dict(self.__stats)
+
+    def get_read_stats(self) -> Dict[ReadStatsKey, ReadStats]:
+        with self.__mutex:
+            return dict(self.__read_stats)
+
+    def reset(self):
+        with self.__mutex:
+            self.__stats = {}
+            self.__read_stats = {}
+
+    def summarize(self, reset: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Builds a summary of the usage recorded so far.
+
+        :param reset: True to reset the stats afterwards.
+        :return: the summary, or None if no calls were recorded.
+        """
+        with self.__mutex:
+            stats = self.__stats
+            read_stats = self.__read_stats
+            if reset:
+                self.__stats = {}
+                self.__read_stats = {}
+        if len(stats) == 0:
+            return None
+
+        totals = OperationStats()
+        operations = []
+        for (logical_operation, ddb_operation, table_name, virtual_table_name), s in stats.items():
+            totals.calls += s.calls
+            totals.errors += s.errors
+            totals.read_capacity_units += s.read_capacity_units
+            totals.write_capacity_units += s.write_capacity_units
+            totals.throttles += s.throttles
+            totals.retries += s.retries
+            record = {
+                'logicalOperation': logical_operation,
+                'operation': ddb_operation,
+                'table': table_name
+            }
+            if virtual_table_name is not None:
+                record['virtualTable'] = virtual_table_name
+            record.update(s.to_record())
+            operations.append(record)
+
+        summary = totals.to_record()
+        del summary['latency']
+        summary['operations'] = operations
+        if len(read_stats) > 0:
+            reads = []
+            for (logical_operation, call_site, consistency), s in read_stats.items():
+                record = {
+                    'logicalOperation': logical_operation,
+                    'callSite': call_site,
+                    'consistency': consistency
+                }
+                record.update(s.to_record())
+                reads.append(record)
+            summary['reads'] = reads
+        return summary
@@ -0,0 +1,125 @@
+from threading import RLock
+from typing import Any, Callable, Dict, Tuple, Optional
+
+from utils import code_utils
+
+#
+# Max number of record shapes to compile per codec. Once exceeded, new shapes go through the generic functions.
+#
+DEFAULT_MAX_SHAPES = 256
+
+Encoder = Callable[[Dict[str, Any]], Dict[str, Any]]
+Decoder = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+# Fast path expressions for encoding a python value of the given type, the value is in 'v'
+_ENCODE_EXPRESSIONS = {
+    str: "{'S': v} if type(v) is str",
+    bool: "{'BOOL': v} if type(v) is bool",
+    int: "{'N': str(v)} if type(v) is int",
+    float: "{'N': str(v)} if type(v) is float",
+    bytes: "{'B': v} if type(v) is bytes",
+    type(None): "{'NULL': True} if v is None"
+}
+
+# Fast path expressions for decoding an attribute value of the given type, the raw value is in 'x'
+_DECODE_EXPRESSIONS = {
+    "S": "x",
+    "BOOL": "x",
+    "B": "x",
+    "N": "(float(x) if '.' in x else int(x))"
+}
+
+
+def _compile_encoder(sample: Dict[str, Any], generic: Callable[[Any], Any]) -> Encoder:
+    lines = ["def encode(row, _generic=_generic):"]
+    for index, (name, value) in enumerate(sample.items()):
+        lines.append(f"    v = row[{name!r}]")
+        fast = _ENCODE_EXPRESSIONS.get(type(value))
+        if fast is None:
+            lines.append(f"    a{index} = _generic(v)")
+        else:
+            lines.append(f"    a{index} = {fast} else _generic(v)")
+    fields = ", ".join(f"{name!r}: a{index}" for index, name in enumerate(sample))
+    lines.append(f"    return {{{fields}}}")
+    return _compile("\n".join(lines), "encode", generic)
+
+
+def _compile_decoder(sample: Dict[str, Any], generic: Callable[[Any], Any]) -> Decoder:
+    lines = ["def decode(item, _generic=_generic):"]
+    for index, (name, value) in enumerate(sample.items()):
+        lines.append(f"    v = item[{name!r}]")
+        att_type = next(iter(value)) if len(value) == 1 else None
+        fast = _DECODE_EXPRESSIONS.get(att_type)
+        if fast is None:
+            lines.append(f"    a{index} = _generic(v)")
+        else:
+            lines.append(f"    x = v.get({att_type!r})")
+            lines.append(f"    a{index} = {fast} if x is not None else _generic(v)")
+    fields = ", ".join(f"{name!r}: a{index}" for index, name in enumerate(sample))
+    lines.append(f"    return {{{fields}}}")
+    return _compile("\n".join(lines), "decode", generic)
+
+
+def _compile(code: str, function_name: str, generic: Callable[[Any], Any]) -> Callable:
+    # The generic function is bound through the default argument, so the compiled function only uses locals
+    return code_utils.execute_code(code, _generic=generic)[function_name]
+
+
+class _ShapeCache:
+    def __init__(self, compiler: Callable[[Dict[str, Any], Callable[[Any], Any]], Callable],
+                 generic: Callable[[Any], Any],
+                 max_shapes: int):
+        self.compiler = compiler
+        self.generic = generic
+        self.max_shapes = max_shapes
+        self.functions: Dict[Tuple[str, ...], Callable] = {}
+        self.mutex = RLock()
+
+    def get(self, record: Dict[str, Any]) -> Optional[Callable]:
+        shape = tuple(record)
+        f = self.functions.get(shape)
+        if f is None:
+            with self.mutex:
+                f = self.functions.get(shape)
+                if f is None:
+                    if len(self.functions) >= self.max_shapes:
+                        return None
+                    f = self.functions[shape] = self.compiler(record, self.generic)
+        return f
+
+
+class ItemCodec:
+    """
+    Converts between python records and DynamoDB items.
+
+    An encoder/decoder is compiled for each record shape (i.e. the attribute names, in order) the first time it is
+    seen, with the attribute types of that first record used for the fast paths. Values that do not match the fast
+    path types, nested maps and lists, and shapes beyond max_shapes all go through the generic functions.
+    """
+
+    def __init__(self,
+                 generic_encoder: Callable[[Any], Dict[str, Any]],
+                 generic_decoder: Callable[[Dict[str, Any]], Any],
+                 max_shapes: int = DEFAULT_MAX_SHAPES):
+        self.__generic_encoder = generic_encoder
+        self.__generic_decoder = generic_decoder
+        self.__encoders = _ShapeCache(_compile_encoder, generic_encoder, max_shapes)
+        self.__decoders = _ShapeCache(_compile_decoder, generic_decoder, max_shapes)
+
+    @property
+    def shape_count(self) -> int:
+        return len(self.__encoders.functions) + len(self.__decoders.functions)
+
+    def encode(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        encoder = self.__encoders.get(row)
+        if encoder is None:
+            generic = self.__generic_encoder
+            return {key: generic(value) for key, value in row.items()}
+        return encoder(row)
+
+    def decode(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        decoder = self.__decoders.get(item)
+        if decoder is None:
+            generic = self.__generic_decoder
+            return {key: generic(value) for key, value in item.items()}
+        return decoder(item)
@@ -0,0 +1,75 @@
+from functools import lru_cache
+from typing import Tuple, Optional
+
+#
+# Max number of templates to cache for each kind of expression
+#
+DEFAULT_CACHE_SIZE = 512
+
+# The expression, and the bind names in the same order as the attribute names used to build it
+ExpressionTemplate = Tuple[str, Tuple[str, ...]]
+
+# The expression, and for each filter the value and attribute name bind names (None for attribute_not_exists)
+FilterTemplate = Tuple[str, Tuple[Optional[Tuple[str, str]], ...]]
+
+
+@lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def update_template(names: Tuple[str, ...]) -> Optional[ExpressionTemplate]:
+    """
+    Builds a SET update expression, i.e. "SET a = :v1, b = :v2".
+
+    :param names: the names of the attributes to set.
+    :return: the template, or None if there are no attributes.
+    """
+    if len(names) == 0:
+        return None
+    bind_names = tuple(f":v{counter}" for counter in range(1, len(names) + 1))
+    expression = "SET " + ", ".join(f"{name} = {bind_name}" for name, bind_name in zip(names, bind_names))
+    return expression, bind_names
+
+
+@lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def equals_template(names: Tuple[str, ...], prefix: str, start: int) -> ExpressionTemplate:
+    """
+    Builds an equality condition, i.e. "a = :c1 AND b = :c2".
+
+    :param names: the attribute names.
+    :param prefix: the bind name prefix, i.e. ":c".
+    :param start: the number to start the bind names with.
+    :return: the template.
+    """
+    bind_names = tuple(f"{prefix}{counter}" for counter in range(start, start + len(names)))
+    expression = " AND ".join(f"{name} = {bind_name}" for name, bind_name in zip(names, bind_names))
+    return expression, bind_names
+
+
+@lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def exists_template(names: Tuple[str, ...]) -> str:
+    """
+    Builds an attribute_exists condition for each of the given attribute names.
+    """
+    return " AND ".join(f"attribute_exists({name})" for name in names)
+
+
+@lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def filter_template(filters: Tuple[Tuple[str, str], ...]) -> FilterTemplate:
+    """
+    Builds a filter expression.
+
+    :param filters: tuples of attribute name and operation. '!exists' is used for attribute_not_exists.
+    :return: the template.
+    """
+    parts = []
+    binds = []
+    counter = 1
+    for name, operation in filters:
+        if operation == '!exists':
+            parts.append(f"attribute_not_exists({name})")
+            binds.append(None)
+        else:
+            key = f":f{counter}"
+            att_name_key = f"#e{counter}"
+            parts.append(f"{att_name_key} {operation} {key}")
+            binds.append((key, att_name_key))
+            counter += 1
+    return " AND ".join(parts), tuple(binds)
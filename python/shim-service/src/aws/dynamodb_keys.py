@@ -1,7 +1,7 @@
 import abc
 from collections import namedtuple
 from enum import Enum
-from typing import Dict, Type, Any, Tuple, Optional, Callable, Union, List
+from typing import Dict, Type, Any, Tuple, Optional, Callable, Union, List, Iterable
 
 from aws.dynamodb import DynamoDbRow
 from utils import collection_utils
@@ -208,11 +208,12 @@ class CompositeKey:
 
         args_holder.value = args[index::]
 
-    def prep_for_deserialization(self, item: Dict[str, Any]):
+    def prep_for_deserialization(self, item: Dict[str, Any], include_injected: bool = False):
         """
         Reconstructs an item from the values in the key.
 
         :param item: the item.
+        :param include_injected: True to include the injected attribute in the item.
         """
         key = item.pop(self.attribute_name)
         values = key.split(self.delimiter)
@@ -220,7 +221,9 @@ class CompositeKey:
 
         # Skip the injected attribute?
         if self.injected is not None:
-            next(it)
+            v = next(it)
+            if include_injected:
+                item[self.injected.name] = v
         for attribute, part in self.original_parts.items():
             v: str = next(it)
             item[attribute] = part.extract(v)
@@ -251,9 +254,21 @@ class Key:
         if self.composite_key is not None:
             self.composite_key.prep_for_serialization(item)
 
-    def prep_for_deserialization(self, item: DynamoDbRow):
+    def prep_for_deserialization(self, item: DynamoDbRow, include_injected: bool = False):
         if self.composite_key is not None:
-            self.composite_key.prep_for_deserialization(item)
+            self.composite_key.prep_for_deserialization(item, include_injected)
+
+    def map_attribute(self, attribute_name: str) -> str:
+        """
+        Maps the given attribute name to the name it is stored under. Attributes that are part of a composite key
+        (including the injected one) are stored in the key itself.
+
+        :param attribute_name: the attribute name.
+        :return: the stored attribute name.
+        """
+        if self.composite_key is not None and attribute_name in self.composite_key.parts:
+            return self.attribute_name
+        return attribute_name
 
 
 class _KeyType(Enum):
@@ -350,9 +365,27 @@ class CompoundKey:
         for key in self.keys:
             key.prep_for_serialization(item)
 
-    def prep_for_deserialization(self, item: DynamoDbRow):
+    def prep_for_deserialization(self, item: DynamoDbRow, include_injected: bool = False):
         for key in self.keys:
-            key.prep_for_deserialization(item)
+            key.prep_for_deserialization(item, include_injected)
+
+    def map_attributes(self, attribute_names: Iterable[str]) -> List[str]:
+        """
+        Maps the given attribute names to the names they are stored under, for use in projections. The key
+        attributes are always included, so that rows can be matched up and deserialized.
+
+        :param attribute_names: the attribute names.
+        :return: the stored attribute names, without duplicates.
+        """
+        result = list(self.key_attributes)
+        for attribute_name in attribute_names:
+            for key in self.keys:
+                mapped = key.map_attribute(attribute_name)
+                if mapped != attribute_name:
+                    break
+            if mapped not in result:
+                result.append(mapped)
+        return result
 
 
 def create_primary_key(obj: Any) -> CompoundKey:
@@ -0,0 +1,284 @@
+import random
+import time
+from threading import RLock
+from typing import Dict, Optional, Callable
+
+from utils import date_utils
+
+# Name of the bucket used when a request is not associated with a single table
+SHARED_BUCKET_NAME = "*"
+
+#
+# Decorrelated jitter backoff defaults (millis)
+#
+DEFAULT_BASE_DELAY_MILLIS = 25
+DEFAULT_MAX_DELAY_MILLIS = 5000
+
+#
+# Max number of attempts for a single request before giving up
+#
+DEFAULT_MAX_ATTEMPTS = 10
+
+#
+# Retry budget defaults. Each retry after a throttle costs DEFAULT_RETRY_COST tokens, each successful call refunds
+# one token. When the budget is exhausted, throttles are raised to the caller instead of retried.
+#
+DEFAULT_RETRY_BUDGET = 500
+DEFAULT_RETRY_COST = 5
+
+#
+# Token bucket defaults (requests per second)
+#
+DEFAULT_MIN_FILL_RATE = 1.0
+DEFAULT_RATE_DECREASE_FACTOR = 0.7
+DEFAULT_RATE_RECOVERY_PER_SECOND = 2.0
+
+Sleeper = Callable[[float], None]
+
+
+def _now_seconds() -> float:
+    return date_utils.get_system_time_in_millis() / 1000
+
+
+class BackoffPolicy:
+    """
+    Exponential backoff with decorrelated jitter, i.e. sleep = min(cap, random(base, previous * 3)).
+    """
+
+    def __init__(self, base_millis: int = DEFAULT_BASE_DELAY_MILLIS, max_millis: int = DEFAULT_MAX_DELAY_MILLIS):
+        assert 0 < base_millis <= max_millis
+        self.base_millis = base_millis
+        self.max_millis = max_millis
+
+    def next_delay(self, previous_millis: int) -> int:
+        """
+        Determines the next delay.
+
+        :param previous_millis: the previous delay, 0 for the first retry.
+        :return: the number of milliseconds to sleep.
+        """
+        upper = max(self.base_millis, previous_millis * 3)
+        return int(min(self.max_millis, random.uniform(self.base_millis, upper)))
+
+
+class RetryBudget:
+    """
+    Shared budget for retries, so a burst of throttles does not turn into a retry storm.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_RETRY_BUDGET, retry_cost: int = DEFAULT_RETRY_COST):
+        assert capacity >= retry_cost > 0
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.__available = capacity
+        self.__mutex = RLock()
+
+    @property
+    def available(self) -> int:
+        return self.__available
+
+    def try_withdraw(self) -> bool:
+        with self.__mutex:
+            if self.__available < self.retry_cost:
+                return False
+            self.__available -= self.retry_cost
+            return True
+
+    def deposit(self):
+        with self.__mutex:
+            if self.__available < self.capacity:
+                self.__available += 1
+
+
+class AdaptiveTokenBucket:
+    """
+    Client side rate limiter for a single table.
+
+    The bucket does not limit anything until a throttle is observed. At that point the fill rate is set to a fraction
+    of the measured request rate, and then recovers linearly while requests succeed. Once the fill rate has recovered
+    well above the measured rate, the bucket disables itself again.
+    """
+
+    def __init__(self,
+                 name: str,
+                 min_fill_rate: float = DEFAULT_MIN_FILL_RATE,
+                 decrease_factor: float = DEFAULT_RATE_DECREASE_FACTOR,
+                 recovery_per_second: float = DEFAULT_RATE_RECOVERY_PER_SECOND):
+        assert 0 < decrease_factor < 1
+        self.name = name
+        self.min_fill_rate = min_fill_rate
+        self.decrease_factor = decrease_factor
+        self.recovery_per_second = recovery_per_second
+        self.__mutex = RLock()
+        self.__enabled = False
+        self.__fill_rate = 0.0
+        self.__throttle_fill_rate = 0.0
+        self.__last_throttle_time = 0.0
+        self.__tokens = 0.0
+        self.__last_refill = 0.0
+        self.__measured_rate = 0.0
+        self.__measure_start = 0.0
+        self.__measure_count = 0
+        self.throttle_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.__enabled
+
+    @property
+    def fill_rate(self) -> Optional[float]:
+        return self.__fill_rate if self.__enabled else None
+
+    @property
+    def measured_rate(self) -> float:
+        return self.__measured_rate
+
+    def __measure(self, now: float):
+        # Simple exponential moving average of the send rate, sampled every half second
+        if self.__measure_start == 0:
+            self.__measure_start = now
+        self.__measure_count += 1
+        elapsed = now - self.__measure_start
+        if elapsed >= 0.5:
+            rate = self.__measure_count / elapsed
+            if self.__measured_rate == 0:
+                self.__measured_rate = rate
+            else:
+                self.__measured_rate = (self.__measured_rate * 0.8) + (rate * 0.2)
+            self.__measure_start = now
+            self.__measure_count = 0
+
+    def __refill(self, now: float):
+        if self.__last_refill > 0:
+            self.__tokens = min(max(1.0, self.__fill_rate),
+                                self.__tokens + (now - self.__last_refill) * self.__fill_rate)
+        self.__last_refill = now
+
+    def acquire(self, sleeper: Sleeper = time.sleep) -> int:
+        """
+        Acquire a token, waiting if required. The token is reserved up front, so concurrent callers queue up behind
+        each other instead of competing for the next refill.
+
+        :param sleeper: used to sleep.
+        :return: the number of milliseconds spent waiting.
+        """
+        with self.__mutex:
+            now = _now_seconds()
+            self.__measure(now)
+            if not self.__enabled:
+                return 0
+            self.__refill(now)
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0
+            delay = -self.__tokens / self.__fill_rate
+        sleeper(delay)
+        return int(delay * 1000)
+
+    def on_success(self):
+        with self.__mutex:
+            if not self.__enabled:
+                return
+            now = _now_seconds()
+            recovered = self.__throttle_fill_rate + (now - self.__last_throttle_time) * self.recovery_per_second
+            self.__fill_rate = max(self.__fill_rate, recovered)
+            if self.__measured_rate > 0 and self.__fill_rate > self.__measured_rate * 2:
+                self.__enabled = False
+
+    def on_throttle(self):
+        with self.__mutex:
+            self.throttle_count += 1
+            now = _now_seconds()
+            current = self.__fill_rate if self.__enabled else self.__measured_rate
+            if current <= 0:
+                current = self.__measured_rate
+            new_rate = max(self.min_fill_rate, current * self.decrease_factor)
+            if not self.__enabled:
+                self.__enabled = True
+                self.__tokens = 0.0
+                self.__last_refill = now
+            self.__fill_rate = new_rate
+            self.__throttle_fill_rate = new_rate
+            self.__last_throttle_time = now
+
+
+class ThrottleStats:
+    """
+    Throttling statistics for a single request.
+    """
+
+    def __init__(self):
+        self.throttle_count = 0
+        self.attempts = 0
+        self.sleep_millis = 0
+
+
+class DynamoDbThrottler:
+    """
+    Holds the backoff policy, retry budget and per-table token buckets used by DynamoDb.
+    """
+
+    def __init__(self,
+                 backoff_policy: BackoffPolicy = None,
+                 retry_budget: RetryBudget = None,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 bucket_factory: Callable[[str], AdaptiveTokenBucket] = AdaptiveTokenBucket,
+                 sleeper: Sleeper = time.sleep):
+        assert max_attempts > 0
+        self.backoff_policy = backoff_policy or BackoffPolicy()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.max_attempts = max_attempts
+        self.sleeper = sleeper
+        self.__bucket_factory = bucket_factory
+        self.__buckets: Dict[str, AdaptiveTokenBucket] = {}
+        self.__mutex = RLock()
+
+    def get_bucket(self, table_name: Optional[str]) -> AdaptiveTokenBucket:
+        name = table_name or SHARED_BUCKET_NAME
+        bucket = self.__buckets.get(name)
+        if bucket is None:
+            with self.__mutex:
+                bucket = self.__buckets.get(name)
+                if bucket is None:
+                    self.__buckets[name] = bucket = self.__bucket_factory(name)
+        return bucket
+
+    def get_throttle_counts(self) -> Dict[str, int]:
+        with self.__mutex:
+            return {name: b.throttle_count for name, b in self.__buckets.items() if b.throttle_count > 0}
+
+    def wait_for_token(self, bucket: AdaptiveTokenBucket, stats: ThrottleStats):
+        stats.attempts += 1
+        stats.sleep_millis += bucket.acquire(self.sleeper)
+
+    def on_success(self, bucket: AdaptiveTokenBucket):
+        bucket.on_success()
+        self.retry_budget.deposit()
+
+    def on_throttle(self, bucket: AdaptiveTokenBucket, stats: ThrottleStats, previous_delay: int) -> Optional[int]:
+        """
+        Called when a request has been throttled.
+
+        :param bucket: the bucket for the table.
+        :param stats: the stats for the request.
+        :param previous_delay: the previous backoff delay.
+        :return: the delay slept, or None if the request should not be retried.
+        """
+        stats.throttle_count += 1
+        bucket.on_throttle()
+        if stats.attempts >= self.max_attempts or not self.retry_budget.try_withdraw():
+            return None
+        delay = self.backoff(previous_delay)
+        stats.sleep_millis += delay
+        return delay
+
+    def backoff(self, previous_delay: int) -> int:
+        """
+        Sleeps for the next backoff delay. Also used when batch requests come back with unprocessed items.
+
+        :param previous_delay: the previous delay, 0 for the first retry.
+        :return: the delay slept.
+        """
+        delay = self.backoff_policy.next_delay(previous_delay)
+        self.sleeper(delay / 1000)
+        return delay
@@ -95,6 +95,9 @@ class BeanName(Enum):
     TENANT_CONTEXT_REPO = 44, PUBSUB_POLLER_PROFILE
     SECURE_CHANNEL_CREDENTIALS = 45, PUBSUB_POLLER_PROFILE
     PUBSUB_SERVICE = 46, PUBSUB_POLLER_PROFILE
+    CONSISTENCY_POLICY = 48, ALL_PROFILES
+    PLATFORM_SESSIONS_REPO = 49, ALL_PROFILES
+    ASYNC_HTTP_CLIENT = 50, LIVE_AGENT_PROCESSOR_PROFILE
 
 
 BeanSupplier = Supplier[T]
@@ -221,7 +221,10 @@ _BEANS: Dict[BeanName, _BeanImpl] = {
     BeanName.TENANT_CONTEXT_REPO: _module(),
     BeanName.PUBSUB_SERVICE: _module(),
     BeanName.PUBSUB_POLLER_PROCESSOR: _module(),
-    BeanName.SECURE_CHANNEL_CREDENTIALS: _module()
+    BeanName.SECURE_CHANNEL_CREDENTIALS: _module(),
+    BeanName.CONSISTENCY_POLICY: _module(),
+    BeanName.PLATFORM_SESSIONS_REPO: _module(),
+    BeanName.ASYNC_HTTP_CLIENT: _module()
 }
 
 
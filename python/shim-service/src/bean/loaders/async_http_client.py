@@ -0,0 +1,5 @@
+from utils.async_http_client import create_async_client
+
+
+def init():
+    return create_async_client()
@@ -0,0 +1,8 @@
+from bean import BeanName, inject
+from config import Config
+from repos.aws.read_consistency import ConsistencyPolicy
+
+
+@inject(bean_instances=BeanName.CONFIG)
+def init(config: Config):
+    return ConsistencyPolicy.from_config(config.read_consistency, config.read_consistency_overrides)
@@ -1,9 +1,11 @@
 from typing import Any
 
 from aws.dynamodb import DynamoDb
+from aws.dynamodb_accounting import DynamoDbAccounting
 from bean import BeanName, inject
+from repos.aws import resolve_virtual_table_name
 
 
 @inject(bean_instances=BeanName.DYNAMODB_CLIENT)
 def init(client: Any):
-    return DynamoDb(client)
+    return DynamoDb(client, accounting=DynamoDbAccounting(resolve_virtual_table_name))
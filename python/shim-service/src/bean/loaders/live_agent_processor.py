@@ -6,6 +6,7 @@ from repos.pending_event_repo import PendingEventsRepo
 from repos.resource_lock import ResourceLockRepo
 from repos.session_contexts import SessionContextsRepo
 from services.sfdc.live_agent.message_dispatcher import LiveAgentMessageDispatcher
+from utils.async_http_client import AsyncHttpClient
 
 
 @inject(bean_instances=(BeanName.PENDING_EVENTS_REPO,
@@ -13,13 +14,15 @@ from services.sfdc.live_agent.message_dispatcher import LiveAgentMessageDispatch
                         BeanName.SESSION_CONTEXTS_REPO,
                         BeanName.LAMBDA_INVOKER,
                         BeanName.CONFIG,
-                        BeanName.LIVE_AGENT_MESSAGE_DISPATCHER))
+                        BeanName.LIVE_AGENT_MESSAGE_DISPATCHER,
+                        BeanName.ASYNC_HTTP_CLIENT))
 def init(pending_events_repo: PendingEventsRepo,
          resource_lock_repo: ResourceLockRepo,
          contexts_repo: SessionContextsRepo,
          invoker: LambdaInvoker,
          config: Config,
-         dispatcher: LiveAgentMessageDispatcher
+         dispatcher: LiveAgentMessageDispatcher,
+         http_client: AsyncHttpClient
          ):
     return LiveAgentPollingProcessor(
         pending_events_repo,
@@ -27,5 +30,6 @@ def init(pending_events_repo: PendingEventsRepo,
         contexts_repo,
         invoker,
         config,
-        dispatcher
+        dispatcher,
+        http_client
     )
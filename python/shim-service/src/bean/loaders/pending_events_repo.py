@@ -1,8 +1,11 @@
 from aws.dynamodb import DynamoDb
 from bean import BeanName, inject
+from config import Config
 from repos.aws.aws_pending_events_repo import AwsPendingEventsRepo
+from repos.aws.read_consistency import ConsistencyPolicy
 
 
-@inject(bean_instances=BeanName.DYNAMODB)
-def init(ddb: DynamoDb):
-    return AwsPendingEventsRepo(ddb)
+@inject(bean_instances=(BeanName.DYNAMODB, BeanName.CONSISTENCY_POLICY, BeanName.CONFIG))
+def init(ddb: DynamoDb, consistency_policy: ConsistencyPolicy, config: Config):
+    return AwsPendingEventsRepo(ddb, consistency_policy, config.pending_event_shards,
+                                config.max_pending_event_shards)
@@ -0,0 +1,9 @@
+from aws.dynamodb import DynamoDb
+from bean import BeanName, inject
+from config import Config
+from repos.aws.aws_platform_sessions import AwsPlatformSessionsRepo
+
+
+@inject(bean_instances=(BeanName.DYNAMODB, BeanName.CONFIG))
+def init(ddb: DynamoDb, config: Config):
+    return AwsPlatformSessionsRepo(ddb, config.max_context_ttl_seconds)
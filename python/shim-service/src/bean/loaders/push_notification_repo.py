@@ -5,22 +5,27 @@ from lambda_pkg.functions import LambdaInvoker
 from repos.aws.aws_sequence import AwsSequenceRepo
 from repos.aws.aws_session_contexts import AwsSessionContextsRepo
 from repos.aws.aws_session_push_notifications import AwsPushNotificationsRepo
+from repos.aws.read_consistency import ConsistencyPolicy
 
 
 @inject(bean_instances=(BeanName.DYNAMODB,
                         BeanName.SEQUENCE_REPO,
                         BeanName.SESSION_CONTEXTS_REPO,
                         BeanName.LAMBDA_INVOKER,
-                        BeanName.CONFIG))
+                        BeanName.CONFIG,
+                        BeanName.CONSISTENCY_POLICY))
 def init(ddb: DynamoDb,
          sequence_repo: AwsSequenceRepo,
          session_contexts_repo: AwsSessionContextsRepo,
          lambda_invoker: LambdaInvoker,
-         config: Config):
+         config: Config,
+         consistency_policy: ConsistencyPolicy):
     return AwsPushNotificationsRepo(
         ddb,
         sequence_repo,
         session_contexts_repo,
         lambda_invoker,
-        config.max_push_notification_seconds
+        config.max_push_notification_seconds,
+        consistency_policy,
+        config.read_legacy_push_notifications
     )
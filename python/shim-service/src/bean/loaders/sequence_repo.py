@@ -1,9 +1,10 @@
 from aws.dynamodb import DynamoDb
 from bean import BeanName, inject
+from config import Config
 from repos.aws.aws_events import AwsEventsRepo
 from repos.aws.aws_sequence import AwsSequenceRepo
 
 
-@inject(bean_instances=(BeanName.DYNAMODB, BeanName.EVENTS_REPO))
-def init(ddb: DynamoDb, events_repo: AwsEventsRepo):
-    return AwsSequenceRepo(ddb, events_repo)
+@inject(bean_instances=(BeanName.DYNAMODB, BeanName.EVENTS_REPO, BeanName.CONFIG))
+def init(ddb: DynamoDb, events_repo: AwsEventsRepo, config: Config):
+    return AwsSequenceRepo(ddb, events_repo, config.event_sequence_block_size)
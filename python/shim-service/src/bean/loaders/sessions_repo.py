@@ -1,10 +1,12 @@
 from aws.dynamodb import DynamoDb
 from bean import BeanName, inject
 from repos.aws.aws_events import AwsEventsRepo
+from repos.aws.aws_platform_sessions import AwsPlatformSessionsRepo
 from repos.aws.aws_sequence import AwsSequenceRepo
 from repos.aws.aws_sessions import AwsSessionsRepo
 from repos.aws.aws_sfdc_sessions_repo import AwsSfdcSessionsRepo
 from repos.aws.aws_user_sessions import AwsUserSessionsRepo
+from repos.aws.read_consistency import ConsistencyPolicy
 
 INVOKE_CLASS = AwsSessionsRepo
 
@@ -13,15 +15,21 @@ INVOKE_CLASS = AwsSessionsRepo
                         BeanName.USER_SESSIONS_REPO,
                         BeanName.EVENTS_REPO,
                         BeanName.SEQUENCE_REPO,
-                        BeanName.SFDC_SESSIONS_REPO))
+                        BeanName.SFDC_SESSIONS_REPO,
+                        BeanName.PLATFORM_SESSIONS_REPO,
+                        BeanName.CONSISTENCY_POLICY))
 def init(dynamodb: DynamoDb, user_sessions_repo: AwsUserSessionsRepo,
          events_repo: AwsEventsRepo,
          sequence_repo: AwsSequenceRepo,
-         sfdc_sessions_repo: AwsSfdcSessionsRepo):
+         sfdc_sessions_repo: AwsSfdcSessionsRepo,
+         platform_sessions_repo: AwsPlatformSessionsRepo,
+         consistency_policy: ConsistencyPolicy):
     return INVOKE_CLASS(
         dynamodb,
         user_sessions_repo,
         events_repo,
         sequence_repo,
-        sfdc_sessions_repo
+        sfdc_sessions_repo,
+        platform_sessions_repo,
+        consistency_policy
     )
@@ -13,6 +13,19 @@ DEFAULT_MAX_SESSION_RETRIES = 10
 #
 DEFAULT_MAX_POLLING_SECONDS = 890
 
+#
+# Set to True to have pollers keep collecting sessions as the ones they are polling finish, for up to
+# max_polling_seconds, rather than collecting once per invocation. The poller Lambda timeouts must cover
+# max_polling_seconds.
+#
+DEFAULT_POLLER_ROLLING_ADMISSION = False
+
+#
+# Set to True to let pollers collect sessions at the same time, rather than one at a time under a collect lock. The
+# events are claimed with conditional updates either way, collectors start at random events to avoid colliding.
+#
+DEFAULT_CONCURRENT_COLLECTORS = False
+
 #
 # Default idle time before re-scheduling a polling session
 #
@@ -23,6 +36,42 @@ DEFAULT_IDLE_POLLING_SECONDS = 300
 #
 DEFAULT_SESSIONS_PER_LA_POLL_PROCESSOR = 20
 
+#
+# Set to True to have live agent pollers wait on their polls from a single event loop, rather than a thread for each
+# session, so each poller can cover many more sessions
+#
+DEFAULT_LA_POLL_ASYNC = False
+
+#
+# Number of sessions a single lambda instance can support for polling live agent, when polling from an event loop
+#
+DEFAULT_SESSIONS_PER_ASYNC_LA_POLL_PROCESSOR = 400
+
+#
+# Number of threads used for the blocking calls (DynamoDB, locks) when polling live agent from an event loop
+#
+DEFAULT_LA_POLL_EXECUTOR_THREADS = 8
+
+#
+# Seconds a live agent poller keeps polling a session it has locked, rather than polling it once and leaving the
+# next poll to another invocation. 0 disables it. A session only keeps being polled until max_polling_seconds after
+# the invocation started.
+#
+DEFAULT_LA_STICKY_POLL_SECONDS = 0
+
+#
+# Number of hash keys new pending live agent poll events are spread over, so the collectors' queries and the updates
+# to the events do not all go to the same partition. Events are moved to the shard for the current count the next
+# time they are polled.
+#
+DEFAULT_PENDING_EVENT_SHARDS = 1
+
+#
+# Number of shards the collectors query, when more than pending_event_shards. Set it to the highest
+# pending_event_shards used so far before lowering that, so the events left in the higher shards are still polled.
+#
+DEFAULT_MAX_PENDING_EVENT_SHARDS = 1
+
 DEFAULT_SESSIONS_PER_PUBSUB_POLL_PROCESSOR = 20
 
 DEFAULT_PUBSUB_POLL_SECONDS = 60
@@ -42,8 +91,30 @@ DEFAULT_MAX_WORK_ID_MAP_SECONDS = 3600 * 24 * 10
 #
 DEFAULT_MAX_PUSH_NOTIFICATION_SECONDS = 3600 * 24 * 7
 
+#
+# Set to True to also look for unsent push notifications in the push notification table, where they were kept before
+# the unsent queue existed. Can be turned off once max_push_notification_seconds has passed since the queue was
+# deployed.
+#
+DEFAULT_READ_LEGACY_PUSH_NOTIFICATIONS = True
+
 DEFAULT_MAX_CONTEXT_TTL_SECONDS = 3600 * 24 * 7
 
+#
+# Number of event sequence numbers each container reserves at a time. With 1, every event does an atomic ADD on the
+# tenant's sequence. Larger blocks save the round trip but numbers from different containers interleave. Either way,
+# numbers are unique but are not assigned in commit order, so they must not be used as a read cursor.
+#
+DEFAULT_EVENT_SEQUENCE_BLOCK_SIZE = 1
+
+#
+# Read consistency for the reads that go through a repo consistency policy: "strong", "eventual" or "validated".
+# Eventually consistent reads cost half the read capacity. Validated reads are eventually consistent, and are read
+# again with a consistent read when the item is older than a version the container has already seen. Overrides are
+# by call site, see repos.aws.read_consistency.
+#
+DEFAULT_READ_CONSISTENCY = 'strong'
+
 
 class Config:
     """
@@ -56,13 +127,25 @@ class Config:
                  max_create_session_retries: int = DEFAULT_MAX_SESSION_RETRIES,
                  max_polling_seconds: int = DEFAULT_MAX_POLLING_SECONDS,
                  idle_polling_seconds: int = DEFAULT_IDLE_POLLING_SECONDS,
+                 poller_rolling_admission: bool = DEFAULT_POLLER_ROLLING_ADMISSION,
+                 concurrent_collectors: bool = DEFAULT_CONCURRENT_COLLECTORS,
                  sessions_per_live_agent_poll_processor=DEFAULT_SESSIONS_PER_LA_POLL_PROCESSOR,
+                 live_agent_poll_async=DEFAULT_LA_POLL_ASYNC,
+                 sessions_per_async_live_agent_poll_processor=DEFAULT_SESSIONS_PER_ASYNC_LA_POLL_PROCESSOR,
+                 live_agent_poll_executor_threads=DEFAULT_LA_POLL_EXECUTOR_THREADS,
+                 live_agent_sticky_poll_seconds=DEFAULT_LA_STICKY_POLL_SECONDS,
                  live_agent_poll_session_seconds=DEFAULT_LA_POLL_SESSION_TIME,
+                 pending_event_shards=DEFAULT_PENDING_EVENT_SHARDS,
+                 max_pending_event_shards=DEFAULT_MAX_PENDING_EVENT_SHARDS,
                  max_work_id_map_seconds=DEFAULT_MAX_WORK_ID_MAP_SECONDS,
                  max_push_notification_seconds=DEFAULT_MAX_PUSH_NOTIFICATION_SECONDS,
+                 read_legacy_push_notifications=DEFAULT_READ_LEGACY_PUSH_NOTIFICATIONS,
                  max_context_ttl_seconds=DEFAULT_MAX_CONTEXT_TTL_SECONDS,
                  pubsub_poll_session_seconds=DEFAULT_PUBSUB_POLL_SECONDS,
-                 pubsub_poll_processor_sessions=DEFAULT_SESSIONS_PER_PUBSUB_POLL_PROCESSOR):
+                 pubsub_poll_processor_sessions=DEFAULT_SESSIONS_PER_PUBSUB_POLL_PROCESSOR,
+                 event_sequence_block_size=DEFAULT_EVENT_SEQUENCE_BLOCK_SIZE,
+                 read_consistency=DEFAULT_READ_CONSISTENCY,
+                 read_consistency_overrides=None):
         self.pubsub_poll_session_seconds = pubsub_poll_session_seconds
         self.sessions_per_pubsub_poll_processor = pubsub_poll_processor_sessions
         self.session_expiration_seconds = session_expiration_seconds
@@ -70,8 +153,26 @@ class Config:
         self.max_create_session_retries = max_create_session_retries
         self.max_polling_seconds = max_polling_seconds
         self.idle_polling_seconds = idle_polling_seconds
+        self.poller_rolling_admission = poller_rolling_admission
+        self.concurrent_collectors = concurrent_collectors
         self.sessions_per_live_agent_poll_processor = sessions_per_live_agent_poll_processor
+        self.live_agent_poll_async = live_agent_poll_async
+        self.sessions_per_async_live_agent_poll_processor = sessions_per_async_live_agent_poll_processor
+        self.live_agent_poll_executor_threads = live_agent_poll_executor_threads
+        self.live_agent_sticky_poll_seconds = live_agent_sticky_poll_seconds
         self.live_agent_poll_session_seconds = live_agent_poll_session_seconds
+        self.pending_event_shards = pending_event_shards
+        self.max_pending_event_shards = max_pending_event_shards
         self.max_work_id_map_seconds = max_work_id_map_seconds
         self.max_push_notification_seconds = max_push_notification_seconds
+        self.read_legacy_push_notifications = read_legacy_push_notifications
         self.max_context_ttl_seconds = max_context_ttl_seconds
+        self.event_sequence_block_size = event_sequence_block_size
+        self.read_consistency = read_consistency
+        self.read_consistency_overrides = read_consistency_overrides or {}
+
+    def get_admission_seconds(self) -> int:
+        """
+        :return: the seconds pollers keep collecting sessions for, 0 if they only collect once.
+        """
+        return self.max_polling_seconds if self.poller_rolling_admission else 0
@@ -1,7 +1,8 @@
 import json
 from typing import Any, Optional, Collection
 
-from bean import inject, BeanType
+from aws.dynamodb import DynamoDb
+from bean import inject, BeanType, BeanName
 from lambda_web_framework import init_lambda, RequestHandler
 from utils import loghelper, exception_utils
 from utils.date_utils import get_system_time_in_millis
@@ -76,6 +77,13 @@ def __log_elapsed_time(message: str = "Total elapsed time"):
     logger.info(f"{message}: {elapsed / 1000:0.3f} seconds.")
 
 
+@inject(bean_instances=BeanName.DYNAMODB)
+def __log_dynamodb_usage(ddb: DynamoDb):
+    summary = ddb.accounting.summarize()
+    if summary is not None:
+        logger.info(f"DynamoDB usage: {json.dumps(summary)}")
+
+
 def handler(event: dict, context: Any):
     try:
         result = _handler(event, context)
@@ -84,3 +92,7 @@ def handler(event: dict, context: Any):
     except BaseException as ex:
         logger.severe("Unexpected exception", ex=ex)
         raise ex
+    finally:
+        # Avoid loading DynamoDB just to answer a ping
+        if event.get('command') != 'ping':
+            __log_dynamodb_usage()
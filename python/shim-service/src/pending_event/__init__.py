@@ -23,7 +23,8 @@ class PendingEvent(SessionKey):
                  user_id: Optional[str],
                  event_time: Optional[EpochMilliseconds] = None,
                  active_at: Optional[EpochMilliseconds] = None,
-                 update_time: Optional[EpochMilliseconds] = None):
+                 update_time: Optional[EpochMilliseconds] = None,
+                 shard: int = 0):
         self.event_type = event_type
         self.event_time = event_time or get_system_time_in_millis()
         self.tenant_id = tenant_id
@@ -31,6 +32,7 @@ class PendingEvent(SessionKey):
         self.user_id = user_id
         self.active_at = active_at or self.event_time
         self.update_time = update_time or self.event_time
+        self.shard = shard
 
     def to_record(self) -> Dict[str, Any]:
         return {
@@ -40,7 +42,8 @@ class PendingEvent(SessionKey):
             'sessionId': self.session_id,
             'userId': self.user_id,
             'activeAt': self.active_at,
-            'updateTime': self.update_time
+            'updateTime': self.update_time,
+            'shard': self.shard
         }
 
     @classmethod
@@ -52,5 +55,6 @@ class PendingEvent(SessionKey):
             record.get('userId'),
             record['eventTime'],
             record['activeAt'],
-            record.get('updateTime')
+            record.get('updateTime'),
+            record.get('shard', 0)
         )
@@ -34,6 +34,10 @@ def assert_valid_platform_channel(name: str) -> bool:
     return True
 
 
+def get_platform_channel_names() -> List[str]:
+    return list(_CHANNELS.keys())
+
+
 def deserialize_platform_channels(record: Dict[str, Any]) -> List[str]:
     results = []
     for channel in _CHANNELS.keys():
@@ -0,0 +1,105 @@
+import abc
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from threading import Thread
+from typing import List, Optional, Callable, Any
+
+from poll.polling_group import AbstractProcessorGroup, LockAndEvent
+from utils import loghelper, exception_utils, threading_utils
+
+logger = loghelper.get_logger(__name__)
+
+
+class AbstractAsyncProcessorGroup(AbstractProcessorGroup, metaclass=abc.ABCMeta):
+    """
+    Processor group that runs its workers as coroutines on a single event loop, rather than a thread each, so one
+    processor can wait on many more polls at once. Polls are awaited with poll_async(), and the blocking calls the
+    workers make (locks, repos) run in a small executor.
+
+    Subclasses call init_async() from their constructor.
+    """
+    executor_threads: int
+    futures: List[Future]
+
+    def init_async(self, executor_threads: int):
+        self.executor_threads = executor_threads
+        self.futures = []
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__loop_thread: Optional[Thread] = None
+        self.__executor: Optional[ThreadPoolExecutor] = None
+
+    @abc.abstractmethod
+    async def poll_async(self, le: LockAndEvent):
+        raise NotImplementedError()
+
+    async def offload(self, function_to_call: Callable, *args) -> Any:
+        """
+        Runs a blocking call in the executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, function_to_call, *args)
+
+    def __get_loop(self) -> asyncio.AbstractEventLoop:
+        # Started on first use, since the group may not find anything to poll
+        if self.__loop is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.executor_threads)
+            self.__loop = asyncio.new_event_loop()
+            self.__loop_thread = threading_utils.start_thread(self.__loop.run_forever)
+        return self.__loop
+
+    def start_worker(self, le: LockAndEvent):
+        self.futures.append(asyncio.run_coroutine_threadsafe(self.__worker(le), self.__get_loop()))
+
+    async def __worker(self, le: LockAndEvent):
+        try:
+            await self.__inner_worker(le)
+        except BaseException as ex:
+            logger.severe("Exception invoking worker", ex=ex)
+
+    async def __inner_worker(self, le: LockAndEvent):
+        logger.info("Worker starting.")
+        try:
+            le.after_release = self.invoke_again
+
+            if not await self.offload(self.should_poll, le):
+                self.dec_submit_count()
+                return
+
+            with self.mutex:
+                self.working_count += 1
+                self.submit_count -= 1
+                self.signal_event.notify()
+
+            try:
+                await self.poll_async(le)
+                if le.update_action_time:
+                    self.release_event(le.event)
+
+            except Exception as ex:
+                logger.severe(f"Failed during poll: {exception_utils.dump_ex(ex)}")
+            finally:
+                self.worker_finished()
+        finally:
+            await self.offload(le.release)
+
+        logger.info("Worker ending.")
+
+    def is_empty(self) -> bool:
+        return len(self.futures) == 0
+
+    def thread_count(self) -> int:
+        return len(self.futures)
+
+    def join(self, timeout: float) -> bool:
+        if len(self.futures) > 0:
+            _, not_done = wait(self.futures, timeout)
+            self.futures = list(not_done)
+        return len(self.futures) == 0
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        super().__exit__(exc_type, exc_val, exc_tb)
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__loop_thread.join(10)
+            if not self.__loop.is_running():
+                self.__loop.close()
+            self.__executor.shutdown(wait=False)
@@ -1,4 +1,5 @@
 import abc
+import time
 from typing import Any, Dict
 
 from lambda_web_framework import InvocableBeanRequestHandler
@@ -6,18 +7,37 @@ from poll.polling_group import AbstractProcessorGroup
 from repos.resource_lock import ResourceLockRepo
 from utils import loghelper
 from utils.date_utils import get_system_time_in_millis, format_elapsed_time_seconds
+from utils.timer_utils import Timer
 
 logger = loghelper.get_logger(__name__)
 
+# How often to log the number of threads still running
+_STATUS_SECONDS = 30
+
+# Min seconds between collections, when admitting sessions as others finish
+_ADMISSION_INTERVAL_SECONDS = 5
+
 
 class BasePollingProcessor(InvocableBeanRequestHandler, metaclass=abc.ABCMeta):
 
     def __init__(self,
                  resource_lock_repo: ResourceLockRepo,
-                 max_collect_seconds: int
+                 max_collect_seconds: int,
+                 admission_seconds: int = 0,
+                 concurrent_collect: bool = False
                  ):
+        """
+        :param resource_lock_repo: the resource lock repo.
+        :param max_collect_seconds: max seconds to spend collecting events.
+        :param admission_seconds: seconds to keep collecting events as workers finish, so each invocation stays busy.
+        0 means events are only collected once.
+        :param concurrent_collect: True to collect without the collect lock. Each event is still claimed with a
+        conditional update, so collectors running at the same time never start the same event.
+        """
         self.resource_lock_repo = resource_lock_repo
         self.max_collect_seconds = max_collect_seconds
+        self.admission_seconds = admission_seconds
+        self.concurrent_collect = concurrent_collect
 
     @classmethod
     @abc.abstractmethod
@@ -28,17 +48,25 @@ class BasePollingProcessor(InvocableBeanRequestHandler, metaclass=abc.ABCMeta):
     def create_group(self) -> AbstractProcessorGroup:
         raise NotImplementedError()
 
-    def invoke(self, parameters: Dict[str, Any]):
+    def __collect(self, group: AbstractProcessorGroup) -> bool:
+        if self.concurrent_collect:
+            group.collect(random_start=True)
+            return True
 
         # We want to lock during collection to avoid as many collisions on individual events found as possible
         lock = self.resource_lock_repo.try_acquire(self.lock_name(), self.max_collect_seconds + 2)
         if lock is None:
             logger.info("Another poller is collecting sessions.")
-            return
+            return False
 
         with lock:
-            group = self.create_group()
             group.collect()
+        return True
+
+    def invoke(self, parameters: Dict[str, Any]):
+        group = self.create_group()
+        if not self.__collect(group):
+            return
 
         if group.is_empty():
             logger.info("No sessions to poll.")
@@ -49,8 +77,42 @@ class BasePollingProcessor(InvocableBeanRequestHandler, metaclass=abc.ABCMeta):
             logger.info(f"Starting poll for {group.thread_count()} session(s) ...")
 
             with group:
-                while not group.join(30):
-                    elapsed = format_elapsed_time_seconds(start_time)
-                    logger.info(f"Number of threads still running: {group.thread_count()}, up time={elapsed} seconds.")
+                if self.admission_seconds > 0:
+                    self.__poll_and_admit(group, start_time)
+                else:
+                    while not group.join(_STATUS_SECONDS):
+                        self.__log_status(group, start_time)
         finally:
             logger.info(f"Stopping, elapsed time = {format_elapsed_time_seconds(start_time)}.")
+
+    def __poll_and_admit(self, group: AbstractProcessorGroup, start_time: int):
+        # Stop admitting in time for the last sessions admitted to finish their polls
+        admission_timer = Timer(self.admission_seconds - group.refresh_seconds)
+        status_timer = Timer(_STATUS_SECONDS)
+        collect_timer = Timer(_ADMISSION_INTERVAL_SECONDS)
+        group.start_admitting()
+        try:
+            while admission_timer.has_time_left():
+                if group.join(collect_timer.get_delay_time(_ADMISSION_INTERVAL_SECONDS)):
+                    # Nothing is running, wait for the next collection
+                    time.sleep(collect_timer.get_delay_time(_ADMISSION_INTERVAL_SECONDS))
+                if collect_timer.is_expired():
+                    if group.has_capacity():
+                        self.__collect(group)
+                        if group.is_empty():
+                            # Nothing left to poll
+                            break
+                    collect_timer = Timer(_ADMISSION_INTERVAL_SECONDS)
+                if status_timer.is_expired():
+                    self.__log_status(group, start_time)
+                    status_timer = Timer(_STATUS_SECONDS)
+        finally:
+            group.stop_admitting()
+
+        while not group.join(_STATUS_SECONDS):
+            self.__log_status(group, start_time)
+
+    @staticmethod
+    def __log_status(group: AbstractProcessorGroup, start_time: int):
+        elapsed = format_elapsed_time_seconds(start_time)
+        logger.info(f"Number of threads still running: {group.thread_count()}, up time={elapsed} seconds.")
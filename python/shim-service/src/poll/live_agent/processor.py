@@ -1,9 +1,11 @@
 import json
-from typing import Any
+from typing import Any, Dict, Tuple, Optional, List, Callable
 
+from aws import dynamodb_accounting
 from config import Config
 from lambda_pkg.functions import LambdaInvoker
 from pending_event import PendingEventType
+from poll.async_polling_group import AbstractAsyncProcessorGroup
 from poll.base_processor import BasePollingProcessor
 from poll.polling_group import AbstractProcessorGroup, LockAndEvent, E
 from repos import QueryResult
@@ -11,15 +13,21 @@ from repos.pending_event_repo import PendingEventsRepo
 from repos.resource_lock import ResourceLockRepo
 from repos.session_contexts import SessionContextsRepo
 from services.sfdc.live_agent import LiveAgentPollerSettings
+from services.sfdc.live_agent.message_data import MessageData
 from services.sfdc.live_agent.message_dispatcher import LiveAgentMessageDispatcher
-from services.sfdc.sfdc_session import SfdcSessionAndContext, load_with_context
+from services.sfdc.sfdc_session import SfdcSessionAndContext, load_with_context, load_all_with_context
 from session import ContextType
 from utils import loghelper, exception_utils
+from utils.async_http_client import AsyncHttpClient
+from utils.timer_utils import Timer
 
 logger = loghelper.get_logger(__name__)
 
 _MAX_COLLECT_SECONDS = 10
 
+# Time allowed, beyond the poll timeout, to process a poll in sticky mode
+_STICKY_MARGIN_SECONDS = 5
+
 
 class ProcessorGroup(AbstractProcessorGroup):
     def __init__(self, resource_lock_repo: ResourceLockRepo,
@@ -28,24 +36,76 @@ class ProcessorGroup(AbstractProcessorGroup):
                  refresh_seconds: int,
                  max_working_count: int,
                  dispatcher: LiveAgentMessageDispatcher,
-                 invoker: LambdaInvoker):
+                 invoker: LambdaInvoker,
+                 deadline: Timer,
+                 sticky_seconds: int = 0):
         super().__init__(resource_lock_repo, refresh_seconds, max_working_count, _MAX_COLLECT_SECONDS)
         self.contexts_repo = contexts_repo
         self.pe_repo = pending_event_repo
         self.dispatcher = dispatcher
         self.invoker = invoker
+        self.deadline = deadline
+        self.sticky_seconds = sticky_seconds
+        self.prefetched: Dict[Tuple[int, str], Optional[SfdcSessionAndContext]] = {}
 
     def invoke_lambda(self):
         self.invoker.invoke_live_agent_poller()
 
     def poll(self, le: LockAndEvent):
         sc: SfdcSessionAndContext = le.user_object
-        sfdc_session = sc.session
+        settings = LiveAgentPollerSettings.deserialize(sc.context.session_data)
+        timer = self.create_sticky_timer()
+        while True:
+            if not self.process_poll(le, settings, lambda: sc.session.poll_live_agent(settings)):
+                break
+            if not self.keep_polling(le, timer):
+                break
+
+    def create_sticky_timer(self) -> Timer:
+        # Sessions admitted late in the invocation only get the time left before the deadline
+        return Timer(self.deadline.get_delay_time(self.sticky_seconds))
+
+    def keep_polling(self, le: LockAndEvent, timer: Timer) -> bool:
+        """
+        Called after each successful poll, to see if the worker should poll the session again rather than leaving it
+        for the next poller. This is the case in sticky mode, as long as there is time left for another poll, and the
+        lock and the pending event can be renewed.
+
+        :param le: the lock and event.
+        :param timer: the timer for the sticky time.
+        :return: True to poll again.
+        """
+        sc: SfdcSessionAndContext = le.user_object
+        needed = sc.session.get_live_agent_poll_timeout_seconds() + _STICKY_MARGIN_SECONDS
+        if timer.get_delay_time(needed) < needed:
+            return False
+        if not le.lock.refresh():
+            logger.info(f"Lost the lock for {le.event}.")
+            return False
+        if not self.update_action_time(le.event, self.refresh_seconds):
+            # The session was deleted, or the event was claimed by another poller
+            logger.info(f"Unable to renew the claim for {le.event}.")
+            le.update_action_time = False
+            return False
+        return True
+
+    @dynamodb_accounting.accounted("live_agent_poll")
+    def process_poll(self, le: LockAndEvent,
+                     settings: LiveAgentPollerSettings,
+                     poller: Callable[[], Optional[MessageData]]) -> bool:
+        """
+        Gets the message data from the poller and dispatches it.
+
+        :param le: the lock and event.
+        :param settings: the poller settings from the context.
+        :param poller: polls live agent, or returns the data from a poll already done.
+        :return: True if the session can be polled again.
+        """
+        sc: SfdcSessionAndContext = le.user_object
         context = sc.context
-        settings = LiveAgentPollerSettings.deserialize(context.session_data)
 
         def inner_poll():
-            message_data = sfdc_session.poll_live_agent(settings)
+            message_data = poller()
             if message_data is None:
                 return True
 
@@ -61,20 +121,32 @@ class ProcessorGroup(AbstractProcessorGroup):
         try:
             if inner_poll():
                 self.contexts_repo.update_session_context(context, settings)
+                # Keep track of what was saved, in case we poll again
+                sc.context = context.set_session_data(settings.serialize())
                 le.after_release = self.invoke_again
-            else:
-                logger.info(f"Polling was shut down for {context}.")
-                self.contexts_repo.set_failed(context, "Polling was shutdown.")
-                self.pe_repo.delete_event(le.event)
-                le.update_action_time = False
+                return True
+            logger.info(f"Polling was shut down for {context}.")
+            self.contexts_repo.set_failed(context, "Polling was shutdown.", le.event)
+            le.update_action_time = False
         except BaseException as ex:
             message_text = exception_utils.get_exception_message(ex)
             self.contexts_repo.set_failed(context, message_text)
             le.failed = True
             le.update_action_time = False
+        return False
+
+    def prefetch(self, events: List[E]):
+        prefetched = load_all_with_context(events, ContextType.LIVE_AGENT)
+        with self.mutex:
+            self.prefetched.update(prefetched)
 
     def should_poll(self, le: LockAndEvent) -> bool:
-        sc: SfdcSessionAndContext = load_with_context(le.event, ContextType.LIVE_AGENT)
+        key = (le.event.tenant_id, le.event.session_id)
+        with self.mutex:
+            found = key in self.prefetched
+            sc: SfdcSessionAndContext = self.prefetched.pop(key, None)
+        if not found:
+            sc = load_with_context(le.event, ContextType.LIVE_AGENT)
         if sc is None:
             logger.info(f"Session {le.event} no longer exists.")
             self.pe_repo.delete_event(le.event)
@@ -88,6 +160,9 @@ class ProcessorGroup(AbstractProcessorGroup):
     def update_action_time(self, event: E, seconds_in_future: int) -> bool:
         return self.pe_repo.update_action_time(event, seconds_in_future)
 
+    def update_action_times(self, events: List[E], seconds_in_future: int) -> List[E]:
+        return self.pe_repo.update_action_times(events, seconds_in_future)
+
     def query_events(self, limit: int, next_token: Any) -> QueryResult:
         return self.pe_repo.query_events(
             PendingEventType.LIVE_AGENT_POLL,
@@ -96,6 +171,35 @@ class ProcessorGroup(AbstractProcessorGroup):
         )
 
 
+class AsyncProcessorGroup(AbstractAsyncProcessorGroup, ProcessorGroup):
+    def __init__(self, resource_lock_repo: ResourceLockRepo,
+                 pending_event_repo: PendingEventsRepo,
+                 contexts_repo: SessionContextsRepo,
+                 refresh_seconds: int,
+                 max_working_count: int,
+                 dispatcher: LiveAgentMessageDispatcher,
+                 invoker: LambdaInvoker,
+                 deadline: Timer,
+                 http_client: AsyncHttpClient,
+                 executor_threads: int,
+                 sticky_seconds: int = 0):
+        super().__init__(resource_lock_repo, pending_event_repo, contexts_repo, refresh_seconds, max_working_count,
+                         dispatcher, invoker, deadline, sticky_seconds)
+        self.http_client = http_client
+        self.init_async(executor_threads)
+
+    async def poll_async(self, le: LockAndEvent):
+        sc: SfdcSessionAndContext = le.user_object
+        settings = LiveAgentPollerSettings.deserialize(sc.context.session_data)
+        timer = self.create_sticky_timer()
+        while True:
+            message_data = await sc.session.poll_live_agent_async(settings, self.http_client)
+            if not await self.offload(self.process_poll, le, settings, lambda: message_data):
+                break
+            if not await self.offload(self.keep_polling, le, timer):
+                break
+
+
 class LiveAgentPollingProcessor(BasePollingProcessor):
 
     def __init__(self, pending_events_repo: PendingEventsRepo,
@@ -103,21 +207,47 @@ class LiveAgentPollingProcessor(BasePollingProcessor):
                  contexts_repo: SessionContextsRepo,
                  invoker: LambdaInvoker,
                  config: Config,
-                 dispatcher: LiveAgentMessageDispatcher):
-        super().__init__(resource_lock_repo, _MAX_COLLECT_SECONDS)
+                 dispatcher: LiveAgentMessageDispatcher,
+                 http_client: AsyncHttpClient):
+        super().__init__(resource_lock_repo, _MAX_COLLECT_SECONDS, config.get_admission_seconds(),
+                         config.concurrent_collectors)
         self.pe_repo = pending_events_repo
         self.resource_lock_repo = resource_lock_repo
         self.contexts_repo = contexts_repo
         self.invoker = invoker
-        self.max_sessions = config.sessions_per_live_agent_poll_processor
+        self.async_polling = config.live_agent_poll_async
+        if self.async_polling:
+            self.max_sessions = config.sessions_per_async_live_agent_poll_processor
+        else:
+            self.max_sessions = config.sessions_per_live_agent_poll_processor
+        self.executor_threads = config.live_agent_poll_executor_threads
+        self.sticky_seconds = config.live_agent_sticky_poll_seconds
+        self.max_polling_seconds = config.max_polling_seconds
         self.refresh_seconds = config.live_agent_poll_session_seconds
         self.dispatcher = dispatcher
+        self.http_client = http_client
 
     @classmethod
     def lock_name(cls) -> str:
         return "lap-collect"
 
     def create_group(self) -> AbstractProcessorGroup:
+        # The group is created when the invocation starts
+        deadline = Timer(self.max_polling_seconds)
+        if self.async_polling:
+            return AsyncProcessorGroup(
+                self.resource_lock_repo,
+                self.pe_repo,
+                self.contexts_repo,
+                self.refresh_seconds,
+                self.max_sessions,
+                self.dispatcher,
+                self.invoker,
+                deadline,
+                self.http_client,
+                self.executor_threads,
+                self.sticky_seconds
+            )
         return ProcessorGroup(
             self.resource_lock_repo,
             self.pe_repo,
@@ -125,5 +255,7 @@ class LiveAgentPollingProcessor(BasePollingProcessor):
             self.refresh_seconds,
             self.max_sessions,
             self.dispatcher,
-            self.invoker
+            self.invoker,
+            deadline,
+            self.sticky_seconds
         )
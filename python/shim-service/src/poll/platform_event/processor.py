@@ -1,5 +1,5 @@
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, List, Tuple
 
 from grpc import ChannelCredentials
 
@@ -20,9 +20,13 @@ from session import SessionKeyAndUser
 from tenant import PendingTenantEvent, PendingTenantEventType, TenantContextType, TenantContext
 from tenant.repo import PendingTenantEventRepo, TenantContextRepo
 from utils import loghelper
+from utils.threading_utils import map_in_parallel
 
 _MAX_COLLECT_SECONDS = 10
 
+# Max number of threads to use when checking tenants for sessions during prefetch
+_MAX_PREFETCH_THREADS = 8
+
 logger = loghelper.get_logger(__name__)
 
 _USER_ID_FIELD = 'RS_L__User_Id__c'
@@ -46,6 +50,8 @@ class ProcessorGroup(AbstractProcessorGroup):
         self.push_notifier_repo = processor.push_notifier_repo
         self.tenant_context_repo = processor.tenant_context_repo
         self.credentials = processor.credentials
+        # Tenant id to whether the tenant has sessions, and the tenant context
+        self.prefetched: Dict[int, Tuple[bool, Optional[TenantContext]]] = {}
 
     def form_lock_name(self, event: PendingTenantEvent):
         return f"pubsub-{event.tenant_id}"
@@ -56,14 +62,33 @@ class ProcessorGroup(AbstractProcessorGroup):
     def update_action_time(self, event: PendingTenantEvent, seconds_in_future: int) -> bool:
         return self.pending_tenant_events_repo.update_action_time(event, seconds_in_future)
 
+    def __has_sessions(self, tenant_id: int) -> bool:
+        return self.sessions_repo.has_sessions_with_platform_channel_type(tenant_id, X1440_PLATFORM.name)
+
+    def prefetch(self, events: List[PendingTenantEvent]):
+        tenant_ids = list({event.tenant_id for event in events})
+        has_sessions = map_in_parallel(tenant_ids, _MAX_PREFETCH_THREADS, self.__has_sessions)
+        contexts = self.tenant_context_repo.find_contexts(TenantContextType.X1440, tenant_ids)
+        with self.mutex:
+            for tenant_id, tenant_has_sessions in zip(tenant_ids, has_sessions):
+                self.prefetched[tenant_id] = (tenant_has_sessions, contexts.get(tenant_id))
+
     def should_poll(self, le: LockAndEvent) -> bool:
         event: PendingTenantEvent = le.event
-        if not self.sessions_repo.has_sessions_with_platform_channel_type(event.tenant_id, X1440_PLATFORM.name):
+        with self.mutex:
+            prefetched = self.prefetched.pop(event.tenant_id, None)
+        if prefetched is not None:
+            has_sessions, context = prefetched
+        else:
+            has_sessions = self.__has_sessions(event.tenant_id)
+            context = None
+        if not has_sessions:
             logger.info(f"Tenant {le.event.tenant_id} has no sessions.")
             self.pending_tenant_events_repo.delete_event(le.event)
             return False
 
-        context = self.tenant_context_repo.find_context(TenantContextType.X1440, event.tenant_id)
+        if prefetched is None:
+            context = self.tenant_context_repo.find_context(TenantContextType.X1440, event.tenant_id)
         if context is None:
             context = TenantContext(TenantContextType.X1440, event.tenant_id, 0, EMPTY_CONTEXT)
 
@@ -139,7 +164,8 @@ class X1440PollingProcessor(BasePollingProcessor):
                  topic: str,
                  credentials: ChannelCredentials,
                  pubsub_service: PubSubService):
-        super().__init__(resource_lock_repo, _MAX_COLLECT_SECONDS)
+        super().__init__(resource_lock_repo, _MAX_COLLECT_SECONDS, config.get_admission_seconds(),
+                         config.concurrent_collectors)
         self.pending_tenant_event_repo = pending_tenant_event_repo
         self.sessions_repo = sessions_repo
         self.user_sessions_repo = user_sessions_repo
@@ -1,7 +1,8 @@
 import abc
+import random
 import time
 from threading import Thread, RLock
-from typing import List, Callable, Optional, TypeVar, Any
+from typing import List, Callable, Optional, TypeVar, Any, Iterable
 
 from repos import QueryResult
 from repos.resource_lock import ResourceLockRepo, ResourceLock
@@ -15,6 +16,12 @@ E = TypeVar("E")
 
 logger = loghelper.get_logger(__name__)
 
+# How long to wait for other workers to finish, so their events can be released together
+_RELEASE_LINGER_MILLIS = 250
+
+# Max number of threads to use when locking the resources for the events being added
+_MAX_LOCK_THREADS = 8
+
 
 class LockAndEvent:
     def __init__(self, event: E, lock: ResourceLock):
@@ -59,9 +66,14 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
         self.threads: List[Thread] = []
         self.submit_count = 0
         self.working_count = 0
+        self.finished_count = 0
         self.mutex = RLock()
         self.signal_event = SignalEvent()
         self.invoke_throttler = Throttler(10000, self.invoke_lambda)
+        self.releases: List[E] = []
+        self.release_throttler = Throttler(_RELEASE_LINGER_MILLIS, self.__flush_releases)
+        self.admitting = False
+        self.invoke_deferred = False
 
     @abc.abstractmethod
     def invoke_lambda(self):
@@ -75,6 +87,16 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
     def update_action_time(self, event: E, seconds_in_future: int) -> bool:
         raise NotImplementedError()
 
+    def update_action_times(self, events: List[E], seconds_in_future: int) -> List[E]:
+        """
+        Updates the action time for the given events. Groups can override this to update them in bulk.
+
+        :param events: the events.
+        :param seconds_in_future: the number of seconds in the future to set the action time to.
+        :return: the events that could not be updated.
+        """
+        return [event for event in events if not self.update_action_time(event, seconds_in_future)]
+
     @abc.abstractmethod
     def poll(self, le: LockAndEvent):
         raise NotImplementedError()
@@ -84,28 +106,83 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
             self.submit_count -= 1
             self.signal_event.notify()
 
+    def worker_finished(self):
+        with self.mutex:
+            self.finished_count += 1
+
+    def has_capacity(self) -> bool:
+        """
+        :return: True if collect() would be able to add events, since workers have finished.
+        """
+        with self.mutex:
+            return self.working_count - self.finished_count + self.submit_count < self.max_working_count
+
     def invoke_again(self):
+        with self.mutex:
+            if self.admitting:
+                # We will pick it up ourselves
+                self.invoke_deferred = True
+                return
         self.invoke_throttler.add_invocation()
 
+    def start_admitting(self):
+        """
+        Called when the processor will keep collecting events as workers finish. Until stop_admitting() is called,
+        invoking another poller for released events is deferred, since this one will pick them up.
+        """
+        with self.mutex:
+            self.admitting = True
+
+    def stop_admitting(self):
+        with self.mutex:
+            self.admitting = False
+            deferred = self.invoke_deferred
+            self.invoke_deferred = False
+        if deferred:
+            self.invoke_throttler.add_invocation()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release_throttler.close()
         self.invoke_throttler.close()
 
+    def release_event(self, event: E):
+        """
+        Queues the event to have its action time reset, so it can be polled again. Releases are written in bulk.
+        """
+        with self.mutex:
+            self.releases.append(event)
+        self.release_throttler.add_invocation()
+
+    def __flush_releases(self):
+        with self.mutex:
+            events = self.releases
+            self.releases = []
+        if len(events) > 0:
+            try:
+                self.update_action_times(events, 0)
+            except BaseException as ex:
+                logger.severe(f"Failed to release {len(events)} event(s)", ex=ex)
+
     def should_poll(self, le: LockAndEvent) -> bool:
         raise NotImplementedError()
 
-    def __inner_worker(self, event: E):
-        # First, try to lock the resource for the event
-        le = None
-        try:
-            le = self.__try_lock(event)
-        finally:
-            if le is None:
-                self.dec_submit_count()
-        if le is None:
-            return
+    def prefetch(self, events: List[E]):
+        """
+        Called with the events admitted during collect(), once they are locked and claimed, before workers are
+        started for them. Groups can override this to load what should_poll() needs for all the events in bulk.
+        Each worker gets to should_poll(), which should remove what was loaded for its event.
+
+        The events were claimed at the exact version that was queried, so anything loaded here is at least as
+        recent as the last poll of the event.
+
+        :param events: the events.
+        """
+        pass
+
+    def __inner_worker(self, le: LockAndEvent):
         logger.info("Worker starting.")
         with le:
             le.after_release = self.invoke_again
@@ -122,16 +199,18 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
             try:
                 self.poll(le)
                 if le.update_action_time:
-                    self.update_action_time(le.event, 0)
+                    self.release_event(le.event)
 
             except BaseException as ex:
                 logger.severe(f"Failed during poll: {exception_utils.dump_ex(ex)}")
+            finally:
+                self.worker_finished()
 
         logger.info("Worker ending.")
 
-    def worker(self, event: E):
+    def worker(self, le: LockAndEvent):
         try:
-            self.__inner_worker(event)
+            self.__inner_worker(le)
         except BaseException as ex:
             logger.severe("Exception invoking worker", ex=ex)
 
@@ -142,11 +221,76 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
         :param event: the event.
         :return: False if we are processing the max events.
         """
-        if not self.is_full(True):
-            t = threading_utils.start_thread(self.worker, user_object=event)
-            self.threads.append(t)
-            return True
-        return False
+        return self.add_all([event])
+
+    def add_all(self, events: Iterable[E]) -> bool:
+        """
+        Try to add the events for processing. The resources for the events are locked first, and the action times
+        of the events that were locked are claimed in bulk. Events that are locked, or were claimed by another
+        poller in the meantime, are skipped and left as they are.
+
+        :param events: the events.
+        :return: False if we are processing the max events, before all the events were added.
+        """
+        events = list(events)
+        while len(events) > 0:
+            if self.is_full(True):
+                return False
+            admitted = [events.pop(0)]
+            while len(events) > 0 and self.__try_reserve():
+                admitted.append(events.pop(0))
+            self.__start(admitted)
+        return True
+
+    def __try_reserve(self) -> bool:
+        with self.mutex:
+            if self.working_count + self.submit_count < self.max_working_count:
+                self.submit_count += 1
+                return True
+            return False
+
+    def __try_lock(self, event: E) -> Optional[LockAndEvent]:
+        try:
+            return self.try_lock(event)
+        except BaseException as ex:
+            logger.severe(f"Failed to lock {event}", ex=ex)
+            return None
+
+    def __start(self, events: List[E]):
+        locked = [le for le in threading_utils.map_in_parallel(events, _MAX_LOCK_THREADS, self.__try_lock)
+                  if le is not None]
+        for _ in range(len(events) - len(locked)):
+            self.dec_submit_count()
+        if len(locked) == 0:
+            return
+
+        try:
+            conflicts = self.update_action_times(list(map(lambda le: le.event, locked)), self.refresh_seconds)
+        except BaseException as ex:
+            logger.severe(f"Failed to claim {len(locked)} event(s)", ex=ex)
+            conflicts = list(map(lambda le: le.event, locked))
+        conflict_ids = set(map(id, conflicts))
+        claimed = []
+        for le in locked:
+            if id(le.event) in conflict_ids:
+                le.lock.release()
+                self.dec_submit_count()
+            else:
+                claimed.append(le)
+        if len(claimed) == 0:
+            return
+
+        try:
+            self.prefetch(list(map(lambda le: le.event, claimed)))
+        except BaseException as ex:
+            # Workers will load what they need
+            logger.severe("Failed to prefetch", ex=ex)
+        for le in claimed:
+            self.start_worker(le)
+
+    def start_worker(self, le: LockAndEvent):
+        t = threading_utils.start_thread(self.worker, user_object=le)
+        self.threads.append(t)
 
     def is_empty(self) -> bool:
         return len(self.threads) == 0
@@ -183,17 +327,15 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
             self.signal_event.wait(timer.get_delay_time_millis(50))
         return True
 
-    def __try_lock(self, event: E) -> Optional[LockAndEvent]:
+    def try_lock(self, event: E) -> Optional[LockAndEvent]:
         # We need to lock on tenant id and user id, since we do not want the same user to be polling more than once
         name = self.form_lock_name(event)
         logger.info(f"Attempting to lock resource {name} ...")
         lock = self.resource_lock_repo.try_acquire(name, self.refresh_seconds)
         if lock is None:
             logger.info(f"{name} is currently locked.")
-        elif lock.execute_and_release_on_false(lambda:
-                                               self.update_action_time(event, self.refresh_seconds)):
-            return LockAndEvent(event, lock)
-        return None
+            return None
+        return LockAndEvent(event, lock)
 
     def thread_count(self) -> int:
         return len(self.threads)
@@ -202,7 +344,19 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
     def query_events(self, limit: int, next_token: Any) -> QueryResult:
         raise NotImplementedError()
 
-    def collect(self):
+    def collect(self, random_start: bool = False):
+        """
+        Queries the events that are due, and starts workers for as many as we can handle.
+
+        :param random_start: True to start with a random event in each page, rather than the one that has been due
+        the longest, so collectors running at the same time try to claim different events.
+        """
+        with self.mutex:
+            # The slots of the workers that finished can be used again, and anything released so far will be
+            # found below
+            self.working_count -= self.finished_count
+            self.finished_count = 0
+            self.invoke_deferred = False
         # Sleep for a bit, so we can get as many as possible
         time.sleep(.5)
         next_token = None
@@ -217,13 +371,15 @@ class AbstractProcessorGroup(metaclass=abc.ABCMeta):
                 if next_token is None:
                     break
             else:
-                for event in result.rows:
-                    if not self.add(event):
-                        full = True
-                        break
+                rows = result.rows
+                if random_start:
+                    offset = random.randrange(len(rows))
+                    rows = rows[offset:] + rows[:offset]
+                if not self.add_all(rows):
+                    full = True
             if full or next_token is None or self.is_full():
                 break
 
         if full or next_token is not None:
             # This means we have more than the max out there, let another process grab them
-            self.invoke_again()
+            self.invoke_throttler.add_invocation()
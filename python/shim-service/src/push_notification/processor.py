@@ -39,7 +39,10 @@ class PushNotificationProcessor(InvocableBeanRequestHandler):
             self.push_notifier.send_push_notification(entry.token, data)
             settings.last_seq_no = record.seq_no
             new_context = entry.context.set_session_data(settings.serialize())
-            self.push_notification_repo.set_sent(record, new_context)
+            # Recorded before the next send, so a failure never causes more than one duplicate
+            if not self.push_notification_repo.set_sent(record, new_context):
+                logger.warning(f"Failed to record notification seq_no {record.seq_no} as sent.")
+                return False
             entry.context = new_context
             return True
         except BaseException as ex:
@@ -65,7 +68,7 @@ class PushNotificationProcessor(InvocableBeanRequestHandler):
         count = 0
         ctx = entry.context
         settings = PushNotificationContextSettings.deserialize(ctx.session_data)
-        result_set = self.push_notification_repo.query_notifications(ctx, settings.last_seq_no)
+        result_set = self.push_notification_repo.query_notifications(ctx)
         for record in result_set:
             if not self.__process_record(settings, entry, record):
                 break
@@ -1,3 +1,7 @@
+from typing import Dict, Any, Optional
+
+from aws.dynamodb_keys import DEFAULT_DELIMITER
+
 SHIM_SERVICE_VIRTUAL_RANGE_TABLE = "ShimServiceVirtualRangeTable"
 SHIM_SERVICE_VIRTUAL_TABLE = "ShimServiceVirtualTable"
 SHIM_SERVICE_EVENT_TABLE = "ShimServiceEvent"
@@ -23,4 +27,41 @@ PENDING_EVENT_TABLE = VirtualTable('PendingEvent', 'g')
 WORK_ID_MAP_TABLE = VirtualTable('WorkIdMap', 'h')
 PENDING_TENANT_EVENT_TABLE = VirtualTable('PendingTenantEvent', 'i')
 TENANT_CONTEXT_TABLE = VirtualTable('TenantContext', 'j')
+PLATFORM_SESSION_TABLE = VirtualTable('PlatformSession', 'k')
+UNSENT_PUSH_NOTIFICATION_TABLE = VirtualTable('UnsentPushNotification', 'l')
+
+
+VIRTUAL_TABLES = (
+    SEQUENCE_TABLE,
+    SFDC_SESSION_TABLE,
+    USER_SESSION_TABLE,
+    SESSION_CONTEXT_TABLE,
+    PUSH_NOTIFICATION_TABLE,
+    RESOURCE_LOCK_TABLE,
+    PENDING_EVENT_TABLE,
+    WORK_ID_MAP_TABLE,
+    PENDING_TENANT_EVENT_TABLE,
+    TENANT_CONTEXT_TABLE,
+    PLATFORM_SESSION_TABLE,
+    UNSENT_PUSH_NOTIFICATION_TABLE
+)
+
+_VIRTUAL_TABLES_BY_TYPE = {t.table_type: t for t in VIRTUAL_TABLES}
+
+
+def resolve_virtual_table_name(table_name: str, key: Dict[str, Any]) -> Optional[str]:
+    """
+    Resolves the virtual table name from the table type at the start of the hash key.
 
+    :param table_name: the physical table name.
+    :param key: the key (or item), in DynamoDB format.
+    :return: the virtual table name, or None if the table is not a virtual table.
+    """
+    if table_name != SHIM_SERVICE_VIRTUAL_TABLE and table_name != SHIM_SERVICE_VIRTUAL_RANGE_TABLE:
+        return None
+    value = key.get(VIRTUAL_HASH_KEY)
+    hash_key = value.get('S') if value is not None else None
+    if hash_key is None:
+        return None
+    table = _VIRTUAL_TABLES_BY_TYPE.get(hash_key.split(DEFAULT_DELIMITER, 1)[0])
+    return table.name if table is not None else None
@@ -1,14 +1,17 @@
 import abc
-from typing import Dict, Any, Optional, Tuple, Callable, List, Union, Collection
+from typing import Dict, Any, Optional, Tuple, Callable, List, Union, Collection, Mapping
 
 from aws.dynamodb import DynamoDb, PrimaryKeyViolationException, PutItemRequest, TransactionCancelledException, \
     DynamoDbRow, PreconditionFailedException, DeleteItemRequest, TransactionRequest, UpdateItemRequest, \
-    RangeKeyQuerySpecifier, GetItemRequest, DynamoDbItem, FilterOperation, BatchCapableRequest
+    RangeKeyQuerySpecifier, GetItemRequest, FilterOperation, BatchCapableRequest, BatchWriteResult, \
+    ConditionCheckRequest
 from aws.dynamodb_keys import create_primary_key, _find_attribute, CompoundKey
 from repos import OptimisticLockException, Record, QueryResult, QueryResultSet
 from repos.aws import VirtualTable
+from repos.aws.read_consistency import ConsistencyPolicy, VersionTracker, ReadConsistency, note_writes
 from utils import loghelper
 from utils.date_utils import get_system_time_in_millis
+from utils.dict_utils import get_or_create
 
 INITIALIZER_ATTRIBUTE = '__initializer__'
 
@@ -20,18 +23,39 @@ TABLE_NAME_ATTRIBUTE = "__table_name__"
 
 BatchGetResultItem = Optional[Union[Record, DynamoDbRow]]
 
+# Table name and canonical key
+BatchGetKey = Tuple[str, Tuple[Tuple[str, Any], ...]]
+
 logger = loghelper.get_logger(__name__)
 
 
+def _canonical_key(keys: Mapping[str, Any]) -> Tuple[Tuple[str, Any], ...]:
+    return tuple(sorted(keys.items()))
+
+
 class BatchGetResult:
-    def __init__(self, entries: List[BatchGetResultItem], row_count: int):
+    def __init__(self, entries: List[BatchGetResultItem], row_count: int,
+                 key_index: Dict[BatchGetKey, int] = None):
+        """
+        :param entries: the entries, in the same order as the requests. None for items that were not found.
+        :param row_count: the number of items found.
+        :param key_index: the request index by table name and canonical key.
+        """
         self.entries = entries
         self.row_count = row_count
         self.index = 0
+        self.key_index = key_index if key_index is not None else {}
 
     def get_entry_at(self, index: int) -> Optional[BatchGetResultItem]:
         return self.entries[index]
 
+    def get_entry(self, table_name: str, keys: Mapping[str, Any]) -> Optional[BatchGetResultItem]:
+        """
+        Finds the entry for the given key, as used in the GetItemRequest.
+        """
+        index = self.key_index.get((table_name, _canonical_key(keys)))
+        return self.entries[index] if index is not None else None
+
     def get_next_entry(self) -> Optional[BatchGetResultItem]:
         if self.index == self.row_count:
             raise IndexError()
@@ -57,6 +81,8 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         self.primary_key = create_primary_key(self)
         self.state_counter_attribute = self.find_attribute(STATE_COUNTER_ATTRIBUTE, "stateCounter")
         self.update_time_attribute = self.find_attribute(UPDATE_TIME_ATTRIBUTE, "updateTime")
+        self.consistency_policy = ConsistencyPolicy()
+        self.version_tracker = VersionTracker(self.state_counter_attribute, self.update_time_attribute)
 
     def find_attribute(self, name: str, default_value_if_true: Any = None):
         v = _find_attribute(self, name)
@@ -79,9 +105,10 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         item = self.prepare_item(entry)
         try:
             self.ddb.put_item(self.table_name, item, key_attributes=self.primary_key.key_attributes)
-            return True
         except PrimaryKeyViolationException:
             return False
+        self.__note_put(item)
+        return True
 
     def update_with_state_check(self, entry: Record):
         self.__update_with_state_check(entry, None)
@@ -109,14 +136,14 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         keys = self.primary_key.build_key_as_dict(item)
         condition = {self.state_counter_attribute: current_state_counter}
         if not apply_now:
-            return UpdateItemRequest(
+            return self.__own(UpdateItemRequest(
                 self.table_name,
                 keys=keys,
                 item=patches,
                 condition=condition,
                 must_exist=True,
                 virtual_table_name=self.__get_virtual_table_name()
-            )
+            ))
         try:
             self.ddb.update_item(
                 table_name=self.table_name,
@@ -126,19 +153,45 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
             )
         except PreconditionFailedException:
             raise OptimisticLockException()
+        self.version_tracker.observe_write(_canonical_key(keys), patches)
         return None
 
+    def note_write(self, request: TransactionRequest):
+        """
+        Records a request created by this repo that was written, i.e. as part of a transaction, so that validated
+        reads do not go back to an older version.
+
+        :param request: the request.
+        """
+        if isinstance(request, PutItemRequest):
+            self.__note_put(request.item)
+        elif isinstance(request, UpdateItemRequest):
+            self.version_tracker.observe_write(_canonical_key(request.keys), request.item)
+        elif isinstance(request, DeleteItemRequest):
+            self.version_tracker.observe_write(_canonical_key(request.keys), None)
+
+    def __note_put(self, item: DynamoDbRow):
+        keys = {name: item[name] for name in self.primary_key.key_attributes}
+        self.version_tracker.observe_write(_canonical_key(keys), item)
+
+    def __own(self, request: Union[TransactionRequest, GetItemRequest]):
+        # So that reads can be validated, and writes recorded, for the repo the request is for
+        setattr(request, 'repo', self)
+        return request
+
     def patch(self, entry: Record, patches: Dict[str, Any]) -> bool:
         item = self.prepare_item(entry)
+        keys = self.primary_key.build_key_as_dict(item, pre_serialized=True)
         try:
             self.ddb.update_item(
                 table_name=self.table_name,
-                keys=self.primary_key.build_key_as_dict(item, pre_serialized=True),
+                keys=keys,
                 item=patches
             )
-            return True
         except PreconditionFailedException:
             return False
+        self.version_tracker.observe_write(_canonical_key(keys), patches)
+        return True
 
     def patch_from_args(self, *args, patches: Dict[str, Any]) -> bool:
         key, _ = self.primary_key.build_key_from_args(*args)
@@ -148,19 +201,20 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
                 keys=key,
                 item=patches
             )
-            return True
         except PreconditionFailedException:
             return False
+        self.version_tracker.observe_write(_canonical_key(key), patches)
+        return True
 
     def create_patch_from_args_request(self, *args, patches: Dict[str, Any], must_exist: bool = False):
         key, _ = self.primary_key.build_key_from_args(*args)
-        return UpdateItemRequest(
+        return self.__own(UpdateItemRequest(
             self.table_name,
             keys=key,
             item=patches,
             must_exist=must_exist,
             virtual_table_name=self.__get_virtual_table_name()
-        )
+        ))
 
     def patch_with_condition_bool(self, entry: Record,
                                   condition_property: str,
@@ -181,15 +235,17 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         if patches is None:
             patches = {}
         patches[condition_property] = new_value
+        keys = self.primary_key.build_key_as_dict(item, pre_serialized=True)
         try:
             self.ddb.update_item(
                 table_name=self.table_name,
-                keys=self.primary_key.build_key_as_dict(item, pre_serialized=True),
+                keys=keys,
                 item=patches,
                 condition={condition_property: current_value}
             )
         except PreconditionFailedException:
             raise OptimisticLockException()
+        self.version_tracker.observe_write(_canonical_key(keys), patches)
 
     def replace(self, entry: Record):
         """
@@ -199,7 +255,9 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         :return: True if the item was created, False if it was updated.
         """
         item = self.prepare_item(entry)
-        return 'Attributes' not in self.ddb.put_item(self.table_name, item, return_old=True)
+        created = 'Attributes' not in self.ddb.put_item(self.table_name, item, return_old=True)
+        self.__note_put(item)
+        return created
 
     def find(self, *args, **kwargs) -> Optional[Any]:
         consistent = kwargs.pop('consistent', False)
@@ -209,95 +267,188 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
             return item
         return self.deserialize_record(item)
 
+    def find_with_policy(self, call_site: str, *args) -> Optional[Any]:
+        """
+        Finds an item, with the read consistency the policy has for the given call site.
+
+        :param call_site: the call site.
+        :param args: the key values.
+        :return: the item, or None if it was not found.
+        """
+        consistency = self.consistency_policy.get(call_site)
+        key, _ = self.primary_key.build_key_from_args(*args)
+        canonical_key = _canonical_key(key)
+        stale = False
+        consistent = consistency == ReadConsistency.STRONG or (
+                consistency == ReadConsistency.VALIDATED and self.version_tracker.must_read_consistent(canonical_key))
+        item = self.ddb.find_item(self.table_name, key, consistent=consistent)
+        if not consistent and consistency == ReadConsistency.VALIDATED and \
+                not self.version_tracker.is_current(canonical_key, item):
+            stale = True
+            consistent = True
+            item = self.ddb.find_item(self.table_name, key, consistent=True)
+        self.ddb.accounting.record_read(call_site, consistency.value, stale)
+        # An eventually consistent read that finds nothing does not mean the item is gone
+        if item is not None or consistent:
+            self.version_tracker.observe(canonical_key, item, consistent)
+        if item is None:
+            return item
+        return self.deserialize_record(item)
+
+    def is_consistent_read(self, call_site: str) -> bool:
+        """
+        Use this for queries, which have nothing to validate against. Only strong consistency reads consistently.
+
+        :param call_site: the call site.
+        :return: True if the read should be consistent.
+        """
+        consistency = self.consistency_policy.get(call_site)
+        self.ddb.accounting.record_read(call_site, consistency.value)
+        return consistency == ReadConsistency.STRONG
+
     def create_get_item_request_from_args(self, *args,
                                           consistent: bool = False,
                                           attributes_to_get: List[str] = None) -> GetItemRequest:
 
         key, _ = self.primary_key.build_key_from_args(*args)
-        if self.virtual_table is not None and (attributes_to_get is not None and len(attributes_to_get) > 0):
-            raise NotImplementedError("Projecting attributes is not supported with virtual tables")
         if attributes_to_get is not None:
-            # We need to ensure that the primary key attributes are included so that we can match them up later
-            att_set = set(attributes_to_get)
-            att_set.update(key.keys())
-            attributes_to_get = list(att_set)
+            # We need to ensure that the primary key attributes are included so that we can match them up later.
+            # For virtual tables, the key attributes (and tableType) are stored in the key itself.
+            attributes_to_get = self.primary_key.map_attributes(attributes_to_get)
 
-        req = GetItemRequest(
+        return self.__own(GetItemRequest(
             self.table_name,
             key,
             consistent=consistent,
             attributes_to_get=attributes_to_get
-        )
-        setattr(req, 'repo', self)
-        return req
+        ))
 
-    def batch_write(self, requests: List[BatchCapableRequest]):
-        self.ddb.batch_write(requests)
+    def batch_write(self, requests: List[BatchCapableRequest]) -> BatchWriteResult:
+        result = self.ddb.batch_write(requests)
+        note_writes(requests)
+        return result
 
-    def batch_get(self, requests: List[GetItemRequest]) -> BatchGetResult:
+    def batch_get_with_policy(self, call_site: str, requests: List[GetItemRequest]) -> BatchGetResult:
+        """
+        Same as batch_get(), with the read consistency the policy has for the given call site. With validated
+        consistency, all the items are read again with a consistent read if any of them is stale.
 
-        # Collect the requests such that we can reconcile them after. This is because DynamoDB will return them
-        # in a random order due to parallel processing.
-        counter = 0
-        requests_to_match = []
-        for req in requests:
-            requests_to_match.append((req, counter))
-            counter += 1
-
-        def key_matches(row_key: DynamoDbRow, tracker_key: DynamoDbRow):
-            for key, value in tracker_key.items():
-                if row_key.get(key) != value:
-                    return False
-            return True
+        :param call_site: the call site.
+        :param requests: the requests, created with create_get_item_request_from_args().
+        :return: the result, with the entries in the same order as the requests.
+        """
+        consistency = self.consistency_policy.get(call_site)
+        consistent = consistency == ReadConsistency.STRONG
+        if consistency == ReadConsistency.VALIDATED:
+            # Nothing to validate an item written without a version against
+            consistent = any(getattr(request, 'repo').version_tracker.must_read_consistent(
+                _canonical_key(request.keys)) for request in requests)
+        for request in requests:
+            request.consistent = consistent
+        rows, key_index = self.__get_rows(requests)
+        stale = False
+        if not consistent and consistency == ReadConsistency.VALIDATED:
+            for request, row in zip(requests, rows):
+                repo: AbstractAwsRepo = getattr(request, 'repo')
+                if not repo.version_tracker.is_current(_canonical_key(request.keys), row):
+                    stale = True
+                    break
+            if stale:
+                for request in requests:
+                    request.consistent = True
+                rows, key_index = self.__get_rows(requests)
+        self.ddb.accounting.record_read(call_site, consistency.value, stale)
+        return self.__create_batch_get_result(requests, rows, key_index)
+
+    def batch_get(self, requests: List[GetItemRequest]) -> BatchGetResult:
+        """
+        Gets the items for the given requests, which can be for any repo. Any number of requests is allowed, they
+        are split into chunks of 100 by DynamoDb.batch_get().
 
-        def find_match(table_name: str, row_key: DynamoDbItem) -> Optional[Tuple[GetItemRequest, int, AbstractAwsRepo]]:
-            counter = 0
-            for req, index in requests_to_match:
-                if req.table_name == table_name and key_matches(row_key, req.keys):
-                    del requests_to_match[counter]
-                    return req, index, getattr(req, 'repo')
-                counter += 1
+        :param requests: the requests, created with create_get_item_request_from_args().
+        :return: the result, with the entries in the same order as the requests.
+        """
+        rows, key_index = self.__get_rows(requests)
+        return self.__create_batch_get_result(requests, rows, key_index)
 
+    def __get_rows(self, requests: List[GetItemRequest]) -> Tuple[List[Optional[DynamoDbRow]],
+                                                                  Dict[BatchGetKey, int]]:
+        # Index the requests such that we can reconcile the rows after. This is because DynamoDB will return them
+        # in a random order due to parallel processing.
+        key_index: Dict[BatchGetKey, int] = {}
+        key_names: Dict[str, List[Tuple[str, ...]]] = {}
+        for index, req in enumerate(requests):
+            canonical_key = _canonical_key(req.keys)
+            key_index[(req.table_name, canonical_key)] = index
+            names = tuple(map(lambda kv: kv[0], canonical_key))
+            table_key_names = get_or_create(key_names, req.table_name, list)
+            if names not in table_key_names:
+                table_key_names.append(names)
+
+        def find_index(table_name: str, row: DynamoDbRow) -> Optional[int]:
+            for names in key_names.get(table_name, ()):
+                index = key_index.get((table_name, tuple((name, row.get(name)) for name in names)))
+                if index is not None:
+                    return index
             return None
 
         results = self.ddb.batch_get(requests)
+        rows: List[Optional[DynamoDbRow]] = [None] * len(requests)
+        for table_name, table_rows in results.items():
+            for row in table_rows:
+                index = find_index(table_name, row)
+                if index is not None and rows[index] is None:
+                    rows[index] = row
+        return rows, key_index
+
+    @staticmethod
+    def __create_batch_get_result(requests: List[GetItemRequest],
+                                  rows: List[Optional[DynamoDbRow]],
+                                  key_index: Dict[BatchGetKey, int]) -> BatchGetResult:
         result_list = [None] * len(requests)
         match_count = 0
-        for table_name, rows in results.items():
-            if len(rows) < 1:
+        for index, row in enumerate(rows):
+            if row is None:
                 continue
-            for row in rows:
-                match = find_match(table_name, row)
-                if match is None:
-                    continue
-                match_count += 1
-                request = match[0]
-                repo = match[2]
-                result_list[match[1]] = repo.deserialize_record(row) if request.attributes_to_get is None else row
+            match_count += 1
+            request = requests[index]
+            repo: AbstractAwsRepo = getattr(request, 'repo')
+            repo.version_tracker.observe(_canonical_key(request.keys), row, request.consistent)
+            if request.attributes_to_get is None:
+                result_list[index] = repo.deserialize_record(row)
+            else:
+                result_list[index] = repo.deserialize_projection(row)
 
-        return BatchGetResult(result_list, match_count)
+        return BatchGetResult(result_list, match_count, key_index)
 
     def delete_entry(self, entry: Record) -> bool:
         item = self.prepare_item(entry)
         key = self.primary_key.build_key_as_dict(item, pre_serialized=True)
-        return self.ddb.delete_item(self.table_name, key)
+        return self.__delete(key)
 
     def delete(self, *args) -> bool:
         key, _ = self.primary_key.build_key_from_args(*args)
-        return self.ddb.delete_item(self.table_name, key)
+        return self.__delete(key)
+
+    def __delete(self, key: Dict[str, Any]) -> bool:
+        deleted = self.ddb.delete_item(self.table_name, key)
+        self.version_tracker.observe_write(_canonical_key(key), None)
+        return deleted
 
     def delete_with_condition(self, entry: Record,
                               condition_property: str,
                               condition_value: Any):
         item = self.prepare_item(entry)
+        keys = self.primary_key.build_key_as_dict(item, pre_serialized=True)
         try:
             self.ddb.delete_item(
                 table_name=self.table_name,
-                keys=self.primary_key.build_key_as_dict(item, pre_serialized=True),
+                keys=keys,
                 condition={condition_property: condition_value}
             )
         except PreconditionFailedException:
             raise OptimisticLockException()
+        self.version_tracker.observe_write(_canonical_key(keys), None)
 
     def query_set(self,
                   *args,
@@ -309,6 +460,7 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
                   filters: Union[FilterOperation, Collection[FilterOperation]] = None,
                   select_attributes: List[str] = None,
                   count_only: bool = False,
+                  prefetch: int = 0
                   ) -> QueryResultSet:
         att, value = self.primary_key.build_hash_key_from_args(*args)
         if start_after is not None:
@@ -329,12 +481,13 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
             att,
             value,
             consistent=consistent,
-            select_attributes=select_attributes,
+            select_attributes=",".join(select_attributes) if select_attributes is not None else None,
             range_key_qualifier=rq,
             limit=limit,
             last_evaluated_key=last_evaluated_key,
             filter_operations=filters,
-            count_only=count_only
+            count_only=count_only,
+            prefetch=prefetch
         )
         results = rset if select_attributes is not None else map(self.deserialize_record, rset)
         return QueryResultSet(results, lambda: rset.next_key, lambda: rset.count_returned)
@@ -368,6 +521,17 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         self.primary_key.prep_for_deserialization(item)
         return self.initializer(item)
 
+    def deserialize_projection(self, item: DynamoDbRow) -> DynamoDbRow:
+        """
+        Prepares a row that was read with a projection. The attributes in the key are restored, but the row is
+        not passed to the initializer since it may be missing attributes.
+
+        :param item: the item.
+        :return: the item.
+        """
+        self.primary_key.prep_for_deserialization(item, include_injected=True)
+        return item
+
     def prepare_put(self, item: DynamoDbRow):
         pass
 
@@ -376,58 +540,69 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
         if len(kwargs) > 0:
             item.update(kwargs)
         self.prepare_put(item)
-        return PutItemRequest(
+        return self.__own(PutItemRequest(
             self.table_name,
             item,
             key_attributes=self.primary_key.key_attributes,
             virtual_table_name=self.__get_virtual_table_name()
-        )
+        ))
 
     def create_update_item_request_from_args(self, patch: Dict[str, Any], *args,
                                              must_exist: bool = True) -> UpdateItemRequest:
         key, _ = self.primary_key.build_key_from_args(*args)
-        return UpdateItemRequest(
+        return self.__own(UpdateItemRequest(
             self.table_name,
             key,
             patch,
             must_exist=must_exist,
             virtual_table_name=self.__get_virtual_table_name()
-        )
+        ))
 
     def create_update_item_request(self, entry: Record, patches: Dict[str, Any], must_exist: bool = True):
         item = self.prepare_item(entry)
         key = self.primary_key.build_key_as_dict(item, pre_serialized=True)
-        return UpdateItemRequest(
+        return self.__own(UpdateItemRequest(
             self.table_name,
             key,
             item=patches,
             must_exist=must_exist,
             virtual_table_name=self.__get_virtual_table_name()
-        )
+        ))
 
     def create_delete_item_request_from_args(self, *args, must_exist: bool = False) -> DeleteItemRequest:
         key, _ = self.primary_key.build_key_from_args(*args)
-        return DeleteItemRequest(
+        return self.__own(DeleteItemRequest(
             self.table_name,
             key,
             must_exist=must_exist,
             virtual_table_name=self.__get_virtual_table_name()
-        )
+        ))
 
     def create_delete_item_request(self, entry: Record, must_exist: bool = False) -> DeleteItemRequest:
         item = self.prepare_item(entry)
         key = self.primary_key.build_key_as_dict(item, pre_serialized=True)
-        return DeleteItemRequest(
+        return self.__own(DeleteItemRequest(
             self.table_name,
             key,
             must_exist=must_exist,
             virtual_table_name=self.__get_virtual_table_name()
-        )
+        ))
+
+    def create_condition_check_request_from_args(self, *args,
+                                                 condition: Union[dict, Tuple[str, dict]] = None,
+                                                 must_exist: bool = True) -> ConditionCheckRequest:
+        key, _ = self.primary_key.build_key_from_args(*args)
+        return self.__own(ConditionCheckRequest(
+            self.table_name,
+            key,
+            condition=condition,
+            must_exist=must_exist,
+            virtual_table_name=self.__get_virtual_table_name()
+        ))
 
     def transact_write(self, requests: Union[List[TransactionRequest], Tuple]) -> Optional[TransactionRequest]:
         try:
             self.ddb.transact_write(requests)
-            return None
         except TransactionCancelledException as ex:
             index = 0
             for r in ex.reasons:
@@ -437,3 +612,5 @@ class AbstractAwsRepo(metaclass=abc.ABCMeta):
                     return req
                 index += 1
             raise ex
+        note_writes(requests)
+        return None
@@ -1,25 +1,56 @@
+import heapq
+import math
+import random
+import time
 from copy import copy
-from typing import Iterable, Any
+from typing import Iterable, Any, Optional, List, Dict, Tuple
 
-from aws.dynamodb import DynamoDb, le_filter
+from farmhash import FarmHash64
+
+from aws.dynamodb import DynamoDb, le_filter, TransactionCancelledException, TransactionRequest, \
+    MAX_TRANSACTION_ITEMS, DynamoDbRow
 from pending_event import PendingEventType, PendingEvent
 from repos import QueryResult
 from repos.aws import PENDING_EVENT_TABLE
 from repos.aws.abstract_range_table_repo import AwsVirtualRangeTableRepo
+from repos.aws.read_consistency import ConsistencyPolicy, QUERY_PENDING_EVENTS, note_writes
 from repos.pending_event_repo import PendingEventsRepo
 from utils import loghelper
+from utils.collection_utils import partition
 from utils.date_utils import get_system_time_in_millis, millis_to_timestamp
+from utils.threading_utils import map_in_parallel
 
 ACTIVE_AT = 'activeAt'
 
+EVENT_TYPE = 'eventType'
+
 logger = loghelper.get_logger(__name__)
 
 _MAX_TENANT_ID = 999999999999
 
+# Each event is moved with a delete and a put
+_MAX_EVENTS_PER_TRANSACTION = MAX_TRANSACTION_ITEMS // 2
+
+_SHARD_DELIMITER = '#'
+
+# Max number of threads to use when querying the shards
+_MAX_QUERY_THREADS = 8
+
+# The only reason a move fails for good: the event was moved or deleted by someone else
+_CONDITIONAL_CHECK_FAILED = 'ConditionalCheckFailed'
+
+# Max number of times to retry events that failed for other reasons, such as a TransactionConflict
+_MAX_MOVE_RETRIES = 3
+
+
+def _format_event_type(event_type: str, shard: int) -> str:
+    # Shard 0 uses the key from before events were sharded, so those events are still found
+    return event_type if shard == 0 else f"{event_type}{_SHARD_DELIMITER}{shard}"
+
 
 class AwsPendingEventsRepo(AwsVirtualRangeTableRepo, PendingEventsRepo):
     __hash_key_attributes__ = {
-        'eventType': str
+        EVENT_TYPE: str
     }
 
     __range_key_attributes__ = {
@@ -30,57 +61,154 @@ class AwsPendingEventsRepo(AwsVirtualRangeTableRepo, PendingEventsRepo):
     __initializer__ = PendingEvent.from_record
     __virtual_table__ = PENDING_EVENT_TABLE
 
-    def __init__(self, ddb: DynamoDb):
+    def __init__(self, ddb: DynamoDb,
+                 consistency_policy: Optional[ConsistencyPolicy] = None,
+                 shard_count: int = 1,
+                 max_shard_count: int = 1):
+        """
+        :param ddb: the DynamoDB instance.
+        :param consistency_policy: the consistency policy.
+        :param shard_count: the number of hash keys new events for each event type are spread over.
+        :param max_shard_count: the number of shards to query, when more than shard_count. Events can be left in
+        the shards past shard_count when it was higher before.
+        """
         super(AwsPendingEventsRepo, self).__init__(ddb)
-
-    def query_events(self, event_type: PendingEventType, limit: int, next_token: Any) -> QueryResult:
-        assert 0 < limit < 100000
-        now = get_system_time_in_millis()
-        results = QueryResult([], next_token)
+        assert shard_count > 0
+        if consistency_policy is not None:
+            self.consistency_policy = consistency_policy
+        self.shard_count = shard_count
+        self.query_shard_count = max(shard_count, max_shard_count)
+
+    def shard_of(self, tenant_id: int, session_id: str) -> int:
+        """
+        Returns the shard new events for the given session go to.
+        """
+        if self.shard_count == 1:
+            return 0
+        return FarmHash64(f"{tenant_id}#{session_id}") % self.shard_count
+
+    def prepare_item(self, entry: PendingEvent) -> Dict[str, Any]:
+        item = entry.to_record()
+        item[EVENT_TYPE] = _format_event_type(item[EVENT_TYPE], entry.shard)
+        self.primary_key.prep_for_serialization(item)
+        return item
+
+    def deserialize_record(self, item: DynamoDbRow):
+        self.primary_key.prep_for_deserialization(item)
+        # The shard is also kept in its own attribute
+        item[EVENT_TYPE] = item[EVENT_TYPE].split(_SHARD_DELIMITER)[0]
+        return self.initializer(item)
+
+    def __query_shard(self, event_type: PendingEventType,
+                      shard: int,
+                      limit: int,
+                      last_evaluated_key: Any,
+                      now: int) -> QueryResult:
         # This madness is because we have a composite range key, and we want to query by the first part of it.
         filter_op = le_filter(None, (now, _MAX_TENANT_ID, "X"))
 
-        result = self.query(
-            event_type.value,
-            consistent=True,
+        return self.query(
+            _format_event_type(event_type.value, shard),
+            consistent=self.is_consistent_read(QUERY_PENDING_EVENTS),
             limit=limit,
-            last_evaluated_key=results.next_token,
+            last_evaluated_key=last_evaluated_key,
             range_filter=filter_op
         )
-        results.rows.extend(result.rows)
-        results.next_token = result.next_token
 
-        return results
+    def query_events(self, event_type: PendingEventType, limit: int, next_token: Any) -> QueryResult:
+        """
+        Queries all the shards, up to the max shard count, and merges the events by action time. Up to limit events
+        are read from each shard, divided by the number of shards, so more than limit events can be returned.
 
-    def update_action_time(self, event: PendingEvent, seconds_in_future: int) -> bool:
+        The next token has the last key of each shard that has more events.
+        """
+        assert 0 < limit < 100000
         now = get_system_time_in_millis()
-        new_action_at = now + (seconds_in_future * 1000)
+        tokens: Dict[int, Any] = next_token if next_token is not None else dict.fromkeys(range(self.query_shard_count))
+        shard_limit = math.ceil(limit / self.query_shard_count)
+
+        def query_shard(shard_and_token: Tuple[int, Any]) -> QueryResult:
+            return self.__query_shard(event_type, shard_and_token[0], shard_limit, shard_and_token[1], now)
+
+        shards = list(tokens.items())
+        results = map_in_parallel(shards, _MAX_QUERY_THREADS, query_shard)
+
+        # Each shard is already sorted by action time
+        rows = list(heapq.merge(*map(lambda r: r.rows, results), key=lambda e: e.active_at))
+        new_tokens = {shard: result.next_token for (shard, _), result in zip(shards, results)
+                      if result.next_token is not None}
+        return QueryResult(rows, new_tokens if len(new_tokens) > 0 else None)
+
+    def __create_move_requests(self, event: PendingEvent, new_action_at: int, now: int) -> List[TransactionRequest]:
         new_event = copy(event)
         new_event.active_at = new_action_at
         new_event.update_time = now
+        # Moved events go to the shard for the current shard count
+        new_event.shard = self.shard_of(event.tenant_id, event.session_id)
+        # Since the action time is in the range key, we need to remove the current record and create a new one
+        return [self.create_delete_item_request(event, must_exist=True), self.create_put_item_request(new_event)]
+
+    def __set_moved(self, event: PendingEvent, new_action_at: int, now: int):
+        event.active_at = new_action_at
+        event.update_time = now
+        event.shard = self.shard_of(event.tenant_id, event.session_id)
+
+    def update_action_time(self, event: PendingEvent, seconds_in_future: int) -> bool:
+        now = get_system_time_in_millis()
+        new_action_at = now + (seconds_in_future * 1000)
 
         logger.info(f"Setting action time for {event} to {millis_to_timestamp(new_action_at)}.")
 
-        # Since the action time is in the range key, we need to remove the current record and create a new one
-        del_req = self.create_delete_item_request(event, must_exist=True)
-        put_req = self.create_put_item_request(new_event)
-        bad_req = self.transact_write([del_req, put_req])
+        bad_req = self.transact_write(self.__create_move_requests(event, new_action_at, now))
         if bad_req is not None:
             return False
-        event.active_at = new_action_at
-        event.update_time = now
+        self.__set_moved(event, new_action_at, now)
         return True
 
-    def update_action_times(self, events: Iterable[PendingEvent], seconds_in_future: int):
-        target = get_system_time_in_millis() + (seconds_in_future * 1000)
-        patches = {'activeAt': target}
-
-        def construct(event: PendingEvent):
-            return self.create_put_item_request(event, **patches)
-
-        requests = list(map(construct, events))
-        if len(requests) > 0:
-            self.batch_write(requests)
+    def __move_events(self, events: List[PendingEvent], new_action_at: int, now: int) -> List[PendingEvent]:
+        conflicts = []
+        retries = 0
+        while len(events) > 0:
+            requests = []
+            for event in events:
+                requests.extend(self.__create_move_requests(event, new_action_at, now))
+            try:
+                self.ddb.transact_write(requests)
+            except TransactionCancelledException as ex:
+                # Each event has two requests
+                codes = {index // 2: r.code for index, r in enumerate(ex.reasons) if r.code is not None}
+                if len(codes) == 0:
+                    raise ex
+                if retries < _MAX_MOVE_RETRIES:
+                    # Drop the events that are gone, and try the rest again
+                    failed = {index for index, code in codes.items() if code == _CONDITIONAL_CHECK_FAILED}
+                    if len(failed) < len(codes):
+                        retries += 1
+                        time.sleep(random.uniform(.01, .05) * retries)
+                else:
+                    failed = set(codes.keys())
+                conflicts.extend(events[index] for index in sorted(failed))
+                events = [event for index, event in enumerate(events) if index not in failed]
+                continue
+
+            note_writes(requests)
+            for event in events:
+                self.__set_moved(event, new_action_at, now)
+            break
+        return conflicts
+
+    def update_action_times(self, events: Iterable[PendingEvent], seconds_in_future: int) -> List[PendingEvent]:
+        now = get_system_time_in_millis()
+        new_action_at = now + (seconds_in_future * 1000)
+        events = list(events)
+        conflicts = []
+        if len(events) > 0:
+            logger.info(f"Setting action time for {len(events)} event(s) to {millis_to_timestamp(new_action_at)}.")
+            for page in partition(events, _MAX_EVENTS_PER_TRANSACTION):
+                conflicts.extend(self.__move_events(page, new_action_at, now))
+            if len(conflicts) > 0:
+                logger.warning(f"Failed to update action time for {len(conflicts)} of {len(events)} event(s).")
+        return conflicts
 
     def delete_event(self, event: PendingEvent) -> bool:
         return self.delete_entry(event)
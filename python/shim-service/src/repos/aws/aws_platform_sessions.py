@@ -0,0 +1,118 @@
+from typing import Dict, Any, List, Iterable
+
+from aws.dynamodb import DynamoDb, PutItemRequest, DeleteItemRequest, DynamoDbRow
+from platform_channels import get_platform_channel_names
+from repos.aws import PLATFORM_SESSION_TABLE
+from repos.aws.abstract_range_table_repo import AwsVirtualRangeTableRepo
+from session import Session
+from utils.date_utils import get_system_time_in_seconds
+
+SESSION_ID = 'sessionId'
+
+# Appended to the platform type for the entry that marks a tenant's sessions as backfilled
+_BACKFILLED_SUFFIX = '#backfilled'
+
+# Session id used for the backfilled marker
+_BACKFILLED_SESSION_ID = '-'
+
+
+class LocalRecord:
+    def __init__(self, tenant_id: int, platform_type: str, session_id: str):
+        self.tenant_id = tenant_id
+        self.platform_type = platform_type
+        self.session_id = session_id
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            'tenantId': self.tenant_id,
+            'platformType': self.platform_type,
+            SESSION_ID: self.session_id
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'LocalRecord':
+        return cls(
+            record['tenantId'],
+            record['platformType'],
+            record[SESSION_ID]
+        )
+
+
+class AwsPlatformSessionsRepo(AwsVirtualRangeTableRepo):
+    """
+    Index of the active sessions for each tenant and platform channel type, so that checking whether a tenant has
+    any does not need to query all the tenant's sessions.
+
+    Entries are written in the same transactions that activate, fail and delete sessions. Sessions that expire are
+    removed by the table listener, along with the session contexts.
+
+    Sessions activated before the index existed are backfilled the first time a tenant's sessions are looked up
+    for a platform type, after which a marker entry (that does not expire) records that it was done.
+    """
+    __hash_key_attributes__ = {
+        'tenantId': int,
+        'platformType': str
+    }
+
+    __range_key_attributes__ = {
+        SESSION_ID: str
+    }
+    __initializer__ = LocalRecord.from_record
+    __virtual_table__ = PLATFORM_SESSION_TABLE
+
+    def __init__(self, ddb: DynamoDb, expiration_seconds: int):
+        super(AwsPlatformSessionsRepo, self).__init__(ddb)
+        self.expiration_seconds = expiration_seconds
+
+    def prepare_put(self, item: DynamoDbRow):
+        # In case the table listener misses the session removal
+        item['expireTime'] = get_system_time_in_seconds() + self.expiration_seconds
+
+    def create_put_requests(self, session: Session) -> List[PutItemRequest]:
+        return list(map(lambda pt: self.create_put_item_request(LocalRecord(session.tenant_id, pt,
+                                                                            session.session_id)),
+                        session.channel_platform_types))
+
+    def create_delete_requests(self, tenant_id: int, session_id: str) -> List[DeleteItemRequest]:
+        return list(map(lambda pt: self.create_delete_item_request_from_args(tenant_id, pt, session_id),
+                        get_platform_channel_names()))
+
+    def build_keys(self, tenant_id: int, session_id: str) -> List[Dict[str, Any]]:
+        return list(map(lambda pt: self.primary_key.build_key_from_args(tenant_id, pt, session_id)[0],
+                        get_platform_channel_names()))
+
+    def has_sessions(self, tenant_id: int, platform_type: str, consistent: bool) -> bool:
+        for _ in self.query_set(tenant_id, platform_type, consistent=consistent, limit=1):
+            return True
+        return False
+
+    def query_session_ids(self, tenant_id: int, platform_type: str, consistent: bool) -> Iterable[str]:
+        result_set = self.query_set(tenant_id, platform_type, consistent=consistent)
+        return map(lambda r: r.session_id, result_set)
+
+    def is_backfilled(self, tenant_id: int, platform_type: str, consistent: bool) -> bool:
+        return self.find(tenant_id, platform_type + _BACKFILLED_SUFFIX, _BACKFILLED_SESSION_ID,
+                         consistent=consistent) is not None
+
+    def create_backfill_request(self, tenant_id: int, platform_type: str, session_id: str) -> PutItemRequest:
+        """
+        Creates the request that adds the entry for a session activated before the index existed. It should be
+        written in a transaction that checks the session is still active, so that an entry is not left behind for
+        a session deleted in the meantime.
+
+        :param tenant_id: the tenant id.
+        :param platform_type: the platform type.
+        :param session_id: the session id.
+        :return: the request, which fails if the entry already exists.
+        """
+        return self.create_put_item_request(LocalRecord(tenant_id, platform_type, session_id))
+
+    def mark_backfilled(self, tenant_id: int, platform_type: str):
+        """
+        Marks the tenant's platform type as backfilled, so that its sessions are not filtered again.
+
+        :param tenant_id: the tenant id.
+        :param platform_type: the platform type.
+        """
+        # Not created with a put request, so it does not expire
+        self.create(LocalRecord(tenant_id, platform_type + _BACKFILLED_SUFFIX, _BACKFILLED_SESSION_ID))
@@ -1,42 +1,35 @@
-from typing import Optional, Any, List, Union, Dict, Callable
-
-from retry import retry
+from threading import RLock
+from typing import Optional, Any, List, Union, Dict, Callable, Tuple
 
 from aws.dynamodb import DynamoDb, TransactionRequest
+from config import DEFAULT_EVENT_SEQUENCE_BLOCK_SIZE
 from events import Event
 from events.event_types import EventType
-from repos import OptimisticLockException
 from repos.aws import SEQUENCE_TABLE
 from repos.aws.abstract_table_repo import AwsVirtualTableRepo
 from repos.aws.aws_events import AwsEventsRepo
 from repos.sequences import SequenceRepo, SequenceCaller
-from utils import date_utils
-from utils.date_utils import get_system_time_in_seconds
 from utils.string_utils import uuid
 
+EVENT_SEQUENCE = 'EventSeq'
+
+
+class SequenceBlock:
+    """
+    A block of sequence numbers reserved by this container.
+    """
 
-class Sequence:
-    def __init__(self,
-                 tenant_id: int,
-                 name: str,
-                 next_value: int,
-                 timeout_at: Optional[int]):
-        self.tenant_id = tenant_id
-        self.name = name
+    def __init__(self, next_value: int, last_value: int):
         self.next_value = next_value
-        self.timeout_at = timeout_at
+        self.last_value = last_value
 
-    def to_record(self):
-        return {
-            'tenantId': self.tenant_id,
-            'sequenceName': self.name,
-            'nextValue': self.next_value,
-            'timeoutAt': self.timeout_at
-        }
+    def remaining(self) -> int:
+        return self.last_value - self.next_value + 1
 
-    @classmethod
-    def from_record(cls, record: dict):
-        return cls(record['tenantId'], record['sequenceName'], record['nextValue'], record.get('timeoutAt'))
+    def take(self, count: int) -> int:
+        first = self.next_value
+        self.next_value += count
+        return first
 
 
 class RequestData:
@@ -46,83 +39,85 @@ class RequestData:
 
 
 class AwsSequenceRepo(AwsVirtualTableRepo, SequenceRepo):
+    """
+    Allocates sequence numbers with an atomic ADD on the 'nextValue' attribute, so there is no lock to take and
+    release around the caller's transaction. 'nextValue' holds the last number handed out.
+
+    When block_size is more than 1, numbers are reserved in blocks (hi/lo) and handed out locally until the block
+    is used up. Numbers are always unique and increasing within a container, but numbers that fail to be used
+    (i.e. a cancelled transaction, or a block left over when the container goes away) leave gaps.
+
+    Numbers are handed out before the caller's transaction commits, so a lower number can commit after a higher
+    one. Readers must not use them as a cursor to skip what they have already seen.
+    """
     __hash_key_attributes__ = {
         'tenantId': int,
         'sequenceName': str
     }
     __virtual_table__ = SEQUENCE_TABLE
-    __initializer__ = Sequence.from_record
+    # Rows are only ever updated with an atomic ADD, never loaded as records
+    __initializer__ = dict
 
-    def __init__(self, ddb: DynamoDb, events_repo: AwsEventsRepo):
+    def __init__(self, ddb: DynamoDb, events_repo: AwsEventsRepo,
+                 block_size: int = DEFAULT_EVENT_SEQUENCE_BLOCK_SIZE):
         super(AwsSequenceRepo, self).__init__(ddb)
         self.events_repo = events_repo
-
-    @retry(exceptions=OptimisticLockException, tries=20, delay=.5, max_delay=30, backoff=.1, jitter=(.1, .9))
-    def __get_current_sequence(self, tenant_id: int,
-                               name: str,
-                               max_lock_seconds: int,
-                               auto_increment: bool = True) -> Sequence:
-        current: Optional[Sequence] = self.find(tenant_id, name, consistent=True)
-        next_timeout = date_utils.get_epoch_seconds_in_future(max_lock_seconds)
-        if current is None:
-            current = Sequence(tenant_id, name, 2, next_timeout)
-            if not self.create(current):
-                raise OptimisticLockException()
-            current.next_value = 1 if auto_increment else 0
-        else:
-            if current.timeout_at > 0 and get_system_time_in_seconds() < current.timeout_at:
-                raise OptimisticLockException()
-            patches = {} if not auto_increment else {'nextValue': current.next_value + 1}
-            self.patch_with_condition(
-                current,
-                "timeoutAt", next_timeout,
-                patches
-            )
-        return Sequence(tenant_id, name, current.next_value, next_timeout)
+        self.block_size = block_size
+        self.__blocks: Dict[Tuple[int, str], SequenceBlock] = {}
+        self.__mutex = RLock()
+
+    def __reserve(self, tenant_id: int, name: str, count: int) -> int:
+        key, _ = self.primary_key.build_key_from_args(tenant_id, name)
+        last_value = self.ddb.increment(self.table_name, key, 'nextValue', count)
+        return last_value - count + 1
+
+    def allocate(self, tenant_id: int, name: str, count: int = 1) -> int:
+        """
+        Allocates consecutive sequence numbers.
+
+        :param tenant_id: the tenant id.
+        :param name: the sequence name.
+        :param count: the number of values to allocate.
+        :return: the first value allocated.
+        """
+        if self.block_size <= 1 or count >= self.block_size:
+            return self.__reserve(tenant_id, name, count)
+        block_key = (tenant_id, name)
+        with self.__mutex:
+            block = self.__blocks.get(block_key)
+            if block is None or block.remaining() < count:
+                first = self.__reserve(tenant_id, name, self.block_size)
+                block = self.__blocks[block_key] = SequenceBlock(first, first + self.block_size - 1)
+            return block.take(count)
 
     def execute_with_events(self,
                             tenant_id: int,
                             event_type: EventType,
                             num_requests: int,
-                            data_creator: Callable[[int], RequestData],
-                            max_lock_seconds: int = 30):
+                            data_creator: Callable[[int], RequestData]):
         # Max is 100, we need an event for each request, so we can't allow more than 50 here.
         assert num_requests < 50
-        seq_update = self.__get_current_sequence(tenant_id, 'EventSeq', max_lock_seconds)
-        original = seq_update.next_value
-        good = False
-        try:
-            request_list = []
-            for i in range(num_requests):
-                seq_update.next_value += 1
-                data = data_creator(seq_update.next_value)
-                event = Event(
-                    tenant_id,
-                    seq_update.next_value,
-                    event_type,
-                    uuid(),
-                    data.event_data
-                )
-                request_list.append(self.events_repo.create_put_item_request(event))
-                request_list.append(data.request)
-            bad_req = self.transact_write(request_list)
-            good = bad_req is None
-            return bad_req
-        finally:
-            if not good:
-                seq_update.next_value = original
-            self.patch_with_condition(
-                seq_update,
-                "timeoutAt",
-                0
+        seq_no = self.allocate(tenant_id, EVENT_SEQUENCE, num_requests)
+        request_list = []
+        for i in range(num_requests):
+            data = data_creator(seq_no)
+            event = Event(
+                tenant_id,
+                seq_no,
+                event_type,
+                uuid(),
+                data.event_data
             )
+            request_list.append(self.events_repo.create_put_item_request(event))
+            request_list.append(data.request)
+            seq_no += 1
+        return self.transact_write(request_list)
 
     def execute_with_event(self, tenant_id: int,
                            request_list: List[TransactionRequest],
                            event_type: EventType,
                            event_data: Optional[Union[str, Dict]] = None,
                            event_id: str = None,
-                           max_lock_seconds: int = 30,
                            seq_no_listener: SequenceCaller = None):
         event = Event(
             tenant_id,
@@ -145,15 +140,7 @@ class AwsSequenceRepo(AwsVirtualTableRepo, SequenceRepo):
                 request_list.extend(additional_requests)
             return self.transact_write(request_list)
 
-        return self.execute(tenant_id, 'EventSeq', max_lock_seconds, inner)
-
-    def execute(self, tenant_id: int, name: str, max_lock_seconds: int, sequence_caller: SequenceCaller) -> Any:
-        seq_update = self.__get_current_sequence(tenant_id, name, max_lock_seconds)
-        try:
-            return sequence_caller(seq_update.next_value)
-        finally:
-            self.patch_with_condition(
-                seq_update,
-                "timeoutAt",
-                0
-            )
+        return self.execute(tenant_id, EVENT_SEQUENCE, inner)
+
+    def execute(self, tenant_id: int, name: str, sequence_caller: SequenceCaller) -> Any:
+        return sequence_caller(self.allocate(tenant_id, name))
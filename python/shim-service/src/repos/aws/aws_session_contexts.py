@@ -21,6 +21,9 @@ from utils.date_utils import get_system_time_in_seconds, get_system_time_in_mill
 
 logger = loghelper.get_logger(__name__)
 
+# Everything SessionContext.from_record() needs, which leaves out expireTime
+_CONTEXT_ATTRIBUTES = ['tenantId', 'sessionId', 'userId', 'contextType', 'sessionData', 'updateTime']
+
 
 class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
     __hash_key_attributes__ = {
@@ -67,6 +70,7 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
         requests.append(sess_repo.create_patch_with_state_check_request(session, {
             'sessionStatus': SessionStatus.ACTIVE.value
         }))
+        requests.extend(sess_repo.platform_sessions_repo.create_put_requests(session))
 
         if session.has_live_agent_polling():
             pe_repo = self.pending_event_repo_supplier.get()
@@ -74,7 +78,8 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
                 PendingEventType.LIVE_AGENT_POLL,
                 session.tenant_id,
                 session.session_id,
-                session.user_id
+                session.user_id,
+                shard=pe_repo.shard_of(session.tenant_id, session.session_id)
             )
             requests.append(pe_repo.create_put_item_request(event))
 
@@ -113,7 +118,8 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
         ctx_req = self.create_get_item_request_from_args(
             session_key.tenant_id,
             session_key.session_id,
-            context_type.value
+            context_type.value,
+            attributes_to_get=_CONTEXT_ATTRIBUTES
         )
         sess_req = self.sessions_repo_supplier.get().create_get_item_request_from_key(session_key,
                                                                                       consistent=True,
@@ -122,8 +128,9 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
                                                                                           "fcmDeviceToken"])
         results = self.batch_get([ctx_req, sess_req])
         if results.row_count > 0:
-            ctx: SessionContext = results.get_entry_at(0)
-            if ctx is not None:
+            ctx_item = results.get_entry_at(0)
+            if ctx_item is not None:
+                ctx = self.initializer(ctx_item)
                 atts = results.get_entry_at(1)
                 if atts is None or atts['sessionStatus'] == SessionStatus.FAILED.value:
                     return SessionContextAndFcmToken(ctx, None)
@@ -154,6 +161,8 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
         }, must_exist=False)
 
         requests = [sess_req]
+        requests.extend(sess_repo.platform_sessions_repo.create_delete_requests(context.tenant_id,
+                                                                                context.session_id))
         for ct in ContextType:
             requests.append(self.create_delete_item_request_from_args(context.tenant_id, context.session_id,
                                                                       ct.value))
@@ -167,6 +176,8 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
         return self.create_update_item_request(context, patches={'sessionData': context.session_data})
 
     def delete_by_row_keys(self, row_keys: List[DynamoDbItem]):
+        platform_sessions_repo = self.sessions_repo_supplier.get().platform_sessions_repo
+
         def transform(row: DynamoDbItem) -> List[TableAndKey]:
             key = from_ddb_item(row)
             entries = []
@@ -175,9 +186,14 @@ class AwsSessionContextsRepo(AwsVirtualRangeTableRepo, SessionContextsRepo):
                 new_key['contextType'] = ct.value
                 # We are a virtual table, so we need to build the actual key
                 entries.append((self.table_name, self.primary_key.build_key_as_dict(new_key)))
+            # The session's platform session index entries go too
+            for platform_key in platform_sessions_repo.build_keys(key['tenantId'], key['sessionId']):
+                entries.append((platform_sessions_repo.table_name, platform_key))
             return entries
 
         def on_submit(table_and_keys: List[TableAndKey]):
             logger.info(f"Attempting to delete {len(table_and_keys)} context record(s) ...")
 
-        self.ddb.batch_delete(flat_iterator(row_keys, transform), on_submit=on_submit)
+        result = self.ddb.batch_delete(flat_iterator(row_keys, transform), on_submit=on_submit)
+        if not result.succeeded:
+            logger.warning(f"Failed to delete {len(result.failures)} context record(s).")
@@ -1,14 +1,16 @@
-from typing import Dict, Any, Optional, Iterable
+import heapq
+from typing import Dict, Any, Optional, Iterable, Type
 
-from aws.dynamodb import DynamoDb, not_exists_filter, TransactionRequest
+from aws.dynamodb import DynamoDb, TransactionRequest, not_exists_filter
 from events.event_types import EventType
 from lambda_pkg.functions import LambdaInvoker
 from lambda_web_framework.web_exceptions import ConflictException
 from push_notification import SessionPushNotification
-from repos.aws import PUSH_NOTIFICATION_TABLE
+from repos.aws import PUSH_NOTIFICATION_TABLE, UNSENT_PUSH_NOTIFICATION_TABLE
 from repos.aws.abstract_range_table_repo import AwsVirtualRangeTableRepo
 from repos.aws.aws_sequence import AwsSequenceRepo
 from repos.aws.aws_session_contexts import AwsSessionContextsRepo
+from repos.aws.read_consistency import ConsistencyPolicy, QUERY_NOTIFICATIONS
 from repos.session_push_notifications import SessionPushNotificationsRepo
 from session import SessionContext, SessionKey, SessionKeyAndUser
 from utils import string_utils, loghelper
@@ -16,6 +18,9 @@ from utils.date_utils import EpochMilliseconds, get_system_time_in_millis, Epoch
 
 logger = loghelper.get_logger(__name__)
 
+# Number of pages to read ahead when querying notifications
+_QUERY_PREFETCH_PAGES = 2
+
 
 class LocalRecord:
     def __init__(self, tenant_id: int,
@@ -37,12 +42,14 @@ class LocalRecord:
         self.sent = sent
         self.expire_time = expire_time
 
-    def to_notification(self) -> SessionPushNotification:
+    def to_notification(self,
+                        notification_class: Type[SessionPushNotification] = SessionPushNotification
+                        ) -> SessionPushNotification:
         if self.message_data is not None:
             message_data = string_utils.decompress(self.message_data)
         else:
             message_data = None
-        return SessionPushNotification(
+        return notification_class(
             self.tenant_id,
             self.session_id,
             self.seq_no,
@@ -99,6 +106,32 @@ class LocalRecord:
         )
 
 
+class _LegacyPushNotification(SessionPushNotification):
+    """
+    An unsent notification found in the push notification table, where they were kept before the unsent queue
+    existed.
+    """
+    pass
+
+
+class _UnsentNotificationsRepo(AwsVirtualRangeTableRepo):
+    """
+    Queue of the notifications that have not been sent yet. Notifications are moved to the push notification
+    table once sent, so querying for the unsent ones never reads the sent ones.
+    """
+    __hash_key_attributes__ = {
+        'tenantId': int,
+        'sessionId': str
+    }
+
+    __range_key_attributes__ = {
+        'seqNo': (int, 16)
+    }
+
+    __initializer__ = LocalRecord.from_record
+    __virtual_table__ = UNSENT_PUSH_NOTIFICATION_TABLE
+
+
 class AwsPushNotificationsRepo(AwsVirtualRangeTableRepo, SessionPushNotificationsRepo):
     __hash_key_attributes__ = {
         'tenantId': int,
@@ -116,12 +149,22 @@ class AwsPushNotificationsRepo(AwsVirtualRangeTableRepo, SessionPushNotification
                  sequence_repo: AwsSequenceRepo,
                  session_contexts_repo: AwsSessionContextsRepo,
                  lambda_invoker: LambdaInvoker,
-                 expiration_seconds: int):
+                 expiration_seconds: int,
+                 consistency_policy: Optional[ConsistencyPolicy] = None,
+                 read_legacy_notifications: bool = True):
+        """
+        :param read_legacy_notifications: True to also look for unsent notifications in this table, where they
+        were kept before the unsent queue existed.
+        """
         super(AwsPushNotificationsRepo, self).__init__(ddb)
         self.sequence_repo = sequence_repo
         self.session_contexts_repo = session_contexts_repo
         self.lambda_invoker = lambda_invoker
         self.expiration_seconds = expiration_seconds
+        self.unsent_repo = _UnsentNotificationsRepo(ddb)
+        self.read_legacy_notifications = read_legacy_notifications
+        if consistency_policy is not None:
+            self.consistency_policy = consistency_policy
 
     def submit(self, session_key: SessionKeyAndUser, platform_channel_type: str, message_type: str, message: str):
         record = LocalRecord(
@@ -139,7 +182,7 @@ class AwsPushNotificationsRepo(AwsVirtualRangeTableRepo, SessionPushNotification
 
         def seq_no_assigned(seq_no: int):
             record.seq_no = seq_no
-            request_list[0] = self.create_put_item_request(record)
+            request_list[0] = self.unsent_repo.create_put_item_request(record)
 
         bad_event: TransactionRequest = self.sequence_repo.execute_with_event(
             session_key.tenant_id,
@@ -160,25 +203,45 @@ class AwsPushNotificationsRepo(AwsVirtualRangeTableRepo, SessionPushNotification
     def query_notifications(self,
                             session_key: SessionKey,
                             previous_seq_no: int = None) -> Iterable[SessionPushNotification]:
-        rset = self.query_set(
+        consistent = self.is_consistent_read(QUERY_NOTIFICATIONS)
+        # Sent notifications are removed from the queue, so it is read in full. Sequence numbers are not assigned in
+        # commit order, so a notification can show up after one with a higher number was sent.
+        rset = self.unsent_repo.query_set(
+            session_key.tenant_id,
+            session_key.session_id,
+            consistent=consistent,
+            prefetch=_QUERY_PREFETCH_PAGES
+        )
+        notifications = map(lambda r: r.to_notification(), rset)
+        if not self.read_legacy_notifications:
+            return notifications
+
+        legacy_rset = self.query_set(
             session_key.tenant_id,
             session_key.session_id,
-            consistent=True,
+            consistent=consistent,
             start_after=previous_seq_no,
             filters=not_exists_filter('sent')
         )
-        return map(lambda r: r.to_notification(), rset)
+        legacy_notifications = map(lambda r: r.to_notification(_LegacyPushNotification), legacy_rset)
+        return heapq.merge(notifications, legacy_notifications, key=lambda n: n.seq_no)
 
     def set_sent(self, record: SessionPushNotification, context: SessionContext = None) -> bool:
         local_record = LocalRecord.from_entry(record)
-        patches = {'sent': True}
-        if context is None:
-            return self.patch(local_record, patches)
+        if isinstance(record, _LegacyPushNotification):
+            requests = [self.create_update_item_request(local_record, {'sent': True})]
         else:
-            req = self.create_update_item_request(local_record, patches=patches)
-            context_req = self.session_contexts_repo.create_patch_session_data_request(context)
-            bad_req = self.transact_write([req, context_req])
-            if bad_req is not None:
-                logger.warning(f"Failed to update context {context}: {bad_req.cancel_reason}")
-                return False
-            return True
+            local_record.sent = True
+            local_record.expire_time = get_system_time_in_seconds() + self.expiration_seconds
+            requests = [
+                # Fails if the notification was already moved, i.e. sent by someone else
+                self.unsent_repo.create_delete_item_request(local_record, must_exist=True),
+                self.create_put_item_request(local_record)
+            ]
+        if context is not None:
+            requests.append(self.session_contexts_repo.create_patch_session_data_request(context))
+        bad_req = self.transact_write(requests)
+        if bad_req is not None:
+            logger.warning(f"Failed to set notification {record.seq_no} as sent: {bad_req.cancel_reason}")
+            return False
+        return True
@@ -6,9 +6,11 @@ from lambda_web_framework.web_exceptions import EntityExistsException
 from repos.aws import SHIM_SERVICE_SESSION_TABLE
 from repos.aws.abstract_repo import AbstractAwsRepo
 from repos.aws.aws_events import AwsEventsRepo
+from repos.aws.aws_platform_sessions import AwsPlatformSessionsRepo
 from repos.aws.aws_sequence import AwsSequenceRepo
 from repos.aws.aws_sfdc_sessions_repo import AwsSfdcSessionsRepo
 from repos.aws.aws_user_sessions import AwsUserSessionsRepo
+from repos.aws.read_consistency import ConsistencyPolicy, FIND_SESSION, SESSIONS_WITH_CHANNEL_TYPE
 from repos.sessions_repo import SessionsRepo, CreateSessionRequest, UserSessionExistsException
 from session import Session, SessionKey, SessionStatus
 from utils import loghelper
@@ -23,6 +25,9 @@ _SESSION_ID = "sessionId"
 _EVENT_EXPIRATION_HOURS = 4
 _EVENT_EXPIRATION_SECONDS = _EVENT_EXPIRATION_HOURS * 3600
 
+# Number of pages to read ahead when querying session ids
+_QUERY_PREFETCH_PAGES = 2
+
 logger = loghelper.get_logger(__name__)
 
 
@@ -39,12 +44,17 @@ class AwsSessionsRepo(SessionsRepo, AbstractAwsRepo):
                  user_sessions_repo: AwsUserSessionsRepo,
                  events_repo: AwsEventsRepo,
                  sequence_repo: AwsSequenceRepo,
-                 sfdc_sessions_repo: AwsSfdcSessionsRepo):
+                 sfdc_sessions_repo: AwsSfdcSessionsRepo,
+                 platform_sessions_repo: AwsPlatformSessionsRepo,
+                 consistency_policy: Optional[ConsistencyPolicy] = None):
         super(AwsSessionsRepo, self).__init__(ddb)
         self.user_sessions_repo = user_sessions_repo
         self.events_repo = events_repo
         self.sequence_repo = sequence_repo
         self.sfdc_sessions_repo = sfdc_sessions_repo
+        self.platform_sessions_repo = platform_sessions_repo
+        if consistency_policy is not None:
+            self.consistency_policy = consistency_policy
 
     def create_session(self, request: CreateSessionRequest):
         expire_time = get_system_time_in_seconds() + request.session.expiration_seconds
@@ -76,7 +86,7 @@ class AwsSessionsRepo(SessionsRepo, AbstractAwsRepo):
         raise EntityExistsException("Session already exists.")
 
     def find_session(self, session_key: SessionKey) -> Optional[Session]:
-        return self.find(session_key.tenant_id, session_key.session_id, consistent=True)
+        return self.find_with_policy(FIND_SESSION, session_key.tenant_id, session_key.session_id)
 
     def update_session(self, session: Session) -> bool:
         requests = [self.create_update_with_state_check_request(session)]
@@ -91,6 +101,24 @@ class AwsSessionsRepo(SessionsRepo, AbstractAwsRepo):
         )
         return bad_request is None
 
+    def __create_touch_requests(self, key: SessionKey, user_id: str, patch: Dict[str, Any]):
+        return to_flat_list(
+            self.create_update_item_request_from_args(patch, key.tenant_id, key.session_id,
+                                                      must_exist=True),
+            self.user_sessions_repo.create_update_item_request_from_args(patch, key.tenant_id, user_id,
+                                                                         must_exist=True),
+            self.sfdc_sessions_repo.create_patch_request(key.tenant_id, key.session_id, patch)
+        )
+
+    @staticmethod
+    def __prepare_event_data(key: SessionKey, user_id: str, event_data: Optional[Dict[str, Any]]):
+        event_data = dict(event_data) if event_data is not None else {}
+        event_data.update({
+            'sessionId': key.session_id,
+            'userId': user_id
+        })
+        return event_data
+
     def touch_with_event(self,
                          key: SessionKey,
                          user_id: str,
@@ -99,25 +127,12 @@ class AwsSessionsRepo(SessionsRepo, AbstractAwsRepo):
                          event_data: Optional[Dict[str, Any]] = None):
         expiration_time = get_system_time_in_seconds() + expiration_seconds
         patch = {'expireTime': expiration_time}
-        event_data = dict(event_data) if event_data is not None else {}
-        event_data.update({
-            'sessionId': key.session_id,
-            'userId': user_id
-        })
-
-        request_list = to_flat_list(
-            self.create_update_item_request_from_args(patch, key.tenant_id, key.session_id,
-                                                      must_exist=True),
-            self.user_sessions_repo.create_update_item_request_from_args(patch, key.tenant_id, user_id,
-                                                                         must_exist=True),
-            self.sfdc_sessions_repo.create_patch_request(key.tenant_id, key.session_id, patch)
-        )
 
         error_request: TransactionRequest = self.sequence_repo.execute_with_event(
             key.tenant_id,
-            request_list,
+            self.__create_touch_requests(key, user_id, patch),
             event_type,
-            event_data
+            self.__prepare_event_data(key, user_id, event_data)
         )
         if error_request is not None:
             logger.warning(f"Error executing touch for {key}: '{error_request.describe()}")
@@ -134,9 +149,10 @@ class AwsSessionsRepo(SessionsRepo, AbstractAwsRepo):
             session.tenant_id,
             session.user_id
         )
+        platform_requests = self.platform_sessions_repo.create_delete_requests(session.tenant_id, session.session_id)
         error_request = self.sequence_repo.execute_with_event(
             session.tenant_id,
-            to_flat_list(session_request, user_session_request),
+            to_flat_list(session_request, user_session_request, platform_requests),
             EventType.SESSION_DELETED,
             event_data={
                 'sessionId': session.session_id,
@@ -166,32 +182,56 @@ class AwsSessionsRepo(SessionsRepo, AbstractAwsRepo):
         )
 
     def has_sessions_with_platform_channel_type(self, tenant_id: int, channel_type: str):
+        consistent = self.is_consistent_read(SESSIONS_WITH_CHANNEL_TYPE)
+        if self.platform_sessions_repo.has_sessions(tenant_id, channel_type, consistent):
+            return True
+        return len(self.__backfill_platform_sessions(tenant_id, channel_type, consistent)) > 0
+
+    def __backfill_platform_sessions(self, tenant_id: int, channel_type: str, consistent: bool) -> List[str]:
+        # Sessions activated before the platform session index existed are only found by filtering, which is done
+        # once for each tenant and platform type
+        if self.platform_sessions_repo.is_backfilled(tenant_id, channel_type, consistent):
+            return []
+
         # where status = 'A' and p_channel_type = True
         status_filter = eq_filter('sessionStatus', SessionStatus.ACTIVE.value)
         channel_filter = eq_filter(f'pt_{channel_type}', True)
         result_set = self.query_set(
             tenant_id,
-            consistent=True,
-            count_only=True,
-            filters=(status_filter, channel_filter)
+            consistent=consistent,
+            select_attributes=[SESSION_ID],
+            filters=(status_filter, channel_filter),
+            prefetch=_QUERY_PREFETCH_PAGES
         )
-
-        # We need to iterate the result set to get the count
-        for _ in result_set:
-            break
-
-        return result_set.count> 0
+        session_ids = list(map(lambda r: r[SESSION_ID], result_set))
+        logger.info(f"Backfilling {len(session_ids)} {channel_type} session(s) for tenant {tenant_id}.")
+        backfilled = list(filter(lambda session_id: self.__backfill_platform_session(tenant_id, channel_type,
+                                                                                     session_id),
+                                 session_ids))
+        self.platform_sessions_repo.mark_backfilled(tenant_id, channel_type)
+        return backfilled
+
+    def __backfill_platform_session(self, tenant_id: int, channel_type: str, session_id: str) -> bool:
+        # The session can be deleted after it was found, so only add the entry while it is still active
+        session_check = self.create_condition_check_request_from_args(
+            tenant_id,
+            session_id,
+            condition={'sessionStatus': SessionStatus.ACTIVE.value}
+        )
+        put_request = self.platform_sessions_repo.create_backfill_request(tenant_id, channel_type, session_id)
+        bad_request = self.transact_write([session_check, put_request])
+        if bad_request is session_check:
+            logger.info(f"Session {session_id} for tenant {tenant_id} is no longer active, not backfilling it.")
+            return False
+        # A failed put means the entry was already added, when the session was activated
+        return True
 
     def query_session_ids_with_platform_channel_type(self,
                                                      tenant_id: int,
                                                      channel_type: str) -> Iterable[str]:
-
-        status_filter = eq_filter('sessionStatus', SessionStatus.ACTIVE.value)
-        channel_filter = eq_filter(f'pt_{channel_type}', True)
-        result_set = self.query_set(
-            tenant_id,
-            consistent=True,
-            select_attributes=[SESSION_ID],
-            filters=(status_filter, channel_filter)
-        )
-        return map(lambda r: r[SESSION_ID], result_set)
+        consistent = self.is_consistent_read(SESSIONS_WITH_CHANNEL_TYPE)
+        session_ids = list(self.platform_sessions_repo.query_session_ids(tenant_id, channel_type, consistent))
+        found = set(session_ids)
+        legacy_ids = self.__backfill_platform_sessions(tenant_id, channel_type, consistent)
+        session_ids.extend(filter(lambda session_id: session_id not in found, legacy_ids))
+        return session_ids
@@ -1,11 +1,12 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Collection
 
-from aws.dynamodb import PutItemRequest, DynamoDb
+from aws.dynamodb import PutItemRequest, DynamoDb, GetItemRequest
 from bean import BeanSupplier
 from repos.aws import SFDC_SESSION_TABLE
 from repos.aws.abstract_range_table_repo import AwsVirtualRangeTableRepo
 from repos.aws.abstract_repo import AbstractAwsRepo
-from repos.sfdc_sessions_repo import SfdcSessionsRepo, SfdcSessionDataAndContext
+from repos.aws.read_consistency import ConsistencyPolicy, LOAD_SESSION_DATA
+from repos.sfdc_sessions_repo import SfdcSessionsRepo, SfdcSessionDataAndContext, SfdcSessionDataByKey
 from session import ContextType, SessionContext, SessionStatus, SessionKey
 from session.exceptions import SessionNotActiveException
 from utils.byte_utils import compress, decompress
@@ -55,10 +56,13 @@ class AwsSfdcSessionsRepo(AwsVirtualRangeTableRepo, SfdcSessionsRepo):
     __virtual_table__ = SFDC_SESSION_TABLE
 
     def __init__(self, ddb: DynamoDb, contexts_repo: AbstractAwsRepo,
-                 sessions_repo_supplier: BeanSupplier):
+                 sessions_repo_supplier: BeanSupplier,
+                 consistency_policy: Optional[ConsistencyPolicy] = None):
         super(AwsSfdcSessionsRepo, self).__init__(ddb)
         self.contexts_repo = contexts_repo
         self.sessions_repo_supplier = sessions_repo_supplier
+        if consistency_policy is not None:
+            self.consistency_policy = consistency_policy
 
     def create_put_request(self, session_key: SessionKey, session_data: bytes, expire_time: EpochSeconds) -> PutItemRequest:
         record = LocalRecord(
@@ -77,29 +81,31 @@ class AwsSfdcSessionsRepo(AwsVirtualRangeTableRepo, SfdcSessionsRepo):
         record: LocalRecord = self.find(session_key.tenant_id, session_key.session_id)
         return decompress(record.session_data) if record is not None else None
 
-    def load_data_and_context(self,
-                              session_key: SessionKey,
-                              context_type: ContextType,
-                              consistent: bool = True) -> Optional[SfdcSessionDataAndContext]:
+    def __create_load_requests(self, session_key: SessionKey,
+                               context_type: ContextType) -> List[GetItemRequest]:
+        # The version attributes are needed for validated reads
         session_req = self.sessions_repo_supplier.get().create_get_item_request_from_args(
             session_key.tenant_id,
             session_key.session_id,
-            consistent=consistent,
-            attributes_to_get=['sessionStatus', 'expSeconds']
+            attributes_to_get=['sessionStatus', 'expSeconds', 'stateCounter', 'updateTime']
         )
 
         our_req = self.create_get_item_request_from_args(
             session_key.tenant_id,
             session_key.session_id,
-            consistent=consistent
+            attributes_to_get=['sessionData']
         )
         context_req = self.contexts_repo.create_get_item_request_from_args(
             session_key.tenant_id,
             session_key.session_id,
-            context_type.value,
-            consistent=consistent
+            context_type.value
         )
-        result = self.batch_get([session_req, our_req, context_req])
+        return [session_req, our_req, context_req]
+
+    def load_data_and_context(self,
+                              session_key: SessionKey,
+                              context_type: ContextType) -> Optional[SfdcSessionDataAndContext]:
+        result = self.batch_get_with_policy(LOAD_SESSION_DATA, self.__create_load_requests(session_key, context_type))
         if result.row_count != 3:
             return None
 
@@ -107,11 +113,37 @@ class AwsSfdcSessionsRepo(AwsVirtualRangeTableRepo, SfdcSessionsRepo):
         if sess_item['sessionStatus'] != SessionStatus.ACTIVE.value:
             raise SessionNotActiveException()
 
-        our_record: LocalRecord = result.get_next_entry()
+        our_item = result.get_next_entry()
         context_record: SessionContext = result.get_next_entry()
 
         return SfdcSessionDataAndContext(
             sess_item['expSeconds'],
-            decompress(our_record.session_data),
+            decompress(our_item['sessionData']),
             context_record
         )
+
+    def load_all_data_and_contexts(self,
+                                   session_keys: Collection[SessionKey],
+                                   context_type: ContextType) -> SfdcSessionDataByKey:
+        requests = []
+        for session_key in session_keys:
+            requests.extend(self.__create_load_requests(session_key, context_type))
+        result = self.batch_get_with_policy(LOAD_SESSION_DATA, requests)
+
+        results = {}
+        index = 0
+        for session_key in session_keys:
+            sess_item = result.get_entry_at(index)
+            our_item = result.get_entry_at(index + 1)
+            context_record: SessionContext = result.get_entry_at(index + 2)
+            index += 3
+            key = (session_key.tenant_id, session_key.session_id)
+            if sess_item is None or our_item is None or context_record is None:
+                results[key] = None
+            elif sess_item['sessionStatus'] == SessionStatus.ACTIVE.value:
+                results[key] = SfdcSessionDataAndContext(
+                    sess_item['expSeconds'],
+                    decompress(our_item['sessionData']),
+                    context_record
+                )
+        return results
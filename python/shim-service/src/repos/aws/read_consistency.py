@@ -0,0 +1,163 @@
+import sys
+from collections import OrderedDict
+from threading import RLock
+from typing import Dict, Optional, Any, Tuple, Hashable, Iterable
+
+from utils.enum_utils import ReverseLookupEnum
+
+#
+# Call sites that can be configured, see Config.read_consistency_overrides
+#
+FIND_SESSION = 'findSession'
+SESSIONS_WITH_CHANNEL_TYPE = 'sessionsWithChannelType'
+LOAD_SESSION_DATA = 'loadSessionData'
+QUERY_NOTIFICATIONS = 'queryNotifications'
+QUERY_PENDING_EVENTS = 'queryPendingEvents'
+
+# Max number of item versions each repo remembers
+DEFAULT_MAX_TRACKED_VERSIONS = 10000
+
+
+class ReadConsistency(ReverseLookupEnum):
+    # Strongly consistent reads, at twice the read capacity
+    STRONG = 'strong'
+    # Eventually consistent reads
+    EVENTUAL = 'eventual'
+    # Eventually consistent reads, re-read with a consistent read when the item is older than a version this
+    # container has already seen. Queries have nothing to validate against, so they are eventually consistent.
+    VALIDATED = 'validated'
+
+    @classmethod
+    def value_of(cls, string_value: str) -> 'ReadConsistency':
+        return cls._value_of(string_value, 'read consistency')
+
+
+class ConsistencyPolicy:
+    """
+    Decides the read consistency for each call site.
+    """
+
+    def __init__(self, default_consistency: ReadConsistency = ReadConsistency.STRONG,
+                 overrides: Optional[Dict[str, ReadConsistency]] = None):
+        self.default_consistency = default_consistency
+        self.overrides = overrides or {}
+
+    def get(self, call_site: str) -> ReadConsistency:
+        return self.overrides.get(call_site, self.default_consistency)
+
+    @classmethod
+    def from_config(cls, default_consistency: str, overrides: Optional[Dict[str, str]]) -> 'ConsistencyPolicy':
+        return cls(
+            ReadConsistency.value_of(default_consistency),
+            {call_site: ReadConsistency.value_of(v) for call_site, v in (overrides or {}).items()}
+        )
+
+
+# stateCounter and updateTime
+ItemVersion = Tuple[int, int]
+
+
+# Recorded for items written without a version, or deleted, so that reads are consistent until one sees the write
+_UNKNOWN_VERSION: ItemVersion = (sys.maxsize, sys.maxsize)
+
+
+class VersionTracker:
+    """
+    Remembers the newest version (stateCounter and updateTime) of the items a repo has read or written, so that
+    eventually consistent reads that return an older version, or no item at all, can be detected. This gives
+    monotonic reads and read-your-writes within a container, not across containers.
+
+    Writes that do not set the version, and deletes, leave the version unknown. Reads of those items are
+    consistent until a consistent read sees the write.
+    """
+
+    def __init__(self, state_counter_attribute: Optional[str],
+                 update_time_attribute: Optional[str],
+                 max_size: int = DEFAULT_MAX_TRACKED_VERSIONS):
+        self.state_counter_attribute = state_counter_attribute
+        self.update_time_attribute = update_time_attribute
+        self.max_size = max_size
+        self.__versions: Dict[Hashable, ItemVersion] = OrderedDict()
+        self.__mutex = RLock()
+
+    def version_of(self, item: Dict[str, Any]) -> ItemVersion:
+        return (item.get(self.state_counter_attribute, 0) if self.state_counter_attribute is not None else 0,
+                item.get(self.update_time_attribute, 0) if self.update_time_attribute is not None else 0)
+
+    def has_version(self, item: Dict[str, Any]) -> bool:
+        return any(name is not None and name in item
+                   for name in (self.state_counter_attribute, self.update_time_attribute))
+
+    def is_current(self, key: Hashable, item: Optional[Dict[str, Any]]) -> bool:
+        """
+        Checks whether the given item is at least as new as the newest version seen.
+
+        :param key: the item's key.
+        :param item: the item read, None if it was not found.
+        :return: False if the read was stale.
+        """
+        with self.__mutex:
+            seen = self.__versions.get(key)
+        if seen is None:
+            return True
+        return item is not None and self.version_of(item) >= seen
+
+    def must_read_consistent(self, key: Hashable) -> bool:
+        """
+        Checks whether the item was written without a version, so an eventually consistent read cannot be checked.
+        """
+        with self.__mutex:
+            return self.__versions.get(key) == _UNKNOWN_VERSION
+
+    def observe(self, key: Hashable, item: Optional[Dict[str, Any]], consistent: bool = True):
+        """
+        Records the version of an item that was read. None means the item does not exist.
+
+        :param key: the item's key.
+        :param item: the item read, None if it was not found.
+        :param consistent: True if the read was consistent. Only consistent reads can see a write whose version
+        is unknown.
+        """
+        with self.__mutex:
+            seen = self.__versions.pop(key, None)
+            if seen == _UNKNOWN_VERSION:
+                if not consistent:
+                    self.__versions[key] = seen
+                    return
+                seen = None
+            if item is not None:
+                version = self.version_of(item)
+                self.__put(key, version if seen is None else max(seen, version))
+
+    def observe_write(self, key: Hashable, item: Optional[Dict[str, Any]]):
+        """
+        Records a write that succeeded.
+
+        :param key: the item's key.
+        :param item: the item, or attributes, written. None if the item was deleted.
+        """
+        with self.__mutex:
+            if item is None or not self.has_version(item):
+                self.__versions.pop(key, None)
+                self.__put(key, _UNKNOWN_VERSION)
+                return
+            version = self.version_of(item)
+            seen = self.__versions.pop(key, None)
+            self.__put(key, version if seen is None or seen == _UNKNOWN_VERSION else max(seen, version))
+
+    def __put(self, key: Hashable, version: ItemVersion):
+        self.__versions[key] = version
+        while len(self.__versions) > self.max_size:
+            self.__versions.popitem(last=False)
+
+
+def note_writes(requests: Iterable[Any]):
+    """
+    Records the requests written, for the ones created by a repo, so its validated reads see the writes.
+
+    :param requests: the requests that were written.
+    """
+    for request in requests:
+        repo = getattr(request, 'repo', None)
+        if repo is not None:
+            repo.note_write(request)
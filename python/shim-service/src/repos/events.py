@@ -9,4 +9,13 @@ class EventsRepo(metaclass=abc.ABCMeta):
     def query_events(self, tenant_id: int,
                      limit: int = 100,
                      last_seq_no: int = None) -> QueryResult:
+        """
+        Queries the events for a tenant, in sequence number order.
+
+        :param tenant_id: the tenant id.
+        :param limit: the max number of events to return.
+        :param last_seq_no: the sequence number to start after. Sequence numbers are not assigned in commit order,
+        so events committed later can have lower numbers than the last one seen.
+        :return: the events.
+        """
         raise NotImplementedError()
@@ -1,5 +1,5 @@
 import abc
-from typing import Iterable, Any
+from typing import Iterable, Any, List
 
 from pending_event import PendingEventType, PendingEvent
 from repos import QueryResult
@@ -16,7 +16,14 @@ class PendingEventsRepo(metaclass=abc.ABCMeta):
         raise NotImplementedError()
 
     @abc.abstractmethod
-    def update_action_times(self, events: Iterable[PendingEvent], seconds_in_future: int):
+    def update_action_times(self, events: Iterable[PendingEvent], seconds_in_future: int) -> List[PendingEvent]:
+        """
+        Updates the action time for all the given events, in as few calls as possible.
+
+        :param events: the events.
+        :param seconds_in_future: the number of seconds in the future to set the action time to.
+        :return: the events that were not updated because they were changed or removed.
+        """
         raise NotImplementedError()
 
     @abc.abstractmethod
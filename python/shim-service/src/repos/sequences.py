@@ -5,6 +5,10 @@ SequenceCaller = Callable[[int], None]
 
 
 class SequenceRepo(metaclass=abc.ABCMeta):
+    """
+    Hands out unique sequence numbers. The numbers are not assigned in commit order.
+    """
+
     @abc.abstractmethod
-    def execute(self, tenant_id: int, name: str, max_lock_seconds: int, sequence_caller: SequenceCaller) -> Any:
+    def execute(self, tenant_id: int, name: str, sequence_caller: SequenceCaller) -> Any:
         raise NotImplementedError()
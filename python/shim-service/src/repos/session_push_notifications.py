@@ -15,6 +15,14 @@ class SessionPushNotificationsRepo(metaclass=abc.ABCMeta):
     def query_notifications(self,
                             session_key: SessionKey,
                             previous_seq_no: int = None) -> Iterable[SessionPushNotification]:
+        """
+        Queries the notifications that have not been sent yet, in sequence number order.
+
+        :param session_key: the session.
+        :param previous_seq_no: only skips legacy notifications up to this number. Sequence numbers are unique, but
+        not assigned in commit order, so they cannot be used as a cursor for the unsent queue.
+        :return: the notifications.
+        """
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -1,5 +1,5 @@
 import abc
-from typing import Optional
+from typing import Optional, Collection, Dict, Tuple
 
 from session import ContextType, SessionContext, SessionKey
 
@@ -11,6 +11,10 @@ class SfdcSessionDataAndContext:
         self.expiration_seconds = expiration_seconds
 
 
+# Tenant id and session id to the data and context
+SfdcSessionDataByKey = Dict[Tuple[int, str], Optional[SfdcSessionDataAndContext]]
+
+
 class SfdcSessionsRepo(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
@@ -22,3 +26,17 @@ class SfdcSessionsRepo(metaclass=abc.ABCMeta):
                               session_key: SessionKey,
                               context_type: ContextType) -> Optional[SfdcSessionDataAndContext]:
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def load_all_data_and_contexts(self,
+                                   session_keys: Collection[SessionKey],
+                                   context_type: ContextType) -> SfdcSessionDataByKey:
+        """
+        Loads the data and context for the given sessions, in bulk.
+
+        :param session_keys: the session keys.
+        :param context_type: the context type.
+        :return: the results by tenant id and session id. None for sessions that are gone. Sessions that are
+        not active are left out.
+        """
+        raise NotImplementedError()
@@ -1,7 +1,7 @@
 import abc
 import json
 import pickle
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Collection, Tuple
 
 from bean import BeanName, inject
 from events.event_types import EventType
@@ -14,6 +14,7 @@ from services.sfdc.live_agent.message_data import MessageData
 from services.sfdc.sfdc_connection import SfdcConnection, create_new_connection, deserialize as deserialize_conn
 from session import Session, ContextType, SessionContext, SessionKey
 from utils import loghelper
+from utils.async_http_client import AsyncHttpClient
 from utils.date_utils import get_system_time_in_millis
 from utils.exception_utils import dump_ex
 from utils.http_client import HttpResponse, RequestBuilder, HttpMethod
@@ -44,6 +45,17 @@ class SfdcSession(SessionKey, metaclass=abc.ABCMeta):
     def poll_live_agent(self, settings: LiveAgentPollerSettings) -> Optional[MessageData]:
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    async def poll_live_agent_async(self, settings: LiveAgentPollerSettings,
+                                    client: AsyncHttpClient) -> Optional[MessageData]:
+        """
+        Same as poll_live_agent(), but for use on an event loop.
+
+        :param settings: the poller settings.
+        :param client: the client to send the poll request with.
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def get_live_agent_poll_timeout_seconds(self) -> int:
         raise NotImplementedError()
@@ -156,7 +168,23 @@ class _SfdcSessionImpl(SfdcSession):
         except BaseException as ex:
             logger.severe(f"Exception polling live agent: {dump_ex(ex)}")
             return MessageData.create_live_agent_kit_shutdown_data(settings.ack)
+        return self.__process_poll_response(settings, rb, resp, start)
 
+    async def poll_live_agent_async(self, settings: LiveAgentPollerSettings,
+                                    client: AsyncHttpClient) -> Optional[MessageData]:
+        rb = self.live_agent.create_poll_request_builder(settings).allow_response_on_error(True)
+        start = get_system_time_in_millis()
+        try:
+            resp = await client.exchange(rb.build())
+        except Exception as ex:
+            logger.severe(f"Exception polling live agent: {dump_ex(ex)}")
+            return MessageData.create_live_agent_kit_shutdown_data(settings.ack)
+        return self.__process_poll_response(settings, rb, resp, start)
+
+    def __process_poll_response(self, settings: LiveAgentPollerSettings,
+                                rb: RequestBuilder,
+                                resp: HttpResponse,
+                                start: int) -> Optional[MessageData]:
         elapsed = get_system_time_in_millis() - start
         logger.info(f"{self.key_for_logging()}: Poll response to {rb.get_uri()} "
                     f"(elapsed = {elapsed} ms.):\n{resp.to_string()}")
@@ -250,3 +278,24 @@ def load_with_context(
         deserialize(key, result.context.user_id, result.data, result.expiration_seconds),
         result.context
     )
+
+
+@inject(bean_instances=BeanName.SFDC_SESSIONS_REPO)
+def load_all_with_context(
+        keys: Collection[SessionKey],
+        context_type: ContextType,
+        sfdc_sessions_repo: SfdcSessionsRepo) -> Dict[Tuple[int, str], Optional[SfdcSessionAndContext]]:
+    """
+    Bulk version of load_with_context(). Sessions that are not active are left out of the results.
+    """
+    results = {}
+    keys_by_id = {(key.tenant_id, key.session_id): key for key in keys}
+    for id_key, result in sfdc_sessions_repo.load_all_data_and_contexts(keys, context_type).items():
+        if result is None:
+            results[id_key] = None
+        else:
+            results[id_key] = SfdcSessionAndContext(
+                deserialize(keys_by_id[id_key], result.context.user_id, result.data, result.expiration_seconds),
+                result.context
+            )
+    return results
@@ -4,6 +4,7 @@ from typing import List, Optional
 from retry import retry
 
 from auth import Credentials
+from aws import dynamodb_accounting
 from bean import BeanName, inject
 from instance import Instance
 from lambda_pkg.functions import LambdaInvoker
@@ -187,6 +188,7 @@ def __connect_session_async(session: Session,
         raise LambdaHttpException(502, message)
 
 
+@dynamodb_accounting.accounted("create_session")
 @inject(bean_instances=(BeanName.INSTANCE, BeanName.SESSIONS_REPO))
 def create_session(session: Session,
                    async_connect: bool,
@@ -1,6 +1,6 @@
 import abc
 from copy import copy
-from typing import Any, Optional
+from typing import Any, Optional, Collection, Dict
 
 from bean import inject, BeanName
 from repos import QueryResult
@@ -32,6 +32,16 @@ class TenantContextRepo(metaclass=abc.ABCMeta):
     def find_context(self, context_type: TenantContextType, tenant_id: int) -> Optional[TenantContext]:
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def find_contexts(self, context_type: TenantContextType,
+                      tenant_ids: Collection[int]) -> Dict[int, TenantContext]:
+        """
+        Finds the contexts for the given tenants, in bulk.
+
+        :return: the contexts found, by tenant id.
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def update_or_create_context(self, context: TenantContext):
         raise NotImplementedError()
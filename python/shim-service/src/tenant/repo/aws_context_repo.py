@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Collection, Dict
 
 from aws.dynamodb import DynamoDb
 from repos import OptimisticLockException
@@ -22,6 +22,13 @@ class AwsTenantContextRepo(AwsVirtualTableRepo, TenantContextRepo):
     def find_context(self, context_type: TenantContextType, tenant_id: int) -> Optional[TenantContext]:
         return self.find(context_type.value, tenant_id, consistent=True)
 
+    def find_contexts(self, context_type: TenantContextType,
+                      tenant_ids: Collection[int]) -> Dict[int, TenantContext]:
+        requests = [self.create_get_item_request_from_args(context_type.value, tenant_id, consistent=True)
+                    for tenant_id in tenant_ids]
+        result = self.batch_get(requests)
+        return {context.tenant_id: context for context in result.entries if context is not None}
+
     def update_or_create_context(self, context: TenantContext):
         if not self.patch_with_condition_bool(context, 'stateCounter', context.state_counter + 1,
                                               {'contextData': context.data}):
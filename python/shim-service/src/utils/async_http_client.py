@@ -0,0 +1,166 @@
+import abc
+import asyncio
+import os
+import ssl
+from concurrent.futures import Executor
+from typing import Optional, Tuple
+from urllib.parse import SplitResult, urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from utils.http_client import HttpRequest, HttpResponse, HttpClient
+
+_MAX_LINE_LENGTH = 65536
+
+
+class AsyncHttpClient(metaclass=abc.ABCMeta):
+    """
+    HTTP client for use on an asyncio event loop.
+    """
+
+    @abc.abstractmethod
+    async def exchange(self, req: HttpRequest) -> HttpResponse:
+        raise NotImplementedError()
+
+
+def _format_request(req: HttpRequest, parts: SplitResult) -> bytes:
+    path = parts.path or "/"
+    if parts.query:
+        path += f"?{parts.query}"
+    body = req.body.encode('utf-8') if req.body is not None else None
+    lines = [f"{req.method.name} {path} HTTP/1.1",
+             f"Host: {parts.netloc}",
+             "Connection: close",
+             "Accept-Encoding: identity"]
+    if req.headers is not None:
+        for name, value in req.headers.items():
+            if type(value) is list:
+                value = ", ".join(value)
+            lines.append(f"{name}: {value}")
+    if body is not None:
+        lines.append(f"Content-Length: {len(body)}")
+    data = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+    return data + body if body is not None else data
+
+
+async def _read_line(reader: asyncio.StreamReader) -> str:
+    line = await reader.readline()
+    if len(line) > _MAX_LINE_LENGTH:
+        raise ValueError("Response line too long")
+    return line.decode('latin-1').rstrip("\r\n")
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    body = bytearray()
+    while True:
+        size = int((await _read_line(reader)).split(";")[0], 16)
+        if size == 0:
+            # Skip the trailers
+            while len(await _read_line(reader)) > 0:
+                pass
+            return bytes(body)
+        body.extend(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, CaseInsensitiveDict, bytes]:
+    status_line = await _read_line(reader)
+    fields = status_line.split(" ", 2)
+    if len(fields) < 2 or not fields[0].startswith("HTTP/"):
+        raise ValueError(f"Invalid status line: {status_line}")
+    status_code = int(fields[1])
+
+    headers = CaseInsensitiveDict()
+    while True:
+        line = await _read_line(reader)
+        if len(line) == 0:
+            break
+        name, _, value = line.partition(":")
+        name = name.strip()
+        value = value.strip()
+        current = headers.get(name)
+        headers[name] = value if current is None else f"{current}, {value}"
+
+    if status_code in (204, 304) or status_code // 100 == 1:
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = await _read_chunked(reader)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+    return status_code, headers, body
+
+
+def _decode(headers: CaseInsensitiveDict, body: bytes) -> str:
+    charset = 'utf-8'
+    content_type = headers.get('content-type')
+    if content_type is not None:
+        for param in content_type.split(";")[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == 'charset' and len(value) > 0:
+                charset = value.strip('"')
+    return body.decode(charset, errors='replace')
+
+
+class _AsyncHttpClientImpl(AsyncHttpClient):
+    """
+    Minimal HTTP/1.1 client on asyncio streams, with one connection per request. Redirects are not followed,
+    cookies are not sent and error responses are returned rather than raised. It is meant for calls that
+    authenticate with headers, such as the Live Agent long poll.
+    """
+
+    def __init__(self, default_timeout: Optional[float] = None):
+        self.default_timeout = default_timeout
+        self.__ssl_context: Optional[ssl.SSLContext] = None
+
+    def __get_ssl_context(self) -> ssl.SSLContext:
+        if self.__ssl_context is None:
+            self.__ssl_context = ssl.create_default_context(cafile=os.environ.get("CA_BUNDLE"))
+        return self.__ssl_context
+
+    async def __exchange(self, req: HttpRequest) -> HttpResponse:
+        parts = urlsplit(req.url)
+        secure = parts.scheme == 'https'
+        port = parts.port or (443 if secure else 80)
+        reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                       ssl=self.__get_ssl_context() if secure else None,
+                                                       limit=_MAX_LINE_LENGTH * 2)
+        try:
+            writer.write(_format_request(req, parts))
+            await writer.drain()
+            status_code, headers, body = await _read_response(reader)
+        finally:
+            writer.close()
+        return HttpResponse(status_code=status_code, headers=headers, body=_decode(headers, body), raw_body=body)
+
+    async def exchange(self, req: HttpRequest) -> HttpResponse:
+        timeout = req.timeout_seconds if req.timeout_seconds is not None else self.default_timeout
+        if timeout is None:
+            return await self.__exchange(req)
+        return await asyncio.wait_for(self.__exchange(req), timeout)
+
+
+class _ExecutorAsyncHttpClient(AsyncHttpClient):
+    def __init__(self, client: HttpClient, executor: Optional[Executor]):
+        self.client = client
+        self.executor = executor
+
+    async def exchange(self, req: HttpRequest) -> HttpResponse:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.client.exchange, req)
+
+
+def create_async_client() -> AsyncHttpClient:
+    return _AsyncHttpClientImpl()
+
+
+def wrap_client(client: HttpClient, executor: Executor = None) -> AsyncHttpClient:
+    """
+    Wraps a blocking client, each exchange runs in the executor. This does not save any threads, use it when the
+    blocking client is needed, i.e. for its cookies.
+
+    :param client: the client to wrap.
+    :param executor: the executor, None for the event loop's default executor.
+    :return: the async client.
+    """
+    return _ExecutorAsyncHttpClient(client, executor)
@@ -1,7 +1,7 @@
 import threading
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread
-from typing import Callable, Any, List, TypeVar, Generic, Optional, Iterable
+from typing import Callable, Any, List, TypeVar, Generic, Optional, Iterable, Sequence, Dict, Hashable
 
 from utils import loghelper
 from utils.collection_utils import BufferedList
@@ -149,3 +149,99 @@ def submit_blocks_in_parallel(
     )
     group.add_all(object_list)
     group.join()
+
+
+R = TypeVar("R")
+
+
+def map_in_parallel(object_list: Sequence[T],
+                    max_threads: int,
+                    function: Callable[[T], R]) -> List[R]:
+    """
+    Calls the given function for each object using up to max_threads threads, and waits for all of them to complete.
+
+    :param object_list: the objects.
+    :param max_threads: the max number of threads to use.
+    :param function: the function to call.
+    :return: the results, in the same order as object_list.
+    :raises BaseException: the first exception raised by the function, once all threads have completed.
+    """
+    assert max_threads > 0
+    count = len(object_list)
+    if count <= 1 or max_threads == 1:
+        return list(map(function, object_list))
+
+    results: List[Any] = [None] * count
+    errors: List[BaseException] = []
+    indexes = Queue()
+    for index in range(count):
+        indexes.put(index)
+
+    def worker():
+        while len(errors) == 0:
+            try:
+                index = indexes.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = function(object_list[index])
+            except BaseException as ex:
+                errors.append(ex)
+
+    threads = [start_thread(worker) for _ in range(min(max_threads, count))]
+    for t in threads:
+        t.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return results
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(Generic[R]):
+    """
+    Lets concurrent callers for the same key share a single call. The first caller (the leader) makes the call, and
+    callers arriving while it is in flight wait for it and get the same result, or exception.
+    """
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.__flights: Dict[Hashable, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def in_flight(self) -> int:
+        with self.__mutex:
+            return len(self.__flights)
+
+    def call(self, key: Hashable, function: Callable[[], R]) -> R:
+        with self.__mutex:
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+            return flight.result
+        except BaseException as ex:
+            flight.error = ex
+            raise ex
+        finally:
+            with self.__mutex:
+                del self.__flights[key]
+            flight.event.set()
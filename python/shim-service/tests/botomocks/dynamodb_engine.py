@@ -0,0 +1,819 @@
+import math
+import random
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from copy import deepcopy
+from threading import RLock
+from typing import Any, Callable, Dict, List, Optional, Tuple, Iterable
+
+from aws.dynamodb import DynamoDbItem, convert_value
+from botomocks import assert_empty, raise_invalid_parameter
+from botomocks.dynamodb_mock import _parse_conditions, _apply_updates
+from botomocks.exceptions import ConditionalCheckFailedException, AwsThrottlingException, \
+    AwsTransactionCanceledException, AwsResourceNotFoundResponseException
+from utils import date_utils
+
+# Returns a latency in milliseconds, using the given random number generator
+LatencyDistribution = Callable[[random.Random], float]
+
+# Attribute name and type, i.e. ('hashKey', 'S')
+KeySchema = Tuple[str, str]
+
+_READ_UNIT_SIZE = 4096
+_WRITE_UNIT_SIZE = 1024
+
+
+def fixed_latency(millis: float) -> LatencyDistribution:
+    return lambda r: millis
+
+
+def uniform_latency(low_millis: float, high_millis: float) -> LatencyDistribution:
+    return lambda r: r.uniform(low_millis, high_millis)
+
+
+def lognormal_latency(median_millis: float, sigma: float = 0.5) -> LatencyDistribution:
+    """
+    Long-tailed latency, which is closer to what DynamoDB looks like from a Lambda than a uniform distribution.
+    """
+    mu = math.log(median_millis)
+    return lambda r: r.lognormvariate(mu, sigma)
+
+
+def _attribute_size(value: Dict[str, Any]) -> int:
+    att_type, att_value = next(iter(value.items()))
+    if att_type == 'S':
+        return len(att_value.encode('utf-8'))
+    if att_type == 'N':
+        return (len(att_value.lstrip('-').replace('.', '')) + 1) // 2 + 1
+    if att_type == 'B':
+        return len(att_value)
+    if att_type == 'M':
+        return 3 + sum(len(name.encode('utf-8')) + _attribute_size(v) for name, v in att_value.items())
+    if att_type == 'L':
+        return 3 + sum(1 + _attribute_size(v) for v in att_value)
+    return 1
+
+
+def item_size(item: DynamoDbItem) -> int:
+    """
+    Approximates the size DynamoDB uses for capacity calculations.
+    """
+    return sum(len(name.encode('utf-8')) + _attribute_size(value) for name, value in item.items())
+
+
+def read_units(size: int, consistent: bool) -> float:
+    units = max(1, math.ceil(size / _READ_UNIT_SIZE))
+    return float(units) if consistent else units / 2
+
+
+def write_units(size: int) -> float:
+    return float(max(1, math.ceil(size / _WRITE_UNIT_SIZE)))
+
+
+def _key_value(value: Dict[str, Any]) -> Any:
+    att_type, att_value = next(iter(value.items()))
+    if att_type not in ('S', 'N', 'B'):
+        raise_invalid_parameter("Key", f"Invalid key type: {att_type}")
+    return convert_value(value)
+
+
+class CapacitySettings:
+    def __init__(self, read_units_per_second: Optional[float] = None,
+                 write_units_per_second: Optional[float] = None,
+                 partition_count: int = 1,
+                 burst_seconds: float = 300.0):
+        """
+        :param read_units_per_second: provisioned read capacity for the table, None for unlimited.
+        :param write_units_per_second: provisioned write capacity for the table, None for unlimited.
+        :param partition_count: the number of physical partitions, the capacity is split evenly between them.
+        :param burst_seconds: the number of seconds of unused capacity each partition can bank.
+        """
+        assert partition_count > 0
+        self.read_units_per_second = read_units_per_second
+        self.write_units_per_second = write_units_per_second
+        self.partition_count = partition_count
+        self.burst_seconds = burst_seconds
+
+
+class _CapacityBucket:
+    def __init__(self, units_per_second: float, burst_seconds: float):
+        self.units_per_second = units_per_second
+        self.max_units = max(units_per_second * burst_seconds, units_per_second)
+        self.units = self.max_units
+        self.last_time = date_utils.get_system_time_in_millis()
+        self.mutex = threading.Lock()
+
+    def try_consume(self, units: float) -> bool:
+        with self.mutex:
+            now = date_utils.get_system_time_in_millis()
+            elapsed = now - self.last_time
+            if elapsed > 0:
+                self.units = min(self.max_units, self.units + elapsed * self.units_per_second / 1000)
+                self.last_time = now
+            # Like DynamoDB, a request is allowed as long as there is some capacity left, and may overdraw it
+            if self.units <= 0:
+                return False
+            self.units -= units
+            return True
+
+
+class _PhysicalPartition:
+    def __init__(self, settings: CapacitySettings):
+        count = settings.partition_count
+        self.read_bucket = _CapacityBucket(settings.read_units_per_second / count, settings.burst_seconds) \
+            if settings.read_units_per_second is not None else None
+        self.write_bucket = _CapacityBucket(settings.write_units_per_second / count, settings.burst_seconds) \
+            if settings.write_units_per_second is not None else None
+
+
+class _ItemCollection:
+    """
+    The items that share a hash key, sorted by range key.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.sort_keys: List[Any] = []
+        self.items: Dict[Any, DynamoDbItem] = {}
+
+    def get(self, sort_value: Any) -> Optional[DynamoDbItem]:
+        return self.items.get(sort_value)
+
+    def put(self, sort_value: Any, item: DynamoDbItem) -> Optional[DynamoDbItem]:
+        current = self.items.get(sort_value)
+        if current is None:
+            self.sort_keys.insert(bisect_left(self.sort_keys, sort_value), sort_value)
+        self.items[sort_value] = item
+        return current
+
+    def remove(self, sort_value: Any) -> Optional[DynamoDbItem]:
+        current = self.items.pop(sort_value, None)
+        if current is not None:
+            del self.sort_keys[bisect_left(self.sort_keys, sort_value)]
+        return current
+
+
+class EngineTable:
+    def __init__(self, name: str,
+                 hash_key: KeySchema,
+                 range_key: Optional[KeySchema] = None,
+                 capacity: Optional[CapacitySettings] = None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.mutex = RLock()
+        self.collections: Dict[Any, _ItemCollection] = {}
+        self.physical_partitions: List[_PhysicalPartition] = []
+        self.set_capacity(capacity)
+
+    def set_capacity(self, capacity: Optional[CapacitySettings]):
+        if capacity is None:
+            self.physical_partitions = []
+        else:
+            self.physical_partitions = [_PhysicalPartition(capacity) for _ in range(capacity.partition_count)]
+
+    def key_values(self, key: DynamoDbItem) -> Tuple[Any, Any]:
+        hash_value = key.get(self.hash_key[0])
+        if hash_value is None:
+            raise_invalid_parameter("Key", f"Missing hash key {self.hash_key[0]}")
+        if self.range_key is None:
+            return _key_value(hash_value), 0
+        range_value = key.get(self.range_key[0])
+        if range_value is None:
+            raise_invalid_parameter("Key", f"Missing range key {self.range_key[0]}")
+        return _key_value(hash_value), _key_value(range_value)
+
+    def extract_key(self, item: DynamoDbItem) -> DynamoDbItem:
+        key = {self.hash_key[0]: item[self.hash_key[0]]}
+        if self.range_key is not None:
+            key[self.range_key[0]] = item[self.range_key[0]]
+        return key
+
+    def get_collection(self, hash_value: Any, create: bool = False) -> Optional[_ItemCollection]:
+        collection = self.collections.get(hash_value)
+        if collection is None and create:
+            with self.mutex:
+                collection = self.collections.get(hash_value)
+                if collection is None:
+                    collection = self.collections[hash_value] = _ItemCollection()
+        return collection
+
+    def sorted_hash_values(self) -> List[Any]:
+        with self.mutex:
+            return sorted(self.collections.keys())
+
+    def try_consume(self, hash_value: Any, units: float, write: bool) -> bool:
+        partitions = self.physical_partitions
+        if len(partitions) == 0:
+            return True
+        partition = partitions[zlib.crc32(str(hash_value).encode('utf-8')) % len(partitions)]
+        bucket = partition.write_bucket if write else partition.read_bucket
+        return bucket is None or bucket.try_consume(units)
+
+
+class _KeyCondition:
+    def __init__(self, expression: str, values: Dict[str, Any]):
+        parts = expression.split(" AND ")
+        if len(parts) > 2:
+            raise_invalid_parameter("Query", f"Unsupported key condition: {expression}")
+        tokens = parts[0].split(' ')
+        if len(tokens) != 3 or tokens[1] != '=':
+            raise_invalid_parameter("Query", f"Unsupported key condition: {expression}")
+        self.hash_value = _key_value(values[tokens[2]])
+        self.operation = None
+        self.range_value = None
+        if len(parts) == 2:
+            range_part = parts[1].strip()
+            if range_part.startswith("begins_with("):
+                args = range_part[len("begins_with("):-1].split(',')
+                self.operation = "begins_with"
+                self.range_value = _key_value(values[args[1].strip()])
+            else:
+                tokens = range_part.split(' ')
+                if len(tokens) != 3:
+                    raise_invalid_parameter("Query", f"Unsupported key condition: {expression}")
+                self.operation = tokens[1]
+                self.range_value = _key_value(values[tokens[2]])
+
+    def index_range(self, sort_keys: List[Any]) -> Tuple[int, int]:
+        op = self.operation
+        v = self.range_value
+        if op is None:
+            return 0, len(sort_keys)
+        if op == '=':
+            return bisect_left(sort_keys, v), bisect_right(sort_keys, v)
+        if op == '<':
+            return 0, bisect_left(sort_keys, v)
+        if op == '<=':
+            return 0, bisect_right(sort_keys, v)
+        if op == '>':
+            return bisect_right(sort_keys, v), len(sort_keys)
+        if op == '>=':
+            return bisect_left(sort_keys, v), len(sort_keys)
+        if op == 'begins_with':
+            start = bisect_left(sort_keys, v)
+            end = start
+            while end < len(sort_keys) and sort_keys[end].startswith(v):
+                end += 1
+            return start, end
+        raise_invalid_parameter("Query", f"Unsupported key operation: {op}")
+
+
+def _merge_names(values: Optional[Dict[str, Any]], names: Optional[Dict[str, str]]) -> Dict[str, Any]:
+    merged = dict(values) if values is not None else {}
+    if names is not None:
+        merged.update(names)
+    return merged
+
+
+def _project(item: DynamoDbItem, projection: Optional[str], names: Optional[Dict[str, str]]) -> DynamoDbItem:
+    if projection is None:
+        return deepcopy(item)
+    result = {}
+    for name in projection.split(','):
+        name = name.strip()
+        if name.startswith('#'):
+            name = names[name]
+        value = item.get(name)
+        if value is not None:
+            result[name] = deepcopy(value)
+    return result
+
+
+def _check_condition(operation: str, expression: Optional[str], current: Optional[DynamoDbItem],
+                     attributes: Dict[str, Any]) -> bool:
+    if expression is None:
+        return True
+    return _parse_conditions(expression).validate(operation, current or {}, attributes, fail=False)
+
+
+def _pop_return_capacity(kwargs: Dict[str, Any]) -> bool:
+    mode = kwargs.pop('ReturnConsumedCapacity', None)
+    return mode is not None and mode != 'NONE'
+
+
+def _capacity_record(units_by_table: Dict[str, float], as_list: bool) -> Any:
+    entries = [{'TableName': table_name, 'CapacityUnits': units} for table_name, units in units_by_table.items()]
+    if as_list:
+        return entries
+    return entries[0] if len(entries) > 0 else None
+
+
+class _Throttled(Exception):
+    pass
+
+
+class LocalDynamoDbEngine:
+    """
+    An in-process stand-in for DynamoDB, meant for load tests and benchmarks rather than correctness tests.
+
+    Items sharing a hash key are kept sorted by range key, so key conditions are resolved with a binary search, and
+    each item collection has its own lock so calls for different keys do not contend. Tables can be given
+    provisioned capacity, split over simulated physical partitions, in which case calls that exceed it fail with
+    ProvisionedThroughputExceededException (or come back unprocessed for batch calls). Latency is simulated by
+    sleeping after each call, and ThrottlingException can be injected randomly.
+    """
+
+    def __init__(self, latency: LatencyDistribution = None,
+                 latencies: Dict[str, LatencyDistribution] = None,
+                 throttle_probability: float = 0.0,
+                 seed: int = None,
+                 sleeper: Callable[[float], None] = time.sleep):
+        """
+        :param latency: the default latency distribution, None for no latency.
+        :param latencies: latency distributions by operation name, i.e. "GetItem".
+        :param throttle_probability: the probability of any call failing with ThrottlingException.
+        :param seed: seed for the random number generator.
+        :param sleeper: used to sleep.
+        """
+        self.tables: Dict[str, EngineTable] = {}
+        self.latency = latency
+        self.latencies = dict(latencies) if latencies is not None else {}
+        self.throttle_probability = throttle_probability
+        self.__random = random.Random(seed)
+        self.__sleeper = sleeper
+        self.__mutex = RLock()
+        self.call_counts: Dict[str, int] = {}
+        self.throttle_counts: Dict[str, int] = {}
+        self.consumed_read_units: Dict[str, float] = {}
+        self.consumed_write_units: Dict[str, float] = {}
+
+    def create_table(self, name: str,
+                     hash_key: KeySchema,
+                     range_key: Optional[KeySchema] = None,
+                     capacity: Optional[CapacitySettings] = None) -> EngineTable:
+        table = self.tables[name] = EngineTable(name, hash_key, range_key, capacity)
+        return table
+
+    def add_manual_table_v2(self, name: str, hash_key: dict, range_key: Optional[dict] = None):
+        """
+        Same as MockDynamoDbClient.add_manual_table_v2, so setup_ddb() can be used.
+        """
+        self.create_table(name, next(iter(hash_key.items())),
+                          next(iter(range_key.items())) if range_key is not None else None)
+
+    def set_capacity(self, table_name: str, capacity: Optional[CapacitySettings]):
+        self.__get_table("UpdateTable", table_name).set_capacity(capacity)
+
+    def __get_table(self, operation: str, name: str) -> EngineTable:
+        t = self.tables.get(name)
+        if t is None:
+            raise AwsResourceNotFoundResponseException(operation, "Requested resource not found")
+        return t
+
+    def __increment(self, counts: Dict[str, Any], name: str, amount: Any = 1):
+        with self.__mutex:
+            counts[name] = counts.get(name, 0) + amount
+
+    def __consume(self, operation: str, table: EngineTable, hash_value: Any, units: float, write: bool):
+        if not table.try_consume(hash_value, units, write):
+            self.__increment(self.throttle_counts, operation)
+            raise _Throttled()
+        self.__increment(self.consumed_write_units if write else self.consumed_read_units, table.name, units)
+
+    def __invoke(self, operation: str, function: Callable[[], Any]) -> Any:
+        self.__increment(self.call_counts, operation)
+        distribution = self.latencies.get(operation, self.latency)
+        with self.__mutex:
+            latency = distribution(self.__random) if distribution is not None else 0
+            inject = self.throttle_probability > 0 and self.__random.random() < self.throttle_probability
+        try:
+            if inject:
+                self.__increment(self.throttle_counts, operation)
+                raise AwsThrottlingException(operation)
+            try:
+                return function()
+            except _Throttled:
+                raise AwsThrottlingException(operation, "ProvisionedThroughputExceededException")
+        finally:
+            if latency > 0:
+                self.__sleeper(latency / 1000)
+
+    def get_item(self, **kwargs):
+        return self.__invoke("GetItem", lambda: self.__get_item(dict(kwargs)))
+
+    def __get_item(self, kwargs: Dict[str, Any]):
+        table = self.__get_table("GetItem", kwargs.pop('TableName'))
+        key = kwargs.pop('Key')
+        consistent = kwargs.pop('ConsistentRead', False)
+        projection = kwargs.pop('ProjectionExpression', None)
+        names = kwargs.pop('ExpressionAttributeNames', None)
+        return_capacity = _pop_return_capacity(kwargs)
+        assert_empty(kwargs)
+
+        hash_value, sort_value = table.key_values(key)
+        collection = table.get_collection(hash_value)
+        item = None
+        if collection is not None:
+            with collection.lock:
+                item = collection.get(sort_value)
+                if item is not None:
+                    item = _project(item, projection, names)
+        units = read_units(item_size(item) if item is not None else 0, consistent)
+        self.__consume("GetItem", table, hash_value, units, False)
+        record = {}
+        if item is not None:
+            record['Item'] = item
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record({table.name: units}, False)
+        return record
+
+    def put_item(self, **kwargs):
+        return self.__invoke("PutItem", lambda: self.__put_item(dict(kwargs)))
+
+    def __put_item(self, kwargs: Dict[str, Any]):
+        table = self.__get_table("PutItem", kwargs.pop('TableName'))
+        item = kwargs.pop('Item')
+        condition = kwargs.pop('ConditionExpression', None)
+        attributes = _merge_names(kwargs.pop('ExpressionAttributeValues', None),
+                                  kwargs.pop('ExpressionAttributeNames', None))
+        return_values = kwargs.pop('ReturnValues', None)
+        return_capacity = _pop_return_capacity(kwargs)
+        kwargs.pop('ReturnItemCollectionMetrics', None)
+        assert_empty(kwargs)
+
+        hash_value, sort_value = table.key_values(item)
+        units = write_units(item_size(item))
+        collection = table.get_collection(hash_value, create=True)
+        with collection.lock:
+            self.__consume("PutItem", table, hash_value, units, True)
+            current = collection.get(sort_value)
+            if not _check_condition("PutItem", condition, current, attributes):
+                raise ConditionalCheckFailedException("PutItem")
+            collection.put(sort_value, deepcopy(item))
+        record = {}
+        if return_values == 'ALL_OLD' and current is not None:
+            record['Attributes'] = deepcopy(current)
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record({table.name: units}, False)
+        return record
+
+    def update_item(self, **kwargs):
+        return self.__invoke("UpdateItem", lambda: self.__update_item(dict(kwargs)))
+
+    def __update_item(self, kwargs: Dict[str, Any]):
+        table = self.__get_table("UpdateItem", kwargs.pop('TableName'))
+        key = kwargs.pop('Key')
+        expression = kwargs.pop('UpdateExpression')
+        condition = kwargs.pop('ConditionExpression', None)
+        values = kwargs.pop('ExpressionAttributeValues', None)
+        attributes = _merge_names(values, kwargs.pop('ExpressionAttributeNames', None))
+        return_values = kwargs.pop('ReturnValues', None)
+        return_capacity = _pop_return_capacity(kwargs)
+        kwargs.pop('ReturnItemCollectionMetrics', None)
+        assert_empty(kwargs)
+
+        hash_value, sort_value = table.key_values(key)
+        collection = table.get_collection(hash_value, create=True)
+        with collection.lock:
+            current = collection.get(sort_value)
+            updates = _apply_updates(expression, values, current)
+            new_item = dict(current) if current is not None else dict(key)
+            new_item.update(deepcopy(updates))
+            units = write_units(max(item_size(new_item), item_size(current) if current is not None else 0))
+            self.__consume("UpdateItem", table, hash_value, units, True)
+            if not _check_condition("UpdateItem", condition, current, attributes):
+                raise ConditionalCheckFailedException("UpdateItem")
+            collection.put(sort_value, new_item)
+        record = {}
+        if return_values == 'ALL_OLD' and current is not None:
+            record['Attributes'] = deepcopy(current)
+        elif return_values == 'ALL_NEW':
+            record['Attributes'] = deepcopy(new_item)
+        elif return_values == 'UPDATED_NEW':
+            record['Attributes'] = deepcopy(updates)
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record({table.name: units}, False)
+        return record
+
+    def delete_item(self, **kwargs):
+        return self.__invoke("DeleteItem", lambda: self.__delete_item(dict(kwargs)))
+
+    def __delete_item(self, kwargs: Dict[str, Any]):
+        table = self.__get_table("DeleteItem", kwargs.pop('TableName'))
+        key = kwargs.pop('Key')
+        condition = kwargs.pop('ConditionExpression', None)
+        attributes = _merge_names(kwargs.pop('ExpressionAttributeValues', None),
+                                  kwargs.pop('ExpressionAttributeNames', None))
+        return_values = kwargs.pop('ReturnValues', None)
+        return_capacity = _pop_return_capacity(kwargs)
+        assert_empty(kwargs)
+
+        hash_value, sort_value = table.key_values(key)
+        collection = table.get_collection(hash_value, create=True)
+        with collection.lock:
+            current = collection.get(sort_value)
+            units = write_units(item_size(current) if current is not None else 0)
+            self.__consume("DeleteItem", table, hash_value, units, True)
+            if not _check_condition("DeleteItem", condition, current, attributes):
+                raise ConditionalCheckFailedException("DeleteItem")
+            collection.remove(sort_value)
+        record = {}
+        if return_values == 'ALL_OLD' and current is not None:
+            record['Attributes'] = current
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record({table.name: units}, False)
+        return record
+
+    def query(self, **kwargs):
+        return self.__invoke("Query", lambda: self.__query(dict(kwargs)))
+
+    def __query(self, kwargs: Dict[str, Any]):
+        table = self.__get_table("Query", kwargs.pop('TableName'))
+        select = kwargs.pop('Select', 'ALL_ATTRIBUTES')
+        projection = kwargs.pop('ProjectionExpression', None)
+        values = kwargs.pop('ExpressionAttributeValues')
+        names = kwargs.pop('ExpressionAttributeNames', None)
+        key_condition = _KeyCondition(kwargs.pop('KeyConditionExpression'), values)
+        filter_expression = kwargs.pop('FilterExpression', None)
+        limit: Optional[int] = kwargs.pop('Limit', None)
+        start_key = kwargs.pop('ExclusiveStartKey', None)
+        consistent = kwargs.pop('ConsistentRead', False)
+        forward = kwargs.pop('ScanIndexForward', True)
+        return_capacity = _pop_return_capacity(kwargs)
+        assert_empty(kwargs)
+
+        evaluated: List[DynamoDbItem] = []
+        more = False
+        collection = table.get_collection(key_condition.hash_value)
+        if collection is not None:
+            with collection.lock:
+                start, end = key_condition.index_range(collection.sort_keys)
+                if start_key is not None:
+                    start_value = table.key_values(start_key)[1]
+                    if forward:
+                        start = max(start, bisect_right(collection.sort_keys, start_value))
+                    else:
+                        end = min(end, bisect_left(collection.sort_keys, start_value))
+                sort_keys = collection.sort_keys[start:end]
+                if not forward:
+                    sort_keys.reverse()
+                if limit is not None and len(sort_keys) > limit:
+                    sort_keys = sort_keys[0:limit]
+                    more = True
+                evaluated = [collection.items[sort_value] for sort_value in sort_keys]
+
+        size = sum(map(item_size, evaluated))
+        units = read_units(size, consistent)
+        self.__consume("Query", table, key_condition.hash_value, units, False)
+        return self.__build_page(table, evaluated, more, select, projection, names, values, filter_expression,
+                                 {table.name: units} if return_capacity else None)
+
+    def __build_page(self, table: EngineTable,
+                     evaluated: List[DynamoDbItem],
+                     more: bool,
+                     select: Optional[str],
+                     projection: Optional[str],
+                     names: Optional[Dict[str, str]],
+                     values: Optional[Dict[str, Any]],
+                     filter_expression: Optional[str],
+                     consumed: Optional[Dict[str, float]]) -> Dict[str, Any]:
+        record = {'ScannedCount': len(evaluated)}
+        if more and len(evaluated) > 0:
+            record['LastEvaluatedKey'] = deepcopy(table.extract_key(evaluated[-1]))
+        results = evaluated
+        if filter_expression is not None:
+            results = _parse_conditions(filter_expression).filter_list(results, _merge_names(values, names))
+        record['Count'] = len(results)
+        if select != 'COUNT':
+            record['Items'] = [_project(item, projection, names) for item in results]
+        if consumed is not None:
+            record['ConsumedCapacity'] = _capacity_record(consumed, False)
+        return record
+
+    def scan(self, **kwargs):
+        return self.__invoke("Scan", lambda: self.__scan(dict(kwargs)))
+
+    def __scan(self, kwargs: Dict[str, Any]):
+        table = self.__get_table("Scan", kwargs.pop('TableName'))
+        select = kwargs.pop('Select', 'ALL_ATTRIBUTES')
+        projection = kwargs.pop('ProjectionExpression', None)
+        values = kwargs.pop('ExpressionAttributeValues', None)
+        names = kwargs.pop('ExpressionAttributeNames', None)
+        filter_expression = kwargs.pop('FilterExpression', None)
+        segment: Optional[int] = kwargs.pop('Segment', None)
+        total_segments: Optional[int] = kwargs.pop('TotalSegments', None)
+        limit: Optional[int] = kwargs.pop('Limit', None)
+        start_key = kwargs.pop('ExclusiveStartKey', None)
+        consistent = kwargs.pop('ConsistentRead', False)
+        return_capacity = _pop_return_capacity(kwargs)
+        assert_empty(kwargs)
+        if (segment is None) != (total_segments is None):
+            raise_invalid_parameter("Scan", "Segment and TotalSegments must be specified together")
+
+        hash_values = table.sorted_hash_values()
+        if total_segments is not None:
+            hash_values = list(filter(lambda hv: zlib.crc32(str(hv).encode('utf-8')) % total_segments == segment,
+                                      hash_values))
+        start_hash_value = start_sort_value = None
+        if start_key is not None:
+            start_hash_value, start_sort_value = table.key_values(start_key)
+            hash_values = hash_values[bisect_left(hash_values, start_hash_value):]
+
+        evaluated: List[DynamoDbItem] = []
+        more = False
+        units = 0.0
+        for hash_value in hash_values:
+            if more:
+                break
+            collection = table.get_collection(hash_value)
+            if collection is None:
+                continue
+            with collection.lock:
+                start = 0
+                if start_key is not None and hash_value == start_hash_value:
+                    start = bisect_right(collection.sort_keys, start_sort_value)
+                items = [collection.items[sort_value] for sort_value in collection.sort_keys[start:]]
+            if limit is not None and len(evaluated) + len(items) >= limit:
+                more = len(evaluated) + len(items) > limit or hash_value != hash_values[-1]
+                items = items[0:limit - len(evaluated)]
+            if len(items) > 0:
+                partition_units = read_units(sum(map(item_size, items)), consistent)
+                self.__consume("Scan", table, hash_value, partition_units, False)
+                units += partition_units
+                evaluated.extend(items)
+
+        return self.__build_page(table, evaluated, more, select, projection, names, values, filter_expression,
+                                 {table.name: units} if return_capacity else None)
+
+    def batch_get_item(self, **kwargs):
+        return self.__invoke("BatchGetItem", lambda: self.__batch_get_item(dict(kwargs)))
+
+    def __batch_get_item(self, kwargs: Dict[str, Any]):
+        request_items: Dict[str, Dict[str, Any]] = kwargs.pop('RequestItems')
+        return_capacity = _pop_return_capacity(kwargs)
+        assert_empty(kwargs)
+        if sum(map(lambda r: len(r['Keys']), request_items.values())) > 100:
+            raise_invalid_parameter("BatchGetItem", "Too many items requested for the BatchGetItem call")
+
+        responses: Dict[str, List[DynamoDbItem]] = {}
+        unprocessed: Dict[str, Dict[str, Any]] = {}
+        consumed: Dict[str, float] = {}
+        processed = 0
+        for table_name, request in request_items.items():
+            params = {'TableName': table_name, 'ConsistentRead': request.get('ConsistentRead', False)}
+            for name in ('ProjectionExpression', 'ExpressionAttributeNames'):
+                if name in request:
+                    params[name] = request[name]
+            for key in request['Keys']:
+                try:
+                    result = self.__get_item(dict(params, Key=key, ReturnConsumedCapacity="TOTAL"))
+                except _Throttled:
+                    unprocessed_request = unprocessed.get(table_name)
+                    if unprocessed_request is None:
+                        unprocessed_request = unprocessed[table_name] = dict(request, Keys=[])
+                    unprocessed_request['Keys'].append(key)
+                    continue
+                processed += 1
+                consumed[table_name] = consumed.get(table_name, 0.0) + result['ConsumedCapacity']['CapacityUnits']
+                item = result.get('Item')
+                if item is not None:
+                    responses.setdefault(table_name, []).append(item)
+        if processed == 0 and len(unprocessed) > 0:
+            raise _Throttled()
+        record = {'Responses': responses, 'UnprocessedKeys': unprocessed}
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record(consumed, True)
+        return record
+
+    def batch_write_item(self, **kwargs):
+        return self.__invoke("BatchWriteItem", lambda: self.__batch_write_item(dict(kwargs)))
+
+    def __batch_write_item(self, kwargs: Dict[str, Any]):
+        request_items: Dict[str, List[Dict[str, Any]]] = kwargs.pop('RequestItems')
+        return_capacity = _pop_return_capacity(kwargs)
+        kwargs.pop('ReturnItemCollectionMetrics', None)
+        assert_empty(kwargs)
+        if sum(map(len, request_items.values())) > 25:
+            raise_invalid_parameter("BatchWriteItem", "Too many items requested for the BatchWriteItem call")
+
+        unprocessed: Dict[str, List[Dict[str, Any]]] = {}
+        consumed: Dict[str, float] = {}
+        processed = 0
+        for table_name, requests in request_items.items():
+            for request in requests:
+                action, content = next(iter(request.items()))
+                try:
+                    if action == 'PutRequest':
+                        result = self.__put_item({'TableName': table_name, 'Item': content['Item'],
+                                                  'ReturnConsumedCapacity': "TOTAL"})
+                    elif action == 'DeleteRequest':
+                        result = self.__delete_item({'TableName': table_name, 'Key': content['Key'],
+                                                     'ReturnConsumedCapacity': "TOTAL"})
+                    else:
+                        raise_invalid_parameter("BatchWriteItem", f"Invalid action: {action}")
+                        return None
+                except _Throttled:
+                    unprocessed.setdefault(table_name, []).append(request)
+                    continue
+                processed += 1
+                consumed[table_name] = consumed.get(table_name, 0.0) + result['ConsumedCapacity']['CapacityUnits']
+        if processed == 0 and len(unprocessed) > 0:
+            raise _Throttled()
+        record = {'UnprocessedItems': unprocessed}
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record(consumed, True)
+        return record
+
+    def transact_write_items(self, **kwargs):
+        return self.__invoke("TransactWriteItems", lambda: self.__transact_write_items(dict(kwargs)))
+
+    def __transact_write_items(self, kwargs: Dict[str, Any]):
+        items: List[Dict[str, Any]] = kwargs.pop('TransactItems')
+        return_capacity = _pop_return_capacity(kwargs)
+        kwargs.pop('ReturnItemCollectionMetrics', None)
+        kwargs.pop('ClientRequestToken', None)
+        assert_empty(kwargs)
+        if len(items) > 100:
+            raise_invalid_parameter("TransactWriteItems", "Too many items in the transaction")
+
+        entries = []
+        for item in items:
+            action, params = next(iter(item.items()))
+            table = self.__get_table("TransactWriteItems", params['TableName'])
+            key = params['Item'] if action == 'Put' else params['Key']
+            hash_value, sort_value = table.key_values(key)
+            collection = table.get_collection(hash_value, create=True)
+            entries.append((action, params, table, hash_value, sort_value, collection))
+
+        # Lock in a consistent order to avoid deadlocks with other transactions
+        collections = {id(e[5]): e for e in entries}
+        ordered = sorted(collections.values(), key=lambda e: (e[2].name, str(e[3])))
+        for e in ordered:
+            e[5].lock.acquire()
+        try:
+            return self.__apply_transaction(entries, return_capacity)
+        finally:
+            for e in reversed(ordered):
+                e[5].lock.release()
+
+    def __apply_transaction(self, entries: List[Tuple], return_capacity: bool):
+        reasons = []
+        failed = False
+        consumed: Dict[str, float] = {}
+        for action, params, table, hash_value, sort_value, collection in entries:
+            current = collection.get(sort_value)
+            attributes = _merge_names(params.get('ExpressionAttributeValues'), params.get('ExpressionAttributeNames'))
+            if action == 'Put':
+                size = item_size(params['Item'])
+            else:
+                size = item_size(current) if current is not None else 0
+            units = write_units(size) * 2
+            if not table.try_consume(hash_value, units, True):
+                self.__increment(self.throttle_counts, "TransactWriteItems")
+                raise _Throttled()
+            consumed[table.name] = consumed.get(table.name, 0.0) + units
+            self.__increment(self.consumed_write_units, table.name, units)
+            condition = params.get('ConditionExpression')
+            if _check_condition(action, condition, current, attributes):
+                reasons.append({'Code': 'None'})
+            else:
+                failed = True
+                reasons.append({'Code': 'ConditionalCheckFailed', 'Message': "The conditional request failed"})
+        if failed:
+            raise AwsTransactionCanceledException(reasons)
+
+        for action, params, table, hash_value, sort_value, collection in entries:
+            if action == 'Put':
+                collection.put(sort_value, deepcopy(params['Item']))
+            elif action == 'Delete':
+                collection.remove(sort_value)
+            elif action == 'Update':
+                current = collection.get(sort_value)
+                new_item = dict(current) if current is not None else dict(params['Key'])
+                new_item.update(deepcopy(_apply_updates(params['UpdateExpression'],
+                                                        params.get('ExpressionAttributeValues'), current)))
+                collection.put(sort_value, new_item)
+            elif action != 'ConditionCheck':
+                raise_invalid_parameter("TransactWriteItems", f"Unsupported action {action}")
+        record = {}
+        if return_capacity:
+            record['ConsumedCapacity'] = _capacity_record(consumed, True)
+        return record
+
+    def get_throttle_count(self) -> int:
+        with self.__mutex:
+            return sum(self.throttle_counts.values())
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        :return: the call, throttle and consumed capacity counts so far.
+        """
+        with self.__mutex:
+            return {
+                'calls': dict(self.call_counts),
+                'throttles': dict(self.throttle_counts),
+                'readCapacityUnits': dict(self.consumed_read_units),
+                'writeCapacityUnits': dict(self.consumed_write_units)
+            }
+
+
+def iterate_items(table: EngineTable) -> Iterable[DynamoDbItem]:
+    for hash_value in table.sorted_hash_values():
+        collection = table.get_collection(hash_value)
+        with collection.lock:
+            items = [collection.items[sort_value] for sort_value in collection.sort_keys]
+        for item in items:
+            yield item
@@ -1,6 +1,8 @@
 import abc
 import random
+import zlib
 from copy import deepcopy
+from decimal import Decimal
 from threading import RLock
 from typing import List, Optional, Any, Dict, Tuple, Iterable, Callable
 
@@ -260,6 +262,44 @@ def _collect_updates(expr: str, attributes: Dict[str, Dict[str, Any]]):
     return record
 
 
+def _add_numbers(left: str, right: str) -> str:
+    return str(Decimal(left) + Decimal(right))
+
+
+def _collect_additions(expr: str, attributes: Dict[str, Dict[str, Any]]):
+    values = expr[3::].split(",")
+    record = {}
+    for v in values:
+        pair = v.split()
+        prop_name = pair[0].strip()
+        check_keyword(prop_name)
+        value = attributes[pair[1].strip()]
+        if 'N' not in value:
+            raise NotImplementedError(f"Unsupported ADD value: {value}")
+        record[prop_name] = value
+    return record
+
+
+def _apply_updates(expr: str, attributes: Dict[str, Dict[str, Any]], current: Optional[Dict[str, Any]]):
+    """
+    Applies a SET or ADD update expression.
+
+    :return: the updated attributes, with their new values.
+    """
+    if not expr.startswith("ADD "):
+        return _collect_updates(expr, attributes)
+    record = {}
+    for prop_name, value in _collect_additions(expr, attributes).items():
+        existing = current.get(prop_name) if current is not None else None
+        if existing is None:
+            record[prop_name] = dict(value)
+        elif 'N' not in existing:
+            raise DynamoDbValidationException("An operand in the update expression has an incorrect data type")
+        else:
+            record[prop_name] = {'N': _add_numbers(existing['N'], value['N'])}
+    return record
+
+
 def check_keyword(attribute: str):
     if attribute.lower() in RESERVED_WORDS:
         raise DynamoDbValidationException(
@@ -308,6 +348,24 @@ def _parse_condition_expression(expr: str) -> ParsedConditionExpression:
     raise AssertionError(f"Can't parse '{expr}'")
 
 
+def _pop_consumed_capacity(kwargs: Dict[str, Any]) -> bool:
+    mode = kwargs.pop('ReturnConsumedCapacity', None)
+    if mode is not None and mode not in ('NONE', 'TOTAL', 'INDEXES'):
+        raise AwsInvalidParameterResponseException("ReturnConsumedCapacity", f"Invalid value: {mode}")
+    return mode is not None and mode != 'NONE'
+
+
+def _add_consumed_capacity(record: Dict[str, Any], table_name: str, capacity_units: float):
+    record['ConsumedCapacity'] = {'TableName': table_name, 'CapacityUnits': capacity_units}
+    return record
+
+
+def _add_consumed_capacities(record: Dict[str, Any], units_by_table: Dict[str, float]):
+    record['ConsumedCapacity'] = [{'TableName': table_name, 'CapacityUnits': units}
+                                  for table_name, units in units_by_table.items()]
+    return record
+
+
 class MockDynamoDbClient:
     def __init__(self):
         self.tables: Dict[str, Table] = {}
@@ -319,6 +377,10 @@ class MockDynamoDbClient:
         self.__get_callback: Optional[Callable] = None
         self.__put_callback: Optional[Callable] = None
         self.__delete_listeners: List[Callable] = []
+        # Max number of keys/items processed per batch call, the rest are returned as unprocessed
+        self.max_batch_processed: Optional[int] = None
+        self.batch_get_count = 0
+        self.batch_write_count = 0
 
     def add_delete_listener(self, listener: DeleteListener):
         self.__delete_listeners.append(listener)
@@ -358,7 +420,7 @@ class MockDynamoDbClient:
         table_name = kwargs.pop('TableName')
         item = kwargs.pop('Item')
         expr = kwargs.pop('ConditionExpression', None)
-        kwargs.pop('ReturnConsumedCapacity', None)
+        return_capacity = _pop_consumed_capacity(kwargs)
         kwargs.pop('ReturnItemCollectionMetrics', None)
         return_values = kwargs.pop("ReturnValues", None)
         if return_values is not None and return_values not in ('NONE', 'ALL_OLD'):
@@ -371,9 +433,12 @@ class MockDynamoDbClient:
             if c():
                 self.__put_callback = c
         old_values = self.__get_table(table_name).add(item, replace)
+        record = {}
         if return_values == 'ALL_OLD' and old_values is not None:
-            return {'Attributes': old_values}
-        return {}
+            record['Attributes'] = old_values
+        if return_capacity:
+            _add_consumed_capacity(record, table_name, 1.0)
+        return record
 
     @synchronized
     def update_item(self, **kwargs):
@@ -384,11 +449,11 @@ class MockDynamoDbClient:
         expr = kwargs.pop("UpdateExpression")
         condition_expr = kwargs.pop("ConditionExpression", None)
         expr_attributes = kwargs.pop("ExpressionAttributeValues", None)
-        kwargs.pop('ReturnConsumedCapacity', None)
+        return_capacity = _pop_consumed_capacity(kwargs)
+        return_values = kwargs.pop('ReturnValues', None)
         kwargs.pop('ReturnItemCollectionMetrics', None)
 
         assert_empty(kwargs)
-        updates = _collect_updates(expr, expr_attributes)
         t = self.__get_table(table_name)
 
         if self.__update_callback:
@@ -404,12 +469,18 @@ class MockDynamoDbClient:
         if condition_expr is not None:
             conditions = _parse_conditions(condition_expr)
             conditions.validate("UpdateItem", current, expr_attributes)
+        updates = _apply_updates(expr, expr_attributes, current)
         current.update(updates)
         if new_record:
             current.update(key)
             t.add(current)
 
-        return {}
+        result = {}
+        if return_values == 'UPDATED_NEW':
+            result['Attributes'] = deepcopy(updates)
+        elif return_values == 'ALL_NEW':
+            result['Attributes'] = deepcopy(current)
+        return _add_consumed_capacity(result, table_name, 1.0) if return_capacity else result
 
     @synchronized
     def delete_item(self, **kwargs):
@@ -420,6 +491,7 @@ class MockDynamoDbClient:
         rv = kwargs.pop('ReturnValues', None)
         condition_expr = kwargs.pop('ConditionExpression', None)
         expr_attributes = kwargs.pop("ExpressionAttributeValues", None)
+        return_capacity = _pop_consumed_capacity(kwargs)
         if len(kwargs) != 0:
             raise AssertionError(f"Unrecognized properties: {','.join(kwargs.keys())}")
 
@@ -444,15 +516,32 @@ class MockDynamoDbClient:
             record['Attributes'] = v
         for l in self.__delete_listeners:
             l(table_name, key)
+        if return_capacity:
+            _add_consumed_capacity(record, table_name, 1.0)
         return record
 
+    def __condition_check(self, **kwargs):
+        kwargs = dict(kwargs)
+        table_name = kwargs.pop('TableName')
+        key = kwargs.pop('Key')
+        condition_expr = kwargs.pop('ConditionExpression')
+        expr_attributes = kwargs.pop("ExpressionAttributeValues", None)
+        if len(kwargs) != 0:
+            raise AssertionError(f"Unrecognized properties: {','.join(kwargs.keys())}")
+
+        current = self.__get_table(table_name).get(key)
+        if current is None:
+            raise ConditionalCheckFailedException("ConditionCheck")
+        _parse_conditions(condition_expr).validate("ConditionCheck", current, expr_attributes)
+
     @synchronized
     def get_item(self, **kwargs):
         kwargs = dict(kwargs)
         table_name = kwargs.pop('TableName')
         key = kwargs.pop('Key')
-        kwargs.pop("ConsistentRead", None)
+        consistent = kwargs.pop("ConsistentRead", False)
         attributes = kwargs.pop("ProjectionExpression", None)
+        return_capacity = _pop_consumed_capacity(kwargs)
 
         if len(kwargs) != 0:
             raise AssertionError(f"Unrecognized properties: {','.join(kwargs.keys())}")
@@ -463,26 +552,37 @@ class MockDynamoDbClient:
             c()
 
         v = self.__get_table(table_name).get(key)
+        record = _add_consumed_capacity({}, table_name, 1.0 if consistent else 0.5) if return_capacity else {}
         if v is None:
-            return {}
+            return record
         if attributes is not None and len(attributes) > 0:
             result_item = dict(key)
             for key in attributes.split(','):
                 key = key.strip()
                 result_item[key] = v[key]
             v = result_item
-        return {"Item": deepcopy(v)}
+        record["Item"] = deepcopy(v)
+        return record
 
     @synchronized
     def batch_write_item(self, **kwargs):
         items: Dict[str, List[Dict[str, Any]]] = kwargs.pop('RequestItems')
-        if len(items) > 25:
+        if sum(map(len, items.values())) > 25:
             raise AssertionError("too many items")
+        return_capacity = _pop_consumed_capacity(kwargs)
         assert_empty(kwargs)
-        unprocessed = []
+        self.batch_write_count += 1
+        unprocessed = {}
+        processed = 0
+        units_by_table: Dict[str, float] = {}
 
         for table_name, requests in items.items():
             for request in requests:
+                if self.max_batch_processed is not None and processed == self.max_batch_processed:
+                    get_or_create(unprocessed, table_name, list).append(deepcopy(request))
+                    continue
+                processed += 1
+                units_by_table[table_name] = units_by_table.get(table_name, 0.0) + 1.0
                 for action, item_request in request.items():
                     if len(item_request) != 1:
                         raise AssertionError(f"Too many entries in {item_request}")
@@ -495,17 +595,24 @@ class MockDynamoDbClient:
                     else:
                         raise AwsInvalidParameterResponseException("BatchWriteItems", f"Invalid action: {action}")
 
-        return {'UnprocessedItems': unprocessed}
+        record = {'UnprocessedItems': unprocessed}
+        if return_capacity:
+            _add_consumed_capacities(record, units_by_table)
+        return record
 
     @synchronized
     def batch_get_item(self, **kwargs):
         kwargs = dict(kwargs)
         items: Dict[str, Dict[str, Any]] = kwargs.pop('RequestItems')
-        if len(items) > 100:
+        if sum(map(lambda r: len(r['Keys']), items.values())) > 100:
             raise AssertionError("too many items")
+        return_capacity = _pop_consumed_capacity(kwargs)
         assert_empty(kwargs)
+        self.batch_get_count += 1
         unprocessed = {}
         results: Dict[str, List[DynamoDbItem]] = {}
+        processed = 0
+        units_by_table: Dict[str, float] = {}
         for table_name, request in items.items():
             params = {
                 'TableName': table_name,
@@ -514,6 +621,13 @@ class MockDynamoDbClient:
             set_if_not_none(params, 'ProjectionExpression', request.get('ProjectionExpression'))
 
             for key in request['Keys']:
+                if self.max_batch_processed is not None and processed == self.max_batch_processed:
+                    unprocessed_request = get_or_create(unprocessed, table_name, lambda: dict(request, Keys=[]))
+                    unprocessed_request['Keys'].append(key)
+                    continue
+                processed += 1
+                units_by_table[table_name] = units_by_table.get(table_name, 0.0) + \
+                    (1.0 if params['ConsistentRead'] else 0.5)
                 params['Key'] = key
                 try:
                     result = self.get_item(**params)
@@ -528,14 +642,18 @@ class MockDynamoDbClient:
         for table_name, result_list in results.items():
             if len(result_list) > 1:
                 random.shuffle(result_list)
-        return {
+        record = {
             'Responses': results,
             'UnprocessedKeys': unprocessed
         }
+        if return_capacity:
+            _add_consumed_capacities(record, units_by_table)
+        return record
 
     @synchronized
     def transact_write_items(self, **kwargs):
         items: List[Dict[str, Any]] = kwargs.pop('TransactItems')
+        return_capacity = _pop_consumed_capacity(kwargs)
         if len(items) == 0:
             return None
         if len(items) > 100:
@@ -560,6 +678,8 @@ class MockDynamoDbClient:
                             self.delete_item(**content)
                         elif action == 'Update':
                             self.update_item(**content)
+                        elif action == 'ConditionCheck':
+                            self.__condition_check(**content)
                         else:
                             raise_invalid_parameter("TransactWriteItems", f"Unsupported action {action} "
                                                                           f"in {item}")
@@ -577,24 +697,77 @@ class MockDynamoDbClient:
         finally:
             if not ok:
                 self.tables = save_tables
+        record = {}
+        if return_capacity:
+            # Transactional writes cost twice as much
+            units_by_table: Dict[str, float] = {}
+            for item in items:
+                table_name = next(iter(item.values()))['TableName']
+                units_by_table[table_name] = units_by_table.get(table_name, 0.0) + 2.0
+            _add_consumed_capacities(record, units_by_table)
+        return record
 
     @synchronized
     def scan(self, **kwargs):
+        kwargs = kwargs.copy()
         table_name = kwargs.pop('TableName')
-        select = kwargs.pop('Select')
-        assert select == "ALL_ATTRIBUTES"
+        select = kwargs.pop('Select', None)
+        projection = kwargs.pop('ProjectionExpression', None)
+        if projection is None:
+            assert select == "ALL_ATTRIBUTES"
+        segment: Optional[int] = kwargs.pop('Segment', None)
+        total_segments: Optional[int] = kwargs.pop('TotalSegments', None)
+        limit: Optional[int] = kwargs.pop("Limit", None)
+        exclusive_start_key: Optional[str] = kwargs.pop("ExclusiveStartKey", None)
+        filter_expression = kwargs.pop('FilterExpression', None)
+        exp_attributes: Dict[str, Any] = dict(kwargs.pop('ExpressionAttributeValues', {}))
+        expr_attribute_names: Dict[str, str] = kwargs.pop('ExpressionAttributeNames', None)
+        return_capacity = _pop_consumed_capacity(kwargs)
+        assert_empty(kwargs)
+        assert (segment is None) == (total_segments is None)
+
         t = self.__get_table(table_name)
-        cloned = list(map(lambda row: row.copy(), t.rows.values()))
-        return {
-            'Items': cloned
-        }
+        keys = sorted(t.rows.keys())
+        if total_segments is not None:
+            assert 0 <= segment < total_segments
+            keys = list(filter(lambda k: zlib.crc32(k.encode('utf-8')) % total_segments == segment, keys))
+
+        if exclusive_start_key is not None:
+            if exclusive_start_key not in keys:
+                raise AssertionError(f"Could not find last exclusive start key: {exclusive_start_key}")
+            keys = keys[keys.index(exclusive_start_key)::]
+
+        record = {}
+        if limit is not None and len(keys) > limit:
+            record['LastEvaluatedKey'] = keys[limit]
+            keys = keys[0:limit:]
+
+        results = list(map(lambda k: t.rows[k], keys))
+        record['ScannedCount'] = len(results)
+        filter_conditions = _parse_conditions(filter_expression)
+        if filter_conditions is not None:
+            if expr_attribute_names is not None:
+                exp_attributes.update(expr_attribute_names)
+            results = filter_conditions.filter_list(results, exp_attributes)
+
+        if projection is not None:
+            names = list(map(lambda n: n.strip(), projection.split(',')))
+            results = list(map(lambda row: {n: row[n] for n in names if n in row}, results))
+
+        record['Count'] = len(results)
+        record['Items'] = deepcopy(results)
+        if return_capacity:
+            _add_consumed_capacity(record, table_name, max(record['ScannedCount'], 1) * 0.5)
+        return record
 
     @synchronized
     def query(self, **kwargs):
         kwargs = kwargs.copy()
         table_name = kwargs.pop('TableName')
-        select = kwargs.pop('Select')
-        assert select in ('ALL_ATTRIBUTES', 'COUNT')
+        select = kwargs.pop('Select', None)
+        projection = kwargs.pop('ProjectionExpression', None)
+        if projection is None:
+            assert select in ('ALL_ATTRIBUTES', 'COUNT')
 
         key_condition_exp = kwargs.pop('KeyConditionExpression')
         exp_attributes: Dict[str, Any] = kwargs.pop('ExpressionAttributeValues').copy()
@@ -606,6 +779,7 @@ class MockDynamoDbClient:
 
         filter_expression = kwargs.pop('FilterExpression', None)
         expr_attribute_names: Dict[str, str] = kwargs.pop('ExpressionAttributeNames', None)
+        return_capacity = _pop_consumed_capacity(kwargs)
 
         assert_empty(kwargs)
 
@@ -651,8 +825,14 @@ class MockDynamoDbClient:
             results = filter_conditions.filter_list(results, exp_attributes)
 
         record['Count'] = len(results)
-        if select != 'COUNT':
+        if projection is not None:
+            names = list(map(lambda n: n.strip(), projection.split(',')))
+            record['Items'] = list(map(lambda row: {n: row[n] for n in names if n in row}, results))
+        elif select != 'COUNT':
             cloned = list(map(lambda row: row.copy(), results))
             record['Items'] = cloned
 
+        if return_capacity:
+            units = max(record['ScannedCount'], 1) * (1.0 if consistent_read else 0.5)
+            _add_consumed_capacity(record, table_name, units)
         return record
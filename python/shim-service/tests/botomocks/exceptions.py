@@ -99,3 +99,11 @@ class AwsTransactionCanceledException(AwsExceptionResponseException):
             error_message=f"Transaction cancelled, please refer cancellation reasons for specific reasons {reason_text}"
         )
         self.response['CancellationReasons'] = reasons
+
+
+class AwsThrottlingException(AwsExceptionResponseException):
+    def __init__(self, operation_name: str, error_code: str = "ThrottlingException"):
+        super(AwsThrottlingException, self).__init__(operation_name=operation_name,
+                                                     status_code=400,
+                                                     error_code=error_code,
+                                                     error_message="Rate of requests exceeds the allowed throughput.")
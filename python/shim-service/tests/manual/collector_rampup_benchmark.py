@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from threading import Lock
+from typing import Any, List
+
+from aws.dynamodb import DynamoDb
+from aws.dynamodb_accounting import DynamoDbAccounting
+from base_test import setup_ddb
+from botomocks.dynamodb_engine import LocalDynamoDbEngine, lognormal_latency
+from pending_event import PendingEvent, PendingEventType
+from poll.base_processor import BasePollingProcessor
+from poll.polling_group import AbstractProcessorGroup, LockAndEvent
+from repos import QueryResult
+from repos.aws.aws_pending_events_repo import AwsPendingEventsRepo
+from repos.aws.aws_resource_lock import AwsResourceLockRepo
+
+SESSIONS = 400
+SESSIONS_PER_POLLER = 20
+
+# Pollers are invoked this often during the burst
+ARRIVAL_SECONDS = .1
+
+MAX_SECONDS = 60
+
+
+class Counters:
+    def __init__(self):
+        self.mutex = Lock()
+        self.admitted = 0
+        self.conflicts = 0
+        self.invocations = 0
+        self.all_admitted = threading.Event()
+        self.done = threading.Event()
+
+    def add(self, name: str, count: int):
+        with self.mutex:
+            setattr(self, name, getattr(self, name) + count)
+            if self.admitted == SESSIONS:
+                self.all_admitted.set()
+
+
+class BenchGroup(AbstractProcessorGroup):
+    """
+    Polls by waiting for the benchmark to end, so the sessions stay admitted.
+    """
+
+    def __init__(self, processor: 'BenchProcessor'):
+        super().__init__(processor.resource_lock_repo, 60, SESSIONS_PER_POLLER, 10)
+        self.repo = processor.repo
+        self.counters = processor.counters
+
+    def invoke_lambda(self):
+        pass
+
+    def form_lock_name(self, event: PendingEvent):
+        return f"bench/{event.session_id}"
+
+    def update_action_time(self, event: PendingEvent, seconds_in_future: int) -> bool:
+        return self.repo.update_action_time(event, seconds_in_future)
+
+    def update_action_times(self, events: List[PendingEvent], seconds_in_future: int) -> List[PendingEvent]:
+        conflicts = self.repo.update_action_times(events, seconds_in_future)
+        if seconds_in_future > 0:
+            self.counters.add('conflicts', len(conflicts))
+        return conflicts
+
+    def should_poll(self, le: LockAndEvent) -> bool:
+        self.counters.add('admitted', 1)
+        return True
+
+    def poll(self, le: LockAndEvent):
+        self.counters.done.wait(MAX_SECONDS)
+        le.update_action_time = False
+
+    def query_events(self, limit: int, next_token: Any) -> QueryResult:
+        return self.repo.query_events(PendingEventType.LIVE_AGENT_POLL, limit, next_token)
+
+
+class BenchProcessor(BasePollingProcessor):
+    def __init__(self, ddb: DynamoDb, repo: AwsPendingEventsRepo, counters: Counters, concurrent: bool):
+        super().__init__(AwsResourceLockRepo(ddb), 10, concurrent_collect=concurrent)
+        self.repo = repo
+        self.counters = counters
+
+    @classmethod
+    def lock_name(cls) -> str:
+        return "bench-collect"
+
+    def create_group(self) -> AbstractProcessorGroup:
+        return BenchGroup(self)
+
+
+def _run(concurrent: bool, shards: int):
+    engine = LocalDynamoDbEngine(latency=lognormal_latency(4, 0.6), seed=1)
+    setup_ddb(engine)
+    ddb = DynamoDb(engine, accounting=DynamoDbAccounting())
+    repo = AwsPendingEventsRepo(ddb, shard_count=shards)
+    start = int(time.time() * 1000) - 1000
+    for i in range(SESSIONS):
+        session_id = f"session-{i:04d}"
+        assert repo.create(PendingEvent(PendingEventType.LIVE_AGENT_POLL, 1, session_id, 'user-id',
+                                        event_time=start + i, shard=repo.shard_of(1, session_id)))
+
+    counters = Counters()
+    processor = BenchProcessor(ddb, repo, counters, concurrent)
+    ddb.accounting.reset()
+    pollers: List[threading.Thread] = []
+    start_time = time.time()
+    while not counters.all_admitted.is_set() and time.time() - start_time < MAX_SECONDS:
+        counters.add('invocations', 1)
+        t = threading.Thread(target=processor.invoke, args=({},))
+        t.start()
+        pollers.append(t)
+        counters.all_admitted.wait(ARRIVAL_SECONDS)
+    elapsed = time.time() - start_time
+    calls = ddb.accounting.summarize()['calls']
+
+    counters.done.set()
+    for t in pollers:
+        t.join()
+
+    name = "concurrent" if concurrent else "locked"
+    print(f"{name:<12} shards={shards:<3} {counters.admitted:4d} sessions in {elapsed:7.3f} seconds, "
+          f"invocations={counters.invocations:<4d} conflicts={counters.conflicts:<4d} "
+          f"calls/session={calls / max(1, counters.admitted):5.2f}")
+
+
+def main():
+    # The info logs are per call
+    logging.disable(logging.INFO)
+    _run(False, 1)
+    for shards in (1, 8):
+        _run(True, shards)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import timeit
+from typing import Callable, Dict, Any
+
+from aws.dynamodb import _to_attribute_value_map, build_map, _to_ddb_item, from_ddb_item
+from platform_channels import OMNI_PLATFORM
+from push_notification import SessionPushNotification
+from repos.aws.aws_session_push_notifications import LocalRecord
+from session import Session, SessionContext, ContextType
+
+ITERATIONS = 100000
+
+
+def _measure(name: str, label: str, function: Callable[[], Any]):
+    elapsed = timeit.timeit(function, number=ITERATIONS)
+    print(f"{name:<20} {label:<16} {ITERATIONS / elapsed:>12,.0f} ops/sec")
+
+
+def _benchmark(name: str, record: Dict[str, Any]):
+    item = _to_ddb_item(record)
+    assert item == _to_attribute_value_map(record)
+    assert from_ddb_item(item) == build_map(item) == record
+    _measure(name, "encode/generic", lambda: _to_attribute_value_map(record))
+    _measure(name, "encode/compiled", lambda: _to_ddb_item(record))
+    _measure(name, "decode/generic", lambda: build_map(item))
+    _measure(name, "decode/compiled", lambda: from_ddb_item(item))
+
+
+def main():
+    session = Session('org-id', 1000, 'session-id', 1, 'user-id', 'https://somewhere.com', 'access-token',
+                      'fcm-device-token', 3600, [OMNI_PLATFORM.name], expiration_time=2000)
+    _benchmark("Session", session.to_record())
+
+    context = SessionContext(1000, 'session-id', 'user-id', ContextType.LIVE_AGENT, b'x' * 512, 1)
+    _benchmark("SessionContext", context.to_record())
+
+    notification = SessionPushNotification(1000, 'session-id', 1, OMNI_PLATFORM.name, 'Message',
+                                           'Some message', 1)
+    _benchmark("PushNotification", LocalRecord.from_entry(notification).to_record())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import json
+import time
+from typing import Callable
+
+from aws.dynamodb import DynamoDb
+from aws.dynamodb_accounting import DynamoDbAccounting
+from base_test import setup_ddb
+from botomocks.dynamodb_engine import LocalDynamoDbEngine, lognormal_latency, CapacitySettings
+from utils.threading_utils import map_in_parallel
+
+TABLE = "ShimServiceSession"
+TENANTS = 20
+SESSIONS_PER_TENANT = 50
+
+
+def _run(name: str, ddb: DynamoDb, threads: int, function: Callable[[int], None]):
+    start = time.time()
+    map_in_parallel(list(range(TENANTS)), threads, function)
+    elapsed = time.time() - start
+    print(f"{name:<24} threads={threads:<3} {elapsed:8.3f} seconds")
+    print(json.dumps(ddb.accounting.summarize(), indent=True))
+
+
+def main():
+    engine = LocalDynamoDbEngine(latency=lognormal_latency(4, 0.6), seed=1)
+    setup_ddb(engine)
+    # A hot tenant will hit the per-partition limit before the table limit
+    engine.set_capacity(TABLE, CapacitySettings(read_units_per_second=4000, write_units_per_second=1000,
+                                                partition_count=4, burst_seconds=1))
+    ddb = DynamoDb(engine, accounting=DynamoDbAccounting())
+
+    def write_tenant(tenant_id: int):
+        for i in range(SESSIONS_PER_TENANT):
+            ddb.put_item(TABLE, {'tenantId': tenant_id, 'sessionId': f"session-{i}", 'userId': f"user-{i}"})
+
+    def read_tenant(tenant_id: int):
+        for i in range(SESSIONS_PER_TENANT):
+            ddb.get_item(TABLE, {'tenantId': tenant_id, 'sessionId': f"session-{i}"})
+        list(ddb.query(TABLE, 'tenantId', tenant_id))
+
+    for threads in (1, 4, 16):
+        _run("write", ddb, threads, write_tenant)
+        _run("read", ddb, threads, read_tenant)
+    print(json.dumps(engine.describe(), indent=True))
+
+
+if __name__ == '__main__':
+    main()
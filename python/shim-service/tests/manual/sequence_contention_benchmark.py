@@ -0,0 +1,109 @@
+import random
+import time
+from threading import Lock
+from typing import Callable, List
+
+from aws.dynamodb import DynamoDb, PreconditionFailedException, PutItemRequest
+from aws.dynamodb_accounting import DynamoDbAccounting
+from base_test import setup_ddb
+from botomocks.dynamodb_engine import LocalDynamoDbEngine, lognormal_latency
+from events.event_types import EventType
+from repos.aws import SHIM_SERVICE_EVENT_TABLE, SHIM_SERVICE_VIRTUAL_TABLE
+from repos.aws.aws_events import AwsEventsRepo
+from repos.aws.aws_sequence import AwsSequenceRepo, EVENT_SEQUENCE
+from utils.threading_utils import map_in_parallel
+
+TENANT_ID = 1
+EVENTS_PER_WRITER = 20
+CONTAINERS = 4
+
+
+class LeaseAllocator:
+    """
+    The scheme AwsSequenceRepo used before: a consistent read, a conditional patch to take the lease, the
+    transaction, then a patch to release the lease. Waits are retried with backoff.
+    """
+
+    def __init__(self, ddb: DynamoDb):
+        self.ddb = ddb
+        self.key = {'hashKey': f"a\t{TENANT_ID}\t{EVENT_SEQUENCE}"}
+        self.retries = 0
+        self.mutex = Lock()
+        ddb.put_item(SHIM_SERVICE_VIRTUAL_TABLE, dict(self.key, nextValue=1, timeoutAt=0))
+
+    def __acquire(self) -> int:
+        delay = .005
+        while True:
+            row = self.ddb.get_item(SHIM_SERVICE_VIRTUAL_TABLE, self.key, consistent=True)
+            if row['timeoutAt'] == 0:
+                try:
+                    self.ddb.update_item(SHIM_SERVICE_VIRTUAL_TABLE, self.key,
+                                         {'timeoutAt': int(time.time()) + 30, 'nextValue': row['nextValue'] + 1},
+                                         condition={'timeoutAt': 0})
+                    return row['nextValue']
+                except PreconditionFailedException:
+                    pass
+            with self.mutex:
+                self.retries += 1
+            time.sleep(delay * random.uniform(.1, .9))
+            delay = min(delay * 2, .5)
+
+    def write_event(self):
+        seq_no = self.__acquire()
+        try:
+            self.ddb.transact_write([_event_request(seq_no)])
+        finally:
+            self.ddb.update_item(SHIM_SERVICE_VIRTUAL_TABLE, self.key, {'timeoutAt': 0})
+
+
+def _event_request(seq_no: int) -> PutItemRequest:
+    return PutItemRequest(SHIM_SERVICE_EVENT_TABLE, {'tenantId': TENANT_ID, 'seqNo': seq_no,
+                                                     'eventType': EventType.SESSION_CREATED.value},
+                          key_attributes=['seqNo'])
+
+
+def _create_ddb() -> DynamoDb:
+    engine = LocalDynamoDbEngine(latency=lognormal_latency(4, 0.6), seed=1)
+    setup_ddb(engine)
+    return DynamoDb(engine, accounting=DynamoDbAccounting())
+
+
+def _run(name: str, ddb: DynamoDb, writers: int, write_event: Callable[[int], None]):
+    def writer(index: int):
+        for _ in range(EVENTS_PER_WRITER):
+            write_event(index)
+
+    start = time.time()
+    map_in_parallel(list(range(writers)), writers, writer)
+    elapsed = time.time() - start
+    count = writers * EVENTS_PER_WRITER
+    summary = ddb.accounting.summarize()
+    print(f"{name:<12} writers={writers:<3} {elapsed:8.3f} seconds, {count / elapsed:8.1f} events/second, "
+          f"{summary['calls'] / count:5.2f} calls/event")
+    seq_nos = [row['seqNo'] for row in ddb.query(SHIM_SERVICE_EVENT_TABLE, 'tenantId', TENANT_ID)]
+    assert len(seq_nos) == count, f"Expected {count} events, got {len(seq_nos)}"
+
+
+def main():
+    for writers in (1, 8, 32):
+        ddb = _create_ddb()
+        lease = LeaseAllocator(ddb)
+        ddb.accounting.reset()
+        _run("lease", ddb, writers, lambda index: lease.write_event())
+        print(f"{'':<12} lease retries={lease.retries}")
+
+        for block_size in (1, 20):
+            ddb = _create_ddb()
+            events_repo = AwsEventsRepo(ddb, None)
+            # Writers are spread over a few containers, each with its own blocks
+            containers: List[AwsSequenceRepo] = [AwsSequenceRepo(ddb, events_repo, block_size)
+                                                 for _ in range(CONTAINERS)]
+
+            def write_event(index: int):
+                containers[index % CONTAINERS].execute_with_event(TENANT_ID, [], EventType.SESSION_CREATED)
+
+            _run("add" if block_size == 1 else f"block({block_size})", ddb, writers, write_event)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,12 @@ from typing import List, Callable, Any
 
 from aws.dynamodb import DynamoDb
 from repos.aws.aws_events import AwsEventsRepo
+from repos.aws.aws_platform_sessions import AwsPlatformSessionsRepo
 from repos.aws.aws_sequence import AwsSequenceRepo
 from repos.aws.aws_sessions import AwsSessionsRepo
 from repos.aws.aws_sfdc_sessions_repo import AwsSfdcSessionsRepo
 from repos.aws.aws_user_sessions import AwsUserSessionsRepo
+from repos.aws.read_consistency import ConsistencyPolicy
 from session import Session
 
 Hook = Callable[[Session], Any]
@@ -18,13 +20,17 @@ class MockAwsSessionsRepo(AwsSessionsRepo):
                  user_sessions_repo: AwsUserSessionsRepo,
                  events_repo: AwsEventsRepo,
                  sequence_repo: AwsSequenceRepo,
-                 sfdc_sessions_repo: AwsSfdcSessionsRepo):
+                 sfdc_sessions_repo: AwsSfdcSessionsRepo,
+                 platform_sessions_repo: AwsPlatformSessionsRepo,
+                 consistency_policy: ConsistencyPolicy):
         super(MockAwsSessionsRepo, self).__init__(
             dynamodb,
             user_sessions_repo,
             events_repo,
             sequence_repo,
-            sfdc_sessions_repo
+            sfdc_sessions_repo,
+            platform_sessions_repo,
+            consistency_policy
         )
         self.update_hooks: List[Hook] = []
         self.touch_hooks: List[Hook] = []
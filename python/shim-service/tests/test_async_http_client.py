@@ -0,0 +1,65 @@
+import asyncio
+from typing import List
+
+from better_test_case import BetterTestCase
+from utils.async_http_client import create_async_client
+from utils.http_client import HttpRequest, HttpResponse, HttpMethod
+
+
+class AsyncHttpClientTests(BetterTestCase):
+    requests_seen: List[bytes]
+
+    def test_content_length(self):
+        resp = self.exchange(b"HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=utf-8\r\n"
+                             b"Content-Length: 11\r\n\r\n{\"a\": \"b\"}\n",
+                             HttpRequest(HttpMethod.POST, "/path?x=1", headers={'X-Test': 'yes'}, body="hello"))
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('{"a": "b"}\n', resp.body)
+        self.assertEqual('application/json; charset=utf-8', resp.headers['content-type'])
+
+        request = self.requests_seen[0].decode('latin-1')
+        self.assertTrue(request.startswith("POST /path?x=1 HTTP/1.1\r\n"))
+        self.assertIn("X-Test: yes\r\n", request)
+        self.assertTrue(request.endswith("Content-Length: 5\r\n\r\nhello"))
+
+    def test_chunked(self):
+        resp = self.exchange(b"HTTP/1.1 204 No Content\r\n\r\n")
+        self.assertEqual(204, resp.status_code)
+        self.assertEqual('', resp.body)
+
+        resp = self.exchange(b"HTTP/1.1 503 Unavailable\r\nTransfer-Encoding: chunked\r\n\r\n"
+                             b"5\r\nHello\r\n7;ext=1\r\n, there\r\n0\r\n\r\n")
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual('Hello, there', resp.body)
+
+    def test_timeout(self):
+        self.assertRaises(asyncio.TimeoutError,
+                          lambda: self.exchange(None, HttpRequest(HttpMethod.GET, "/", timeout_seconds=0.1)))
+
+    def exchange(self, response: bytes, req: HttpRequest = None) -> HttpResponse:
+        return asyncio.run(self.__exchange(response, req or HttpRequest(HttpMethod.GET, "/")))
+
+    async def __exchange(self, response: bytes, req: HttpRequest) -> HttpResponse:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            data = await reader.readuntil(b"\r\n\r\n")
+            length = next((int(line.split(b":")[1]) for line in data.split(b"\r\n")
+                           if line.lower().startswith(b"content-length:")), 0)
+            self.requests_seen.append(data + await reader.readexactly(length))
+            if response is None:
+                # Never answer, just wait for the client to give up
+                await reader.read()
+            else:
+                writer.write(response)
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        try:
+            port = server.sockets[0].getsockname()[1]
+            req.url = f"http://127.0.0.1:{port}{req.url}"
+            return await create_async_client().exchange(req)
+        finally:
+            server.close()
+
+    def setUp(self):
+        self.requests_seen = []
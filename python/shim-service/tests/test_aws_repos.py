@@ -1,11 +1,21 @@
+import threading
+from copy import copy
+
 from aws.dynamodb import DynamoDb
 from better_test_case import BetterTestCase
 from botomocks.dynamodb_mock import MockDynamoDbClient
+from botomocks.exceptions import AwsTransactionCanceledException
 from events import Event
 from events.event_types import EventType
+from pending_event import PendingEvent, PendingEventType
 from repos.aws.aws_events import AwsEventsRepo
+from repos.aws.aws_pending_events_repo import AwsPendingEventsRepo
+from repos.aws.aws_sequence import AwsSequenceRepo
+from repos.aws.aws_sfdc_sessions_repo import AwsSfdcSessionsRepo
 from repos.aws.aws_user_sessions import AwsUserSessionsRepo
-from session import UserSession
+from session import UserSession, SessionKey
+from utils.byte_utils import decompress
+from utils.date_utils import get_system_time_in_millis
 
 
 class RepoTest(BetterTestCase):
@@ -26,6 +36,212 @@ class RepoTest(BetterTestCase):
         found = repo.find(user_session.tenant_id, user_session.user_id)
         self.assertEqual(user_session, found)
 
+    def test_batch_get(self):
+        repo = AwsUserSessionsRepo(self.ddb)
+        for i in range(150):
+            self.assertTrue(repo.create(UserSession(199, f"user-{i:03d}", 'session-id', 'device-token', 999999)))
+
+        # Request in reverse order, with keys that do not exist mixed in
+        requests = []
+        for i in reversed(range(160)):
+            requests.append(repo.create_get_item_request_from_args(199, f"user-{i:03d}"))
+        result = repo.batch_get(requests)
+        self.assertEqual(150, result.row_count)
+        for index in range(10):
+            self.assertFalse(result.has_entry(index))
+        for index in range(10, 160):
+            session: UserSession = result.get_entry_at(index)
+            self.assertEqual(f"user-{159 - index:03d}", session.user_id)
+
+        request = requests[20]
+        self.assertEqual("user-139", result.get_entry(request.table_name, request.keys).user_id)
+        self.assertIsNone(result.get_entry(requests[0].table_name, requests[0].keys))
+
+    def test_virtual_projection(self):
+        repo = AwsSfdcSessionsRepo(self.ddb, None, None)
+        request = repo.create_put_request(SessionKey.key_of(1, 'session-id'), b'data', 1000)
+        self.ddb.put_item(repo.table_name, request.item)
+
+        request = repo.create_get_item_request_from_args(1, 'session-id',
+                                                         attributes_to_get=['sessionId', 'tableType', 'sessionData'])
+        self.assertEqual(['hashKey', 'rangeKey', 'sessionData'], request.attributes_to_get)
+        # Loaded with a request for the whole item in the same physical table, as for the session context
+        other = repo.create_put_request(SessionKey.key_of(1, 'other-id'), b'other', 1000)
+        self.ddb.put_item(repo.table_name, other.item)
+        request_items_seen = []
+        batch_get_item = self.ddb_mock.batch_get_item
+
+        def capture(**kwargs):
+            request_items_seen.append(kwargs['RequestItems'])
+            return batch_get_item(**kwargs)
+
+        self.ddb_mock.batch_get_item = capture
+        result = repo.batch_get([request, repo.create_get_item_request_from_args(1, 'other-id')])
+        row = result.get_entry_at(0)
+        row['sessionData'] = decompress(row['sessionData'])
+        self.assertEqual({'tenantId': 1, 'sessionId': 'session-id', 'tableType': repo.virtual_table.table_type,
+                          'sessionData': b'data'}, row)
+        self.assertEqual(1000, result.get_entry_at(1).expire_time)
+
+        projections = sorted(str(items[repo.table_name].get('ProjectionExpression'))
+                             for items in request_items_seen)
+        self.assertEqual(['None', 'hashKey,rangeKey,sessionData'], projections)
+
+    def test_update_action_times(self):
+        repo = AwsPendingEventsRepo(self.ddb)
+        events = []
+        for i in range(120):
+            event = PendingEvent(PendingEventType.LIVE_AGENT_POLL, 1, f"session-{i:03d}", 'user-id')
+            self.assertTrue(repo.create(event))
+            events.append(event)
+
+        # Move a couple of them out from under the bulk update
+        self.assertTrue(repo.update_action_time(copy(events[10]), 60))
+        self.assertTrue(repo.delete_event(events[75]))
+
+        conflicts = repo.update_action_times(events, 30)
+        self.assertEqual([events[10], events[75]], conflicts)
+        result = repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertEmpty(result.rows)
+
+        conflicts = repo.update_action_times(events[20:30], 0)
+        self.assertEmpty(conflicts)
+        result = repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertEqual(list(map(lambda e: e.session_id, events[20:30])),
+                         list(map(lambda e: e.session_id, result.rows)))
+
+    def test_update_action_times_transaction_conflict(self):
+        repo = AwsPendingEventsRepo(self.ddb)
+        events = []
+        for i in range(5):
+            event = PendingEvent(PendingEventType.LIVE_AGENT_POLL, 1, f"session-{i:03d}", 'user-id')
+            self.assertTrue(repo.create(event))
+            events.append(event)
+        self.assertTrue(repo.delete_event(events[4]))
+
+        # The first attempt collides with another transaction on the third event
+        transact_write_items = self.ddb_mock.transact_write_items
+        calls = []
+
+        def collide(**kwargs):
+            calls.append(len(kwargs['TransactItems']))
+            if len(calls) == 1:
+                reasons = [{'Code': 'None'}] * len(kwargs['TransactItems'])
+                reasons[4] = {'Code': 'TransactionConflict'}
+                reasons[8] = {'Code': 'ConditionalCheckFailed'}
+                raise AwsTransactionCanceledException(reasons)
+            return transact_write_items(**kwargs)
+
+        self.ddb_mock.transact_write_items = collide
+        conflicts = repo.update_action_times(events, 30)
+        self.assertEqual([events[4]], conflicts)
+        self.assertEqual([10, 8], calls)
+        self.assertEmpty(repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None).rows)
+
+    def test_sharded_events(self):
+        legacy_repo = AwsPendingEventsRepo(self.ddb)
+        repo = AwsPendingEventsRepo(self.ddb, shard_count=4)
+        now = get_system_time_in_millis()
+        events = []
+        for i in range(40):
+            session_id = f"session-{i:03d}"
+            event = PendingEvent(PendingEventType.LIVE_AGENT_POLL, 1, session_id, 'user-id',
+                                 event_time=now - 1000 + i, shard=repo.shard_of(1, session_id))
+            self.assertTrue(repo.create(event))
+            events.append(event)
+        self.assertEqual({0, 1, 2, 3}, {e.shard for e in events})
+
+        # Events from before the queue was sharded are in shard 0
+        legacy = PendingEvent(PendingEventType.LIVE_AGENT_POLL, 1, 'legacy', 'user-id', event_time=now - 2000)
+        self.assertTrue(legacy_repo.create(legacy))
+        events.insert(0, legacy)
+
+        # The shards are merged by action time
+        result = repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertIsNone(result.next_token)
+        self.assertEqual(list(map(lambda e: e.session_id, events)), list(map(lambda e: e.session_id, result.rows)))
+        self.assertEqual(list(map(lambda e: e.shard, events)), list(map(lambda e: e.shard, result.rows)))
+
+        result = legacy_repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertEqual([e.session_id for e in events if e.shard == 0], [e.session_id for e in result.rows])
+
+        # Page through the shards
+        seen = []
+        next_token = None
+        while True:
+            result = repo.query_events(PendingEventType.LIVE_AGENT_POLL, 8, next_token)
+            self.assertLessEqual(len(result.rows), 8)
+            seen.extend(map(lambda e: e.session_id, result.rows))
+            next_token = result.next_token
+            if next_token is None:
+                break
+        self.assertEqual(sorted(map(lambda e: e.session_id, events)), sorted(seen))
+
+        # Moving the legacy event puts it in its shard
+        legacy = copy(legacy)
+        self.assertTrue(repo.update_action_time(legacy, 0))
+        self.assertEqual(repo.shard_of(1, 'legacy'), legacy.shard)
+        self.assertEqual(1, len(list(filter(lambda e: e.session_id == 'legacy',
+                                            repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None).rows))))
+        self.assertTrue(repo.delete_event(legacy))
+        self.assertHasLength(40, repo.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None).rows)
+
+    def test_lower_shard_count(self):
+        repo = AwsPendingEventsRepo(self.ddb, shard_count=4)
+        now = get_system_time_in_millis()
+        events = []
+        for i in range(40):
+            session_id = f"session-{i:03d}"
+            event = PendingEvent(PendingEventType.LIVE_AGENT_POLL, 1, session_id, 'user-id',
+                                 event_time=now - 1000 + i, shard=repo.shard_of(1, session_id))
+            self.assertTrue(repo.create(event))
+            events.append(event)
+        session_ids = list(map(lambda e: e.session_id, events))
+
+        # Only the shards for the new count are queried, unless told otherwise
+        lowered = AwsPendingEventsRepo(self.ddb, shard_count=2)
+        result = lowered.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertEqual([e.session_id for e in events if e.shard < 2], [e.session_id for e in result.rows])
+
+        lowered = AwsPendingEventsRepo(self.ddb, shard_count=2, max_shard_count=4)
+        result = lowered.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertEqual(session_ids, list(map(lambda e: e.session_id, result.rows)))
+
+        # Polling the events moves them to the shards for the new count
+        self.assertEmpty(lowered.update_action_times(result.rows, 0))
+        self.assertEqual({0, 1}, {e.shard for e in result.rows})
+        lowered = AwsPendingEventsRepo(self.ddb, shard_count=2)
+        result = lowered.query_events(PendingEventType.LIVE_AGENT_POLL, 1000, None)
+        self.assertEqual(sorted(session_ids), sorted(map(lambda e: e.session_id, result.rows)))
+
+    def test_sequences(self):
+        # Two containers sharing the sequence, one without blocks and one with
+        repos = [AwsSequenceRepo(self.ddb, None), AwsSequenceRepo(self.ddb, None, block_size=10)]
+        self.assertEqual(1, repos[0].allocate(1, 'EventSeq'))
+        self.assertEqual(2, repos[1].allocate(1, 'EventSeq'))
+        self.assertEqual(3, repos[1].allocate(1, 'EventSeq', 5))
+        # Block has 4 values left, so a new one is reserved
+        self.assertEqual(12, repos[1].allocate(1, 'EventSeq', 5))
+        self.assertEqual(22, repos[0].allocate(1, 'EventSeq', 2))
+        self.assertEqual(1, repos[0].allocate(2, 'EventSeq'))
+
+        allocated = []
+        mutex = threading.Lock()
+
+        def allocate(index: int):
+            repo = repos[index % 2]
+            for _ in range(50):
+                value = repo.allocate(3, 'EventSeq')
+                with mutex:
+                    allocated.append(value)
+
+        threads = [threading.Thread(target=allocate, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(300, len(set(allocated)))
+
     def test_events(self):
         repo = AwsEventsRepo(self.ddb, None)
 
@@ -95,6 +311,7 @@ class RepoTest(BetterTestCase):
     def setUp(self):
         self.ddb_mock = ddb_mock = MockDynamoDbClient()
         ddb_mock.add_manual_table_v2("ShimServiceEvent", {'tenantId': 'N'}, {'seqNo': 'N'})
+        ddb_mock.add_manual_table_v2("ShimServiceVirtualTable", {'hashKey': 'S'})
         ddb_mock.add_manual_table_v2("ShimServiceVirtualRangeTable", {'hashKey': 'S'},
                                      {'rangeKey': 'S'})
         self.ddb = DynamoDb(ddb_mock)
@@ -0,0 +1,229 @@
+import threading
+import time
+from typing import List
+
+from aws.dynamodb import DynamoDb, eq_filter, ResourceNotFoundException, ResultSet, GetItemRequest, \
+    PutItemRequest, DeleteItemRequest, UnprocessedItemsException
+from aws.dynamodb_throttling import DynamoDbThrottler
+from base_test import setup_ddb
+from better_test_case import BetterTestCase
+from botomocks.dynamodb_mock import MockDynamoDbClient
+
+
+class TestSuite(BetterTestCase):
+    ddb_mock: MockDynamoDbClient
+    ddb: DynamoDb
+    sleeps: List[float]
+
+    def setUp(self):
+        self.sleeps = []
+        self.ddb_mock = MockDynamoDbClient()
+        setup_ddb(self.ddb_mock)
+        self.ddb = DynamoDb(self.ddb_mock, DynamoDbThrottler(sleeper=self.sleeps.append))
+
+    def __add_sessions(self, count: int):
+        for i in range(count):
+            self.ddb.put_item("ShimServiceSession", {'tenantId': i % 7, 'sessionId': f"session-{i}",
+                                                     'userId': f"user-{i % 3}"})
+
+    def test_parallel_scan(self):
+        self.__add_sessions(250)
+        expected = {row['sessionId'] for row in self.ddb.scan("ShimServiceSession")}
+        self.assertEqual(250, len(expected))
+
+        rs = self.ddb.parallel_scan("ShimServiceSession", 8, max_threads=3, max_queued_pages=2, page_size=10)
+        found = [row['sessionId'] for row in rs]
+        self.assertEqual(250, len(found))
+        self.assertEqual(expected, set(found))
+        self.assertFalse(rs.has_next())
+
+    def test_parallel_scan_with_filter_and_projection(self):
+        self.__add_sessions(100)
+        rows = list(self.ddb.parallel_scan("ShimServiceSession", 4,
+                                           select_attributes="sessionId",
+                                           filter_operations=eq_filter('userId', 'user-1')))
+        self.assertEqual(33, len(rows))
+        for row in rows:
+            self.assertEqual(['sessionId'], list(row.keys()))
+
+    def test_parallel_scan_empty(self):
+        self.assertFalse(self.ddb.parallel_scan("ShimServiceSession", 4).has_next())
+
+    def test_parallel_scan_close(self):
+        self.__add_sessions(100)
+        rs = self.ddb.parallel_scan("ShimServiceSession", 4, max_queued_pages=1, page_size=5)
+        self.assertTrue(rs.has_next())
+        rs.next()
+        rs.close()
+        scanner = getattr(rs, "_ParallelScanResultSet__scanner")
+        scanner.join(5)
+        for t in getattr(scanner, "_ParallelScanner__threads"):
+            self.assertFalse(t.is_alive())
+
+    def test_parallel_scan_error(self):
+        self.assertRaises(ResourceNotFoundException, lambda: list(self.ddb.parallel_scan("NoSuchTable", 4)))
+
+    def test_query_prefetch(self):
+        self.__add_sessions(70)
+        rs = self.ddb.query("ShimServiceSession", "tenantId", 1, prefetch=2)
+        expected = [row['sessionId'] for row in self.ddb.query("ShimServiceSession", "tenantId", 1)]
+        self.assertEqual(10, len(expected))
+        self.assertEqual(expected, [row['sessionId'] for row in rs])
+        self.assertFalse(rs.has_next())
+
+    def test_scan_prefetch_pages(self):
+        pages = [([{'a': {'N': str(i)}}], i + 1 if i < 9 else None, 1) for i in range(10)]
+        calls = []
+
+        def query_function(next_key):
+            calls.append(next_key)
+            return pages[next_key or 0]
+
+        rs = ResultSet(query_function, prefetch=3)
+        self.assertEqual(list(range(10)), [row['a'] for row in rs])
+        self.assertEqual([None] + list(range(1, 10)), calls)
+
+    def test_prefetch_error(self):
+        def query_function(next_key):
+            if next_key is None:
+                return [{'a': {'N': '1'}}], 1, 1
+            raise ResourceNotFoundException()
+
+        rs = ResultSet(query_function, prefetch=1)
+        self.assertTrue(rs.has_next())
+        rs.next()
+        self.assertRaises(ResourceNotFoundException, rs.has_next)
+
+    def test_prefetch_close(self):
+        def query_function(next_key):
+            return [{'a': {'N': str(next_key or 0)}}], (next_key or 0) + 1, 1
+
+        rs = ResultSet(query_function, prefetch=1)
+        self.assertEqual(0, rs.next()['a'])
+        reader = getattr(rs, "_ResultSet__reader")
+        rs.close()
+        reader.join(5)
+        self.assertFalse(getattr(reader, "_PageReader__thread").is_alive())
+
+    def test_batch_get_chunks(self):
+        self.__add_sessions(250)
+        requests = [GetItemRequest("ShimServiceSession", {'tenantId': i % 7, 'sessionId': f"session-{i}"})
+                    for i in range(260)]
+        self.ddb_mock.max_batch_processed = 30
+        results = self.ddb.batch_get(requests, max_threads=2)
+        rows = results["ShimServiceSession"]
+        self.assertEqual(250, len(rows))
+        self.assertEqual({f"session-{i}" for i in range(250)}, {row['sessionId'] for row in rows})
+
+        # 3 chunks, with 100, 100 and 60 keys
+        self.assertEqual(4 + 4 + 2, self.ddb_mock.batch_get_count)
+        self.assertEqual(7, len(self.sleeps))
+
+    def test_increment(self):
+        key = {'tenantId': 1, 'sessionId': 'counter'}
+        self.assertEqual(1, self.ddb.increment("ShimServiceSession", key, 'hits'))
+        self.assertEqual(11, self.ddb.increment("ShimServiceSession", key, 'hits', 10))
+        self.ddb.update_item("ShimServiceSession", key, {'userId': 'user'})
+        self.assertEqual(10, self.ddb.increment("ShimServiceSession", key, 'hits', -1))
+        self.assertEqual({'tenantId': 1, 'sessionId': 'counter', 'hits': 10, 'userId': 'user'},
+                         self.ddb.get_item("ShimServiceSession", key))
+
+    def test_batch_get_empty(self):
+        self.assertEqual({}, self.ddb.batch_get([]))
+
+    def test_batch_write(self):
+        requests = [PutItemRequest("ShimServiceSession", {'tenantId': 1, 'sessionId': f"session-{i}"})
+                    for i in range(60)]
+        self.ddb_mock.max_batch_processed = 10
+        result = self.ddb.batch_write(requests, max_threads=2)
+        self.assertTrue(result.succeeded)
+        self.assertEqual(60, len(result.outcomes))
+        self.assertEqual(3 + 3 + 1, self.ddb_mock.batch_write_count)
+        self.assertEqual(7, result.iterations)
+        self.assertEqual(60, len(list(self.ddb.query("ShimServiceSession", "tenantId", 1))))
+
+        deletes = [DeleteItemRequest("ShimServiceSession", {'tenantId': 1, 'sessionId': f"session-{i}"})
+                   for i in range(30)]
+        self.assertTrue(self.ddb.batch_write(deletes).succeeded)
+        self.assertEqual(30, len(list(self.ddb.query("ShimServiceSession", "tenantId", 1))))
+
+    def test_batch_write_unprocessed(self):
+        requests = [PutItemRequest("ShimServiceSession", {'tenantId': 1, 'sessionId': f"session-{i}"})
+                    for i in range(30)]
+        self.ddb_mock.max_batch_processed = 0
+        self.assertRaises(UnprocessedItemsException, lambda: self.ddb.batch_write(requests))
+        result = self.ddb.try_batch_write(requests)
+        self.assertFalse(result.succeeded)
+        self.assertEqual(30, len(result.failures))
+        self.assertIs(requests[0], result.failures[0].source)
+        self.assertRaises(UnprocessedItemsException, result.raise_if_failed)
+
+    def test_batch_delete(self):
+        self.__add_sessions(70)
+        submitted = []
+        errors = []
+        keys = [("ShimServiceSession", {'tenantId': i % 7, 'sessionId': f"session-{i}"}) for i in range(70)]
+        keys.append(("NoSuchTable", {'tenantId': 1, 'sessionId': 'nope'}))
+        result = self.ddb.batch_delete(keys, on_submit=submitted.append, on_error=errors.append)
+        self.assertEqual(71, sum(map(len, submitted)))
+        self.assertEqual(1, len(errors))
+        # The whole batch with the bad table fails
+        self.assertEqual(71 - 50, len(result.failures))
+        self.assertIs(errors[0], result.failures[0].error)
+        self.assertEqual(50, len(list(filter(lambda o: o.succeeded, result.outcomes))))
+
+    def test_coalesced_reads(self):
+        key = {'tenantId': 1, 'sessionId': 'abc'}
+        self.ddb.put_item("ShimServiceSession", dict(key, userId='user'))
+        flights = self.ddb.read_flights
+        release = threading.Event()
+        self.ddb_mock.set_get_callback(lambda: release.wait(5))
+
+        rows = []
+        threads = [threading.Thread(target=lambda: rows.append(self.ddb.get_item("ShimServiceSession", key)))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        while flights.hits < 3:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(4, len(rows))
+        self.assertEqual(1, flights.misses)
+        for row in rows:
+            self.assertEqual('user', row['userId'])
+        # Each caller gets its own copy
+        self.assertEqual(4, len(set(map(id, rows))))
+        # Only one request was sent
+        get_calls = [s.calls for k, s in self.ddb.accounting.get_stats().items() if k[1] == "GetItem"]
+        self.assertEqual([1], get_calls)
+
+
+    def test_consistent_reads_not_coalesced(self):
+        key = {'tenantId': 1, 'sessionId': 'abc'}
+        self.ddb.put_item("ShimServiceSession", dict(key, userId='user'))
+        flights = self.ddb.read_flights
+        release = threading.Event()
+        self.ddb_mock.set_get_callback(lambda: release.wait(0.2))
+
+        threads = [threading.Thread(target=lambda: self.ddb.get_item("ShimServiceSession", key, consistent=True))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        # Each consistent read sends its own request
+        self.assertEqual(0, flights.hits + flights.misses)
+        get_calls = [s.calls for k, s in self.ddb.accounting.get_stats().items() if k[1] == "GetItem"]
+        self.assertEqual([3], get_calls)
+
+    def test_coalesced_not_found(self):
+        self.assertIsNone(self.ddb.find_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'}))
+        ddb = DynamoDb(self.ddb_mock, coalesce_reads=False)
+        self.assertIsNone(ddb.read_flights)
+        self.assertRaises(ResourceNotFoundException,
+                          lambda: ddb.get_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'}))
@@ -0,0 +1,116 @@
+from typing import List, Dict, Any
+
+from aws import dynamodb_accounting
+from aws.dynamodb import DynamoDb, GetItemRequest, PutItemRequest, ResourceNotFoundException
+from aws.dynamodb_accounting import DynamoDbAccounting, LatencyHistogram, NO_OPERATION
+from aws.dynamodb_throttling import DynamoDbThrottler
+from base_test import setup_ddb
+from better_test_case import BetterTestCase
+from botomocks.dynamodb_mock import MockDynamoDbClient
+from botomocks.exceptions import AwsThrottlingException
+from repos.aws import resolve_virtual_table_name, SHIM_SERVICE_VIRTUAL_TABLE
+
+
+def _find(summary: Dict[str, Any], operation: str, logical_operation: str = NO_OPERATION) -> Dict[str, Any]:
+    for entry in summary['operations']:
+        if entry['operation'] == operation and entry['logicalOperation'] == logical_operation:
+            return entry
+    raise AssertionError(f"{logical_operation}/{operation} not found in {summary}")
+
+
+class TestSuite(BetterTestCase):
+    ddb_mock: MockDynamoDbClient
+    ddb: DynamoDb
+    sleeps: List[float]
+
+    def setUp(self):
+        self.sleeps = []
+        self.ddb_mock = MockDynamoDbClient()
+        setup_ddb(self.ddb_mock)
+        self.accounting = DynamoDbAccounting(resolve_virtual_table_name)
+        self.ddb = DynamoDb(self.ddb_mock, DynamoDbThrottler(sleeper=self.sleeps.append), self.accounting)
+
+    def test_capacity(self):
+        key = {'tenantId': 1, 'sessionId': 'abc'}
+        self.ddb.put_item("ShimServiceSession", key)
+        self.ddb.get_item("ShimServiceSession", key)
+        self.ddb.get_item("ShimServiceSession", key, consistent=True)
+        self.assertRaises(ResourceNotFoundException,
+                          lambda: self.ddb.get_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'xyz'}))
+
+        summary = self.accounting.summarize()
+        self.assertEqual(4, summary['calls'])
+        self.assertEqual(2.0, summary['readCapacityUnits'])
+        self.assertEqual(1.0, summary['writeCapacityUnits'])
+
+        get = _find(summary, "GetItem")
+        self.assertEqual("ShimServiceSession", get['table'])
+        self.assertEqual(3, get['calls'])
+        self.assertEqual(0, get['errors'])
+        self.assertEqual(3, get['latency']['count'])
+        self.assertNotIn('virtualTable', get)
+
+        # Summarizing resets by default
+        self.assertIsNone(self.accounting.summarize())
+
+    def test_logical_operations(self):
+        with dynamodb_accounting.operation("outer"):
+            self.ddb.put_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'})
+            with dynamodb_accounting.operation("inner"):
+                self.ddb.find_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'})
+            self.assertEqual("outer", dynamodb_accounting.current_operation())
+
+            # Batch chunks are read on other threads
+            requests = [GetItemRequest("ShimServiceSession", {'tenantId': 1, 'sessionId': f"s{i}"})
+                        for i in range(250)]
+            self.ddb.batch_get(requests, max_threads=3)
+        self.assertEqual(NO_OPERATION, dynamodb_accounting.current_operation())
+
+        summary = self.accounting.summarize()
+        self.assertEqual(1, _find(summary, "PutItem", "outer")['calls'])
+        self.assertEqual(1, _find(summary, "GetItem", "inner")['calls'])
+        batch = _find(summary, "BatchGetItem", "outer")
+        self.assertEqual(3, batch['calls'])
+        self.assertEqual(125.0, batch['readCapacityUnits'])
+
+    def test_virtual_tables(self):
+        items = [{'hashKey': f"c\tuser-{i}", 'value': i} for i in range(3)]
+        self.ddb.batch_write(map(lambda item: PutItemRequest(SHIM_SERVICE_VIRTUAL_TABLE, item), items))
+        self.ddb.put_item(SHIM_SERVICE_VIRTUAL_TABLE, {'hashKey': "d\tcontext", 'value': 1})
+        self.ddb.batch_write([PutItemRequest(SHIM_SERVICE_VIRTUAL_TABLE, {'hashKey': "c\tuser"}),
+                              PutItemRequest(SHIM_SERVICE_VIRTUAL_TABLE, {'hashKey': "d\tother"})])
+
+        summary = self.accounting.summarize()
+        self.assertEqual("UserSession", _find(summary, "BatchWriteItem")['virtualTable'])
+        self.assertEqual("SessionContext", _find(summary, "PutItem")['virtualTable'])
+        # Mixed virtual tables cannot be attributed to one
+        batches = [e for e in summary['operations'] if e['operation'] == "BatchWriteItem"]
+        self.assertEqual(2, len(batches))
+        self.assertEqual(6.0, summary['writeCapacityUnits'])
+
+    def test_throttles(self):
+        count = 2
+
+        def callback():
+            nonlocal count
+            count -= 1
+            if count > 0:
+                self.ddb_mock.set_get_callback(callback)
+            raise AwsThrottlingException("GetItem")
+
+        self.ddb_mock.set_get_callback(callback)
+        self.ddb.find_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'})
+        get = _find(self.accounting.summarize(), "GetItem")
+        self.assertEqual(1, get['calls'])
+        self.assertEqual(2, get['throttles'])
+        self.assertEqual(2, get['retries'])
+
+    def test_latency_histogram(self):
+        h = LatencyHistogram((10, 100))
+        for millis in (1, 10, 11, 100, 5000):
+            h.add(millis)
+        record = h.to_record()
+        self.assertEqual(5, record['count'])
+        self.assertEqual(5122, record['totalMillis'])
+        self.assertEqual(5000, record['maxMillis'])
+        self.assertEqual({'<=10': 2, '<=100': 2, '>100': 1}, record['buckets'])
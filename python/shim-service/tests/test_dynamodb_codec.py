@@ -0,0 +1,53 @@
+from aws.dynamodb import _to_ddb_item, from_ddb_item, _to_attribute_value_dict, convert_value, build_map
+from aws.dynamodb_codec import ItemCodec
+from better_test_case import BetterTestCase
+from platform_channels import OMNI_PLATFORM
+from session import Session, SessionContext, ContextType
+
+
+def _generic_encode(row: dict) -> dict:
+    return {key: _to_attribute_value_dict(value) for key, value in row.items()}
+
+
+class TestSuite(BetterTestCase):
+
+    def test_session(self):
+        session = Session('org-id', 1000, 'session-id', 1, 'user-id', 'https://somewhere.com', 'token',
+                          'fcm-token', 3600, [OMNI_PLATFORM.name], expiration_time=2000)
+        record = session.to_record()
+        item = _to_ddb_item(record)
+        self.assertEqual(_generic_encode(record), item)
+        self.assertEqual(record, from_ddb_item(item))
+        self.assertEqual(session, Session.from_record(from_ddb_item(item)))
+
+    def test_session_context(self):
+        context = SessionContext(1000, 'session-id', 'user-id', ContextType.WEB, b'data', 1)
+        record = context.to_record()
+        item = _to_ddb_item(record)
+        self.assertEqual(_generic_encode(record), item)
+        self.assertEqual(record, from_ddb_item(item))
+
+    def test_type_changes(self):
+        codec = ItemCodec(_to_attribute_value_dict, convert_value)
+        first = {'a': 'string', 'b': 1, 'c': None, 'd': 1.5, 'e': True}
+        self.assertEqual(first, codec.decode(codec.encode(first)))
+
+        # Same shape, different types, should go through the generic functions
+        second = {'a': None, 'b': 'now a string', 'c': {'m': [1, 'two']}, 'd': 2, 'e': b'bytes'}
+        item = codec.encode(second)
+        self.assertEqual(_generic_encode(second), item)
+        self.assertEqual(build_map(item), codec.decode(item))
+        self.assertEqual(second, codec.decode(item))
+        self.assertEqual(2, codec.shape_count)
+
+    def test_max_shapes(self):
+        codec = ItemCodec(_to_attribute_value_dict, convert_value, max_shapes=1)
+        codec.encode({'a': 1})
+        self.assertEqual({'b': {'S': 'x'}}, codec.encode({'b': 'x'}))
+        self.assertEqual({'b': 'x'}, codec.decode({'b': {'S': 'x'}}))
+        self.assertEqual(2, codec.shape_count)
+
+    def test_odd_attribute_names(self):
+        codec = ItemCodec(_to_attribute_value_dict, convert_value)
+        row = {"it's": 1, 'with"quote': 'x', 'a\tb': 2}
+        self.assertEqual(row, codec.decode(codec.encode(row)))
@@ -0,0 +1,178 @@
+import threading
+from typing import List
+
+from aws.dynamodb import DynamoDb, RangeKeyQuerySpecifier, eq_filter, PreconditionFailedException, \
+    PutItemRequest, DeleteItemRequest, TransactionCancelledException, GetItemRequest, ThrottlingException, \
+    PrimaryKeyViolationException
+from aws.dynamodb_accounting import DynamoDbAccounting
+from aws.dynamodb_throttling import DynamoDbThrottler
+from base_test import setup_ddb
+from better_test_case import BetterTestCase
+from botomocks.dynamodb_engine import LocalDynamoDbEngine, CapacitySettings, fixed_latency, item_size, \
+    read_units, write_units, iterate_items
+from botomocks.exceptions import AwsThrottlingException
+from support.clock import Clock
+
+_TABLE = "ShimServiceSession"
+
+
+class TestSuite(BetterTestCase):
+    engine: LocalDynamoDbEngine
+    ddb: DynamoDb
+    sleeps: List[float]
+
+    def setUp(self):
+        self.sleeps = []
+        self.engine = LocalDynamoDbEngine(sleeper=self.sleeps.append, seed=1)
+        setup_ddb(self.engine)
+        self.accounting = DynamoDbAccounting()
+        self.ddb = DynamoDb(self.engine, DynamoDbThrottler(max_attempts=3, sleeper=self.sleeps.append),
+                            self.accounting)
+
+    def __add_sessions(self, tenant_id: int, count: int):
+        for i in range(count):
+            self.ddb.put_item(_TABLE, {'tenantId': tenant_id, 'sessionId': f"session-{i:03d}", 'index': i})
+
+    def test_crud(self):
+        key = {'tenantId': 1, 'sessionId': 'abc'}
+        self.ddb.put_item(_TABLE, dict(key, userId='user'), key_attributes=['tenantId', 'sessionId'])
+        self.assertEqual('user', self.ddb.get_item(_TABLE, key)['userId'])
+        self.assertRaises(PrimaryKeyViolationException,
+                          lambda: self.ddb.put_item(_TABLE, key, key_attributes=['tenantId']))
+
+        self.ddb.update_item(_TABLE, key, {'userId': 'other'}, condition={'userId': 'user'})
+        self.assertRaises(PreconditionFailedException,
+                          lambda: self.ddb.update_item(_TABLE, key, {'userId': 'x'}, condition={'userId': 'user'}))
+        self.assertEqual('other', self.ddb.find_item(_TABLE, key)['userId'])
+
+        self.assertTrue(self.ddb.delete_item(_TABLE, key))
+        self.assertFalse(self.ddb.delete_item(_TABLE, key))
+        self.assertIsNone(self.ddb.find_item(_TABLE, key))
+
+    def test_query_ranges(self):
+        self.__add_sessions(1, 50)
+        self.__add_sessions(2, 5)
+
+        def query(operation: str = None, value: str = None, **kwargs):
+            qualifier = RangeKeyQuerySpecifier('sessionId', value, operation) if operation is not None else None
+            return [row['index'] for row in self.ddb.query(_TABLE, 'tenantId', 1, range_key_qualifier=qualifier,
+                                                           **kwargs)]
+
+        self.assertEqual(list(range(50)), query())
+        self.assertEqual([10], query('=', "session-010"))
+        self.assertEqual(list(range(10)), query('<', "session-010"))
+        self.assertEqual(list(range(11)), query('<=', "session-010"))
+        self.assertEqual(list(range(41, 50)), query('>', "session-040"))
+        self.assertEqual(list(range(40, 50)), query('>=', "session-040"))
+        self.assertEqual(list(range(3)), query(limit=3))
+        self.assertEqual([3], query(filter_operations=eq_filter('index', 3)))
+
+        # Paging with ExclusiveStartKey
+        rs = self.ddb.query(_TABLE, 'tenantId', 1, limit=7)
+        self.assertEqual(7, len(list(rs)))
+        page = self.engine.query(TableName=_TABLE, KeyConditionExpression="tenantId = :h",
+                                 ExpressionAttributeValues={':h': {'N': '1'}}, Limit=20)
+        self.assertEqual(20, page['Count'])
+        page = self.engine.query(TableName=_TABLE, KeyConditionExpression="tenantId = :h",
+                                 ExpressionAttributeValues={':h': {'N': '1'}}, Limit=20,
+                                 ExclusiveStartKey=page['LastEvaluatedKey'])
+        self.assertEqual({'S': 'session-020'}, page['Items'][0]['sessionId'])
+
+    def test_scan(self):
+        for tenant_id in range(10):
+            self.__add_sessions(tenant_id, 12)
+        self.assertEqual(120, len(list(self.ddb.scan(_TABLE))))
+        rows = list(self.ddb.parallel_scan(_TABLE, 4, page_size=5))
+        self.assertEqual(120, len(rows))
+        self.assertEqual(120, len({(row['tenantId'], row['sessionId']) for row in rows}))
+        self.assertEqual(120, len(list(iterate_items(self.engine.tables[_TABLE]))))
+
+    def test_batch_and_transactions(self):
+        self.ddb.batch_write([PutItemRequest(_TABLE, {'tenantId': 1, 'sessionId': f"s{i}"}) for i in range(60)])
+        requests = [GetItemRequest(_TABLE, {'tenantId': 1, 'sessionId': f"s{i}"}) for i in range(150)]
+        self.assertEqual(60, len(self.ddb.batch_get(requests)[_TABLE]))
+
+        self.assertRaises(TransactionCancelledException, lambda: self.ddb.transact_write([
+            PutItemRequest(_TABLE, {'tenantId': 1, 'sessionId': "new"}),
+            PutItemRequest(_TABLE, {'tenantId': 1, 'sessionId': "s1"}, key_attributes=['sessionId'])
+        ]))
+        self.assertIsNone(self.ddb.find_item(_TABLE, {'tenantId': 1, 'sessionId': "new"}))
+
+        self.ddb.transact_write([
+            PutItemRequest(_TABLE, {'tenantId': 1, 'sessionId': "new"}),
+            DeleteItemRequest(_TABLE, {'tenantId': 1, 'sessionId': "s1"})
+        ])
+        self.assertIsNotNone(self.ddb.find_item(_TABLE, {'tenantId': 1, 'sessionId': "new"}))
+        self.assertIsNone(self.ddb.find_item(_TABLE, {'tenantId': 1, 'sessionId': "s1"}))
+
+    def test_consumed_capacity(self):
+        big = "x" * 5000
+        item = {'tenantId': {'N': '1'}, 'sessionId': {'S': 'abc'}, 'data': {'S': big}}
+        self.assertEqual(5, write_units(item_size(item)))
+        self.assertEqual(1.0, read_units(item_size(item), False))
+        self.assertEqual(2.0, read_units(item_size(item), True))
+
+        self.ddb.put_item(_TABLE, {'tenantId': 1, 'sessionId': 'abc', 'data': big})
+        self.ddb.get_item(_TABLE, {'tenantId': 1, 'sessionId': 'abc'}, consistent=True)
+        summary = self.accounting.summarize()
+        self.assertEqual(5.0, summary['writeCapacityUnits'])
+        self.assertEqual(2.0, summary['readCapacityUnits'])
+        self.assertEqual({_TABLE: 5.0}, self.engine.describe()['writeCapacityUnits'])
+
+    def test_capacity_throttling(self):
+        c = Clock()
+        c.ticks = 1000000
+        try:
+            self.engine.set_capacity(_TABLE, CapacitySettings(read_units_per_second=1, burst_seconds=1))
+            self.ddb.put_item(_TABLE, {'tenantId': 1, 'sessionId': 'abc'})
+            key = {'tenantId': 1, 'sessionId': 'abc'}
+            self.ddb.get_item(_TABLE, key, consistent=True)
+            # No capacity left and the clock is not moving
+            self.assertRaises(ThrottlingException, lambda: self.ddb.get_item(_TABLE, key, consistent=True))
+            self.assertEqual({'GetItem': 3}, self.engine.describe()['throttles'])
+
+            c.increment_seconds(2)
+            self.assertEqual('abc', self.ddb.get_item(_TABLE, key, consistent=True)['sessionId'])
+
+            # Batch reads come back unprocessed rather than failing, as long as some keys are read
+            self.__add_sessions(2, 4)
+            self.engine.set_capacity(_TABLE, CapacitySettings(read_units_per_second=1, burst_seconds=1))
+            request = {_TABLE: {'Keys': [{'tenantId': {'N': '2'}, 'sessionId': {'S': f"session-{i:03d}"}}
+                                         for i in range(4)]}}
+            result = self.engine.batch_get_item(RequestItems=request)
+            self.assertEqual(2, len(result['Responses'][_TABLE]))
+            self.assertEqual(2, len(result['UnprocessedKeys'][_TABLE]['Keys']))
+            self.assertRaises(AwsThrottlingException, lambda: self.engine.batch_get_item(RequestItems=request))
+        finally:
+            c.cleanup()
+
+    def test_latency_and_injection(self):
+        engine = LocalDynamoDbEngine(latency=fixed_latency(20), latencies={'PutItem': fixed_latency(5)},
+                                     throttle_probability=0.5, seed=7, sleeper=self.sleeps.append)
+        setup_ddb(engine)
+        ddb = DynamoDb(engine, DynamoDbThrottler(sleeper=lambda s: None))
+        for i in range(20):
+            ddb.put_item(_TABLE, {'tenantId': 1, 'sessionId': f"s{i}"})
+            ddb.get_item(_TABLE, {'tenantId': 1, 'sessionId': f"s{i}"})
+        self.assertEqual(0.005, self.sleeps[0])
+        self.assertIn(0.02, self.sleeps)
+        self.assertTrue(engine.get_throttle_count() > 0)
+        calls = engine.describe()['calls']
+        self.assertEqual(20 + engine.describe()['throttles'].get('PutItem', 0), calls['PutItem'])
+
+    def test_concurrent_writes(self):
+        def writer(tenant_id: int):
+            for i in range(100):
+                self.engine.put_item(TableName=_TABLE,
+                                     Item={'tenantId': {'N': str(tenant_id)}, 'sessionId': {'S': f"s{i:03d}"}})
+
+        threads = [threading.Thread(target=writer, args=(t,)) for t in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        table = self.engine.tables[_TABLE]
+        self.assertEqual(8, len(table.collections))
+        for collection in table.collections.values():
+            self.assertEqual(100, len(collection.sort_keys))
+            self.assertEqual(sorted(collection.sort_keys), collection.sort_keys)
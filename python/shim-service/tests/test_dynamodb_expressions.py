@@ -0,0 +1,47 @@
+from aws import dynamodb_expressions
+from aws.dynamodb import UpdateItemRequest, _build_filter_expression, eq_filter, not_exists_filter, le_filter
+from better_test_case import BetterTestCase
+
+
+class TestSuite(BetterTestCase):
+
+    def test_update_request(self):
+        req = UpdateItemRequest("Table", {'hashKey': 'h', 'rangeKey': 'r'},
+                                {'hashKey': 'h', 'activeAt': 10, 'sessionData': b'data'},
+                                condition={'timeoutAt': 5})
+        params = req.to_ddb_request()['Update']
+        self.assertEqual("SET activeAt = :v1, sessionData = :v2", params['UpdateExpression'])
+        self.assertEqual("timeoutAt = :c1 AND hashKey = :k1 AND rangeKey = :k2", params['ConditionExpression'])
+        self.assertEqual({
+            ':c1': {'N': '5'},
+            ':k1': {'S': 'h'},
+            ':k2': {'S': 'r'},
+            ':v1': {'N': '10'},
+            ':v2': {'B': b'data'}
+        }, params['ExpressionAttributeValues'])
+
+        # Same shape, should come from the cache
+        info = dynamodb_expressions.update_template.cache_info()
+        req = UpdateItemRequest("Table", {'hashKey': 'h2', 'rangeKey': 'r2'},
+                                {'activeAt': 11, 'sessionData': b'other'},
+                                condition={'timeoutAt': 6})
+        params = req.to_ddb_request()['Update']
+        self.assertEqual("SET activeAt = :v1, sessionData = :v2", params['UpdateExpression'])
+        self.assertEqual({'N': '11'}, params['ExpressionAttributeValues'][':v1'])
+        self.assertEqual(info.hits + 1, dynamodb_expressions.update_template.cache_info().hits)
+
+    def test_filters(self):
+        values = {}
+        names = {}
+        expr = _build_filter_expression((eq_filter('sessionStatus', 'A'), not_exists_filter('sent'),
+                                         le_filter('activeAt', 100)), values, names)
+        self.assertEqual("#e1 = :f1 AND attribute_not_exists(sent) AND #e2 <= :f2", expr)
+        self.assertEqual({':f1': {'S': 'A'}, ':f2': {'N': '100'}}, values)
+        self.assertEqual({'#e1': 'sessionStatus', '#e2': 'activeAt'}, names)
+
+    def test_templates(self):
+        self.assertIsNone(dynamodb_expressions.update_template(()))
+        self.assertEqual(("a = :k3 AND b = :k4", (":k3", ":k4")),
+                         dynamodb_expressions.equals_template(("a", "b"), ":k", 3))
+        self.assertEqual("attribute_exists(a) AND attribute_exists(b)",
+                         dynamodb_expressions.exists_template(("a", "b")))
@@ -0,0 +1,111 @@
+from typing import List
+
+from aws.dynamodb import DynamoDb, ThrottlingException
+from aws.dynamodb_throttling import DynamoDbThrottler, BackoffPolicy, RetryBudget, AdaptiveTokenBucket, \
+    ThrottleStats
+from base_test import setup_ddb
+from better_test_case import BetterTestCase
+from botomocks.dynamodb_mock import MockDynamoDbClient
+from botomocks.exceptions import AwsThrottlingException
+from support.clock import Clock
+
+
+class TestSuite(BetterTestCase):
+    ddb_mock: MockDynamoDbClient
+    ddb: DynamoDb
+    sleeps: List[float]
+
+    def setUp(self):
+        self.sleeps = []
+        self.ddb_mock = MockDynamoDbClient()
+        setup_ddb(self.ddb_mock)
+        self.throttler = DynamoDbThrottler(max_attempts=3, sleeper=self.sleeps.append)
+        self.ddb = DynamoDb(self.ddb_mock, self.throttler)
+
+    def __throttle_gets(self, count: int, error_code: str = "ThrottlingException"):
+        def callback():
+            nonlocal count
+            count -= 1
+            if count > 0:
+                self.ddb_mock.set_get_callback(callback)
+            raise AwsThrottlingException("GetItem", error_code)
+
+        self.ddb_mock.set_get_callback(callback)
+
+    def test_retry(self):
+        self.ddb.put_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'})
+        self.__throttle_gets(2, "ProvisionedThroughputExceededException")
+        item = self.ddb.get_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'})
+        self.assertEqual('abc', item['sessionId'])
+
+        resp = self.ddb.get_last_response()
+        self.assertEqual(2, resp.throttle_count)
+        self.assertTrue(resp.throttle_sleep_millis >= self.throttler.backoff_policy.base_millis * 2)
+
+        bucket = self.throttler.get_bucket("ShimServiceSession")
+        self.assertTrue(bucket.enabled)
+        self.assertEqual({"ShimServiceSession": 2}, self.throttler.get_throttle_counts())
+
+    def test_max_attempts(self):
+        self.__throttle_gets(3)
+        self.assertRaises(ThrottlingException,
+                          lambda: self.ddb.get_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'}))
+        self.assertEqual({"ShimServiceSession": 3}, self.throttler.get_throttle_counts())
+
+    def test_retry_budget(self):
+        self.throttler.retry_budget = RetryBudget(10, 5)
+        self.__throttle_gets(3)
+        self.assertRaises(ThrottlingException,
+                          lambda: self.ddb.get_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'}))
+        self.assertEqual(0, self.throttler.retry_budget.available)
+
+        # Successful calls refund the budget
+        self.ddb.find_item("ShimServiceSession", {'tenantId': 1, 'sessionId': 'abc'})
+        self.assertEqual(1, self.throttler.retry_budget.available)
+
+    def test_backoff_policy(self):
+        policy = BackoffPolicy(10, 1000)
+        delay = 0
+        for i in range(50):
+            delay = policy.next_delay(delay)
+            self.assertTrue(10 <= delay <= 1000)
+
+    def test_token_bucket(self):
+        sleeps = []
+        c = Clock()
+        c.ticks = 1000000
+        try:
+            bucket = AdaptiveTokenBucket("test", min_fill_rate=2.0)
+            for i in range(20):
+                bucket.acquire(sleeps.append)
+                c.increment_ticks(50)
+            self.assertFalse(bucket.enabled)
+            self.assertEqual(0, len(sleeps))
+            self.assertTrue(bucket.measured_rate > 0)
+
+            bucket.on_throttle()
+            self.assertTrue(bucket.enabled)
+            rate = bucket.fill_rate
+            self.assertTrue(2.0 <= rate < bucket.measured_rate)
+
+            # No tokens available right after a throttle
+            waited = bucket.acquire(sleeps.append)
+            self.assertEqual(1, len(sleeps))
+            self.assertEqual(int(sleeps[0] * 1000), waited)
+
+            # Fill rate recovers while calls succeed
+            c.increment_ticks(20000)
+            bucket.on_success()
+            self.assertFalse(bucket.enabled)
+            self.assertIsNone(bucket.fill_rate)
+        finally:
+            c.cleanup()
+
+    def test_throttle_stats(self):
+        bucket = self.throttler.get_bucket(None)
+        stats = ThrottleStats()
+        self.throttler.wait_for_token(bucket, stats)
+        self.assertIsNotNone(self.throttler.on_throttle(bucket, stats, 0))
+        self.assertEqual(1, stats.throttle_count)
+        self.assertEqual(1, stats.attempts)
+        self.assertIs(bucket, self.throttler.get_bucket("*"))
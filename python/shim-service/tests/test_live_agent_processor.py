@@ -1,20 +1,28 @@
 import json
 import time
+from copy import copy
 from typing import List
 
 import bean
 from base_test import BaseTest, AsyncMode, SECOND_USER_ID, DEFAULT_USER_ID
 from bean import BeanName
 from config import Config
+from mocks.extended_http_session_mock import ExtendedHttpMockSession
 from mocks.gcp.firebase_admin import messaging
 from mocks.http_session_mock import set_always_response, MockedResponse
 from pending_event import PendingEventType
-from poll.live_agent.processor import LiveAgentPollingProcessor
+from poll import base_processor
+from poll.live_agent.processor import LiveAgentPollingProcessor, AsyncProcessorGroup
+from repos.aws.aws_session_push_notifications import AwsPushNotificationsRepo, LocalRecord
 from repos.pending_event_repo import PendingEventsRepo
+from repos.resource_lock import ResourceLockRepo
 from repos.session_push_notifications import SessionPushNotificationsRepo
 from session import SessionStatus
 from support.verification_utils import verify_dry_run, verify_async_result, verify_agent_chat_request
 from utils import loghelper
+from utils.async_http_client import wrap_client
+from utils.date_utils import get_system_time_in_millis
+from utils.string_utils import compress
 
 POLLER_FUNCTION = "ShimServiceLiveAgentPoller"
 
@@ -95,6 +103,11 @@ class TestLiveAgentPollingProcessor(BaseTest):
         notifications = list(repo.query_notifications(sess))
         self.assertEmpty(notifications)
 
+        # The sent notifications are moved out of the unsent queue
+        sent = list(repo.query_set(sess.tenant_id, sess.session_id))
+        self.assertEqual([3, 4], list(map(lambda r: r.seq_no, sent)))
+        self.assertTrue(all(map(lambda r: r.sent, sent)))
+
         # Check the actual notifications
 
         # The first one was the verification of the fcm device token
@@ -117,6 +130,77 @@ class TestLiveAgentPollingProcessor(BaseTest):
         self.assertEqual(sess.tenant_id, event.tenant_id)
         self.assertEqual(sess.session_id, event.session_id)
 
+    def test_legacy_notifications(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+        sess = self.get_session_from_token(token)
+        repo: AwsPushNotificationsRepo = bean.get_bean_instance(BeanName.PUSH_NOTIFICATION_REPO)
+
+        # An unsent notification written before the unsent queue existed
+        self.assertTrue(repo.create(LocalRecord(sess.tenant_id, sess.session_id, 1, 'omni', 'Legacy', compress('{}'),
+                                                get_system_time_in_millis(), False, None)))
+        repo.submit(sess, 'omni', 'Queued', '{}')
+
+        notifications = list(repo.query_notifications(sess))
+        self.assertEqual(['Legacy', 'Queued'], list(map(lambda n: n.message_type, notifications)))
+        self.assertTrue(all(map(repo.set_sent, notifications)))
+        self.assertEmpty(list(repo.query_notifications(sess)))
+
+        # Sending the queued one again is detected
+        self.assertFalse(repo.set_sent(notifications[1]))
+
+        # Nothing is read from the push notification table once the legacy rows have expired
+        repo.read_legacy_notifications = False
+        self.assertTrue(repo.create(LocalRecord(sess.tenant_id, sess.session_id, 100, 'omni', 'Legacy', compress('{}'),
+                                                get_system_time_in_millis(), False, None)))
+        self.assertEmpty(list(repo.query_notifications(sess)))
+
+    def test_late_notification(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+        sess = self.get_session_from_token(token)
+        repo: AwsPushNotificationsRepo = bean.get_bean_instance(BeanName.PUSH_NOTIFICATION_REPO)
+        self.lambda_mock.enable_function(PUSH_NOTIFIER_FUNCTION, delayed=True)
+        # The verification of the fcm device token
+        verify_dry_run(messaging.pop_invocation())
+
+        def commit_and_notify(seq_no: int):
+            self.assertTrue(repo.unsent_repo.create(LocalRecord(sess.tenant_id, sess.session_id, seq_no, 'omni',
+                                                                f"Message{seq_no}", compress('{}'),
+                                                                get_system_time_in_millis(), False, None)))
+            repo.lambda_invoker.invoke_notification_poller(sess)
+            self.assertGreater(self.lambda_mock.wait_for_completion(PUSH_NOTIFIER_FUNCTION), 0)
+            payload = json.loads(messaging.pop_invocation().data['x1440Payload'])
+            self.assertEqual(f"Message{seq_no}", payload['messageType'])
+
+        # The higher number commits, and is sent, first
+        commit_and_notify(1001)
+        commit_and_notify(1000)
+        messaging.assert_no_invocations()
+        self.assertEmpty(list(repo.query_notifications(sess)))
+
+    def test_invoke_async(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+
+        mock = ExtendedHttpMockSession()
+        mock.add_get_response(
+            "https://somewhere-chat.lightning.force.com/chat/rest/System/Messages?ack=-1&pc=0",
+            200,
+            body=_MESSAGE_DATA
+        )
+        self.processor.async_polling = True
+        self.processor.http_client = wrap_client(self.create_http_client(mock))
+        self.assertTrue(isinstance(self.processor.create_group(), AsyncProcessorGroup))
+
+        self.processor.invoke({})
+        self.assertIn("Starting poll for 1 session(s) ...", self.info_logs)
+
+        repo: SessionPushNotificationsRepo = bean.get_bean_instance(BeanName.PUSH_NOTIFICATION_REPO)
+        notifications = list(repo.query_notifications(self.get_session_from_token(token)))
+        self.assertEqual([3, 4], list(map(lambda n: n.seq_no, notifications)))
+
+        # The event was released, so it can be polled again
+        pe_repo: PendingEventsRepo = bean.get_bean_instance(BeanName.PENDING_EVENTS_REPO)
+        self.assertHasLength(1, pe_repo.query_events(PendingEventType.LIVE_AGENT_POLL, 100, None).rows)
+
     def install_notification_delay(self):
         """
         Use this to cause delay in processing to ensure that another thread attempts to obtain a lock while
@@ -134,6 +218,21 @@ class TestLiveAgentPollingProcessor(BaseTest):
 
         repo.query_notifications = my_func
 
+    def test_prefetch(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+        sess = self.get_session_from_token(token)
+        group = self.processor.create_group()
+        events = group.query_events(10, None).rows
+        self.assertHasLength(1, events)
+        gone = copy(events[0])
+        gone.session_id = "gone"
+        group.prefetch(events + [gone])
+
+        sc = group.prefetched[(sess.tenant_id, sess.session_id)]
+        self.assertEqual(sess.session_id, sc.session.session_id)
+        self.assertEqual(sess.session_id, sc.context.session_id)
+        self.assertIsNone(group.prefetched[(sess.tenant_id, "gone")])
+
     def test_invoke_empty(self):
         self.processor.invoke({})
         self.assertEqual("No sessions to poll.", self.info_logs.pop(0))
@@ -154,6 +253,88 @@ class TestLiveAgentPollingProcessor(BaseTest):
         n = self.sns_mock.pop_notification()
         self.assertContains("Unexpected request: GET", n.message)
 
+    def test_invoke_sticky(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+
+        mock = self.add_new_http_mock()
+        mock.add_get_response(
+            "https://somewhere-chat.lightning.force.com/chat/rest/System/Messages?ack=-1&pc=0",
+            200,
+            body=_MESSAGE_DATA
+        )
+        # The next poll will get a shutdown
+        mock.add_get_response(
+            "https://somewhere-chat.lightning.force.com/chat/rest/System/Messages?ack=-1&pc=1",
+            400
+        )
+        self.processor.sticky_seconds = 300
+
+        self.processor.invoke({})
+        self.assertHasLength(1, list(filter(lambda m: m.startswith("Starting poll for"), self.info_logs)))
+        self.assertHasLength(1, list(filter(lambda m: m.startswith("Attempting to lock"), self.info_logs)))
+
+        # The messages from the first poll, and the shutdown from the second
+        repo: SessionPushNotificationsRepo = bean.get_bean_instance(BeanName.PUSH_NOTIFICATION_REPO)
+        sess = self.get_session_from_token(token, failure_ok=True)
+        notifications = list(repo.query_notifications(sess))
+        self.assertEqual([3, 4, 5], list(map(lambda n: n.seq_no, notifications)))
+
+        # The second poll, in the same worker, is the one that shut it down
+        self.assertEqual(SessionStatus.FAILED, sess.status)
+        self.assertEqual("Polling was shutdown.", sess.failure_message)
+        pe_repo: PendingEventsRepo = bean.get_bean_instance(BeanName.PENDING_EVENTS_REPO)
+        self.assertEmpty(pe_repo.query_events(PendingEventType.LIVE_AGENT_POLL, 100, None).rows)
+
+    def test_invoke_sticky_deadline(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+
+        mock = self.add_new_http_mock()
+        mock.add_get_response(
+            "https://somewhere-chat.lightning.force.com/chat/rest/System/Messages?ack=-1&pc=0",
+            204
+        )
+        self.processor.sticky_seconds = 300
+        # No time left for a second poll before the invocation ends
+        self.processor.max_polling_seconds = 10
+
+        self.processor.invoke({})
+
+        sess = self.get_session_from_token(token)
+        self.assertNotEqual(SessionStatus.FAILED, sess.status)
+        pe_repo: PendingEventsRepo = bean.get_bean_instance(BeanName.PENDING_EVENTS_REPO)
+        self.assertHasLength(1, pe_repo.query_events(PendingEventType.LIVE_AGENT_POLL, 100, None).rows)
+
+    def test_invoke_rolling(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+
+        mock = self.add_new_http_mock()
+        mock.add_get_response(
+            "https://somewhere-chat.lightning.force.com/chat/rest/System/Messages?ack=-1&pc=0",
+            204
+        )
+        # The session is loaded again for the second poll
+        mock = self.add_new_http_mock()
+        mock.add_get_response(
+            "https://somewhere-chat.lightning.force.com/chat/rest/System/Messages?ack=-1&pc=1",
+            400
+        )
+        config: Config = bean.get_bean_instance(BeanName.CONFIG)
+        self.processor.admission_seconds = config.live_agent_poll_session_seconds + 30
+        save_interval = base_processor._ADMISSION_INTERVAL_SECONDS
+        base_processor._ADMISSION_INTERVAL_SECONDS = 1
+        try:
+            self.processor.invoke({})
+        finally:
+            base_processor._ADMISSION_INTERVAL_SECONDS = save_interval
+
+        # The session was released after the first poll, and collected again by the same invocation
+        self.assertHasLength(1, list(filter(lambda m: m.startswith("Starting poll for"), self.info_logs)))
+        self.assertHasLength(2, list(filter(lambda m: m.startswith("Attempting to lock"), self.info_logs)))
+
+        sess = self.get_session_from_token(token, failure_ok=True)
+        self.assertEqual(SessionStatus.FAILED, sess.status)
+        self.assertEqual("Polling was shutdown.", sess.failure_message)
+
     def test_invoke_multiple(self):
         self.create_web_session(async_mode=AsyncMode.NONE)
         self.create_web_session(async_mode=AsyncMode.NONE, user_id=SECOND_USER_ID)
@@ -163,6 +344,55 @@ class TestLiveAgentPollingProcessor(BaseTest):
         self.sns_mock.pop_notification()
         self.sns_mock.pop_notification()
 
+    def test_concurrent_collect(self):
+        self.create_web_session(async_mode=AsyncMode.NONE)
+        self.create_web_session(async_mode=AsyncMode.NONE, user_id=SECOND_USER_ID)
+
+        # Simulate another poller collecting
+        lock_repo: ResourceLockRepo = bean.get_bean_instance(BeanName.RESOURCE_LOCK_REPO)
+        lock = lock_repo.try_acquire(LiveAgentPollingProcessor.lock_name(), 60)
+        try:
+            self.processor.invoke({})
+            self.assertEqual(["Another poller is collecting sessions."], self.info_logs[-1:])
+
+            self.processor.concurrent_collect = True
+            self.processor.invoke({})
+            self.assertIn("Starting poll for 2 session(s) ...", self.info_logs)
+        finally:
+            lock.release()
+        self.sns_mock.pop_notification()
+        self.sns_mock.pop_notification()
+
+    def test_locked_session(self):
+        self.create_web_session(async_mode=AsyncMode.NONE)
+        pe_repo: PendingEventsRepo = bean.get_bean_instance(BeanName.PENDING_EVENTS_REPO)
+        events = pe_repo.query_events(PendingEventType.LIVE_AGENT_POLL, 100, None).rows
+        self.assertHasLength(1, events)
+
+        prefetched = []
+        create_group = self.processor.create_group
+
+        def create_capturing_group():
+            group = create_group()
+            group.prefetch = prefetched.extend
+            return group
+
+        # Simulate another poller polling the session
+        self.processor.create_group = create_capturing_group
+        lock_repo: ResourceLockRepo = bean.get_bean_instance(BeanName.RESOURCE_LOCK_REPO)
+        lock = lock_repo.try_acquire(f"lap/{events[0].tenant_id}-{events[0].user_id}", 60)
+        try:
+            self.processor.invoke({})
+        finally:
+            lock.release()
+        self.assertEqual("No sessions to poll.", self.info_logs[-1])
+        # Nothing is loaded for events that were not admitted
+        self.assertEmpty(prefetched)
+
+        # The event is left as it was, rather than claimed or released
+        result = pe_repo.query_events(PendingEventType.LIVE_AGENT_POLL, 100, None)
+        self.assertEqual([events[0].active_at], list(map(lambda e: e.active_at, result.rows)))
+
     def test_limit(self):
         """
         Here we create the max events allowed per session + 1
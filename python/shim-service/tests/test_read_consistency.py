@@ -0,0 +1,86 @@
+from typing import Dict, Any, List
+
+from base_test import BaseTest, AsyncMode
+from bean import beans, BeanName
+from repos.aws.read_consistency import ConsistencyPolicy, ReadConsistency, FIND_SESSION, LOAD_SESSION_DATA
+from session import ContextType
+
+
+def _find_reads(summary: Dict[str, Any], call_site: str) -> List[Dict[str, Any]]:
+    return [r for r in summary.get('reads', ()) if r['callSite'] == call_site]
+
+
+class ReadConsistencyTests(BaseTest):
+    def test_find_session(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+        sess = self.get_session_from_token(token)
+        accounting = self.dynamodb.accounting
+        accounting.reset()
+
+        # Strong by default
+        self.sessions_repo.find_session(sess)
+        summary = accounting.summarize()
+        self.assertEqual(1.0, summary['readCapacityUnits'])
+        self.assertEqual([{'logicalOperation': '-', 'callSite': FIND_SESSION, 'consistency': 'strong',
+                           'reads': 1, 'staleReads': 0}], _find_reads(summary, FIND_SESSION))
+
+        self.sessions_repo.consistency_policy = ConsistencyPolicy(overrides={FIND_SESSION: ReadConsistency.EVENTUAL})
+        self.assertEqual(sess, self.sessions_repo.find_session(sess))
+        self.assertEqual(.5, accounting.summarize()['readCapacityUnits'])
+
+        # Validated reads only read again when the item is older than what we have seen
+        self.sessions_repo.consistency_policy = ConsistencyPolicy(ReadConsistency.VALIDATED)
+        self.assertEqual(sess, self.sessions_repo.find_session(sess))
+        summary = accounting.summarize()
+        self.assertEqual(1, summary['calls'])
+        self.assertEqual(0, _find_reads(summary, FIND_SESSION)[0]['staleReads'])
+
+        # Put back the old version after an update
+        old_item = self.dynamodb.get_item("ShimServiceSession", {'tenantId': sess.tenant_id,
+                                                                 'sessionId': sess.session_id})
+        self.assertTrue(self.sessions_repo.update_session(sess))
+        self.dynamodb.put_item("ShimServiceSession", old_item)
+        accounting.reset()
+
+        self.sessions_repo.find_session(sess)
+        summary = accounting.summarize()
+        self.assertEqual(2, summary['calls'])
+        self.assertEqual(1.5, summary['readCapacityUnits'])
+        self.assertEqual(1, _find_reads(summary, FIND_SESSION)[0]['staleReads'])
+
+    def test_load_session_data(self):
+        token = self.create_web_session(async_mode=AsyncMode.NONE)
+        sess = self.get_session_from_token(token)
+        repo = beans.get_bean_instance(BeanName.SFDC_SESSIONS_REPO)
+        contexts_repo = beans.get_bean_instance(BeanName.SESSION_CONTEXTS_REPO)
+        repo.consistency_policy = ConsistencyPolicy(ReadConsistency.VALIDATED)
+        accounting = self.dynamodb.accounting
+
+        def load_capacity_units() -> float:
+            accounting.reset()
+            self.assertIsNotNone(repo.load_data_and_context(sess, ContextType.LIVE_AGENT))
+            summary = accounting.summarize()
+            self.assertEqual(0, _find_reads(summary, LOAD_SESSION_DATA)[0]['staleReads'])
+            return summary['readCapacityUnits']
+
+        # The context was written without a version when the session was created, so the first read is
+        # consistent, and the ones after that are not
+        consistent_units = load_capacity_units()
+        self.assertEqual(consistent_units / 2, load_capacity_units())
+
+        # Our own writes are read back consistently, once
+        context = repo.load_data_and_context(sess, ContextType.LIVE_AGENT).context
+        self.assertTrue(contexts_repo.update_session_context(context))
+        self.assertEqual(consistent_units, load_capacity_units())
+        self.assertEqual(consistent_units / 2, load_capacity_units())
+
+        self.assertTrue(contexts_repo.set_failed(context, "failed"))
+        accounting.reset()
+        self.assertIsNone(repo.load_data_and_context(sess, ContextType.LIVE_AGENT))
+        self.assertEqual(consistent_units, accounting.summarize()['readCapacityUnits'])
+
+    def test_config(self):
+        policy = ConsistencyPolicy.from_config('eventual', {FIND_SESSION: 'validated'})
+        self.assertEqual(ReadConsistency.VALIDATED, policy.get(FIND_SESSION))
+        self.assertEqual(ReadConsistency.EVENTUAL, policy.get('other'))
+        self.assertRaises(ValueError, lambda: ConsistencyPolicy.from_config('bad', None))
@@ -92,6 +92,11 @@ class SessionManagerTest(BaseTest):
         ns = PushNotificationContextSettings.deserialize(ctx.session_data)
         self.assertIsNone(ns.last_seq_no)
 
+        # Projected read of the context, along with the token from the session
+        entry = repo.find_session_context_with_fcm_token(sess, ContextType.PUSH_NOTIFIER)
+        self.assertEqual(ctx.to_record(), entry.context.to_record())
+        self.assertEqual(sess.fcm_device_token, entry.token)
+
         results = repo.query(sess.tenant_id)
         # Expect this to break when we start working on x1440, should be 4
         self.assertHasLength(3, results.rows)
@@ -326,13 +331,63 @@ class SessionManagerTest(BaseTest):
         self.assertRaises(GoneException, lambda: self.submit_keepalive(session))
 
     def test_delete(self):
-        session = self.create_session()
+        session = self.create_session(async_conn=False)
+        platform_repo = self.sessions_repo.platform_sessions_repo
+        self.assertEqual([session.session_id],
+                         list(platform_repo.query_session_ids(TENANT_ID, X1440_PLATFORM.name, True)))
+        self.assertTrue(self.sessions_repo.has_sessions_with_platform_channel_type(TENANT_ID, OMNI_PLATFORM.name))
+
         self.assertTrue(self.delete_session(session))
         self.assertRaises(GoneException, lambda: self.delete_session(session))
 
         # Let's make sure it deleted everything
         self.assertIsNone(self.sessions_repo.find_session(session))
         self.assertIsNone(self.user_sessions_repo.find_by_session(session))
+        self.assertFalse(platform_repo.has_sessions(TENANT_ID, X1440_PLATFORM.name, True))
+        self.assertFalse(self.sessions_repo.has_sessions_with_platform_channel_type(TENANT_ID, X1440_PLATFORM.name))
+
+    def test_platform_session_backfill(self):
+        platform_repo = self.sessions_repo.platform_sessions_repo
+        legacy = self.create_session(async_conn=False)
+        # Pretend it was activated before the platform session index existed
+        for platform_type in (X1440_PLATFORM.name, OMNI_PLATFORM.name):
+            platform_repo.delete(TENANT_ID, platform_type, legacy.session_id)
+        indexed = self.create_session(user_id='other-user', fcm_device_token='other-device', async_conn=False)
+
+        expected = sorted([legacy.session_id, indexed.session_id])
+        self.assertEqual(expected, sorted(self.sessions_repo.query_session_ids_with_platform_channel_type(
+            TENANT_ID, X1440_PLATFORM.name)))
+        self.assertEqual(expected, sorted(platform_repo.query_session_ids(TENANT_ID, X1440_PLATFORM.name, True)))
+
+        # The tenant's sessions are only filtered once
+        self.assertTrue(self.delete_session(legacy))
+        self.assertTrue(self.delete_session(indexed))
+        self.dynamodb.accounting.reset()
+        self.assertFalse(self.sessions_repo.has_sessions_with_platform_channel_type(TENANT_ID, X1440_PLATFORM.name))
+        self.assertEqual([], list(self.sessions_repo.query_session_ids_with_platform_channel_type(
+            TENANT_ID, X1440_PLATFORM.name)))
+        self.assertEqual([], [k for k in self.dynamodb.accounting.get_stats()
+                              if k[1] == "Query" and k[2] == "ShimServiceSession"])
+
+    def test_platform_session_backfill_with_delete(self):
+        platform_repo = self.sessions_repo.platform_sessions_repo
+        legacy = self.create_session(async_conn=False)
+        for platform_type in (X1440_PLATFORM.name, OMNI_PLATFORM.name):
+            platform_repo.delete(TENANT_ID, platform_type, legacy.session_id)
+
+        # Delete the session after it is found by the filter, but before its entry is written
+        original = self.ddb_mock.transact_write_items
+
+        def delete_first(**kwargs):
+            self.ddb_mock.transact_write_items = original
+            self.assertTrue(self.delete_session(legacy))
+            return original(**kwargs)
+
+        self.ddb_mock.transact_write_items = delete_first
+        self.assertEqual([], list(self.sessions_repo.query_session_ids_with_platform_channel_type(
+            TENANT_ID, X1440_PLATFORM.name)))
+        self.assertEqual([], list(platform_repo.query_session_ids(TENANT_ID, X1440_PLATFORM.name, True)))
+        self.assertFalse(self.sessions_repo.has_sessions_with_platform_channel_type(TENANT_ID, X1440_PLATFORM.name))
 
     def test_create_with_user_already_logged_in(self):
         # Simulate user logged in with a different device token
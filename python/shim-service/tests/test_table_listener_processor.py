@@ -60,6 +60,7 @@ class TestSuite(BaseTest):
 
         self.ddb_mock.add_delete_listener(listener)
         self.invoke_event(payload)
-        # There are currently 3 context types, so we expect 100 * 3 = 300 deletes to have been issued
-        self.assertHasLength(300, keys)
-        self.assertEqual(300, self.ddb_mock.delete_count)
+        # There are currently 3 context types and 2 platform types, so we expect 100 * 5 = 500 deletes to have
+        # been issued
+        self.assertHasLength(500, keys)
+        self.assertEqual(500, self.ddb_mock.delete_count)
@@ -5,7 +5,7 @@ from typing import List, Any
 
 from better_test_case import BetterTestCase
 from support.thread_utils import SignalEvent
-from utils.threading_utils import AsyncProcessorGroup, submit_blocks_in_parallel
+from utils.threading_utils import AsyncProcessorGroup, submit_blocks_in_parallel, map_in_parallel, SingleFlight
 
 
 class Tester:
@@ -137,7 +137,56 @@ class TestSuite(BetterTestCase):
         self.assertHasLength(2, threads_seen)
         self.assertEqual(20, total)
 
+    def test_map_in_parallel(self):
+        threads_seen = set()
 
-
-
-
+        def square(value: int) -> int:
+            threads_seen.add(threading.current_thread().ident)
+            time.sleep(0.01)
+            return value * value
+
+        self.assertEqual([i * i for i in range(20)], map_in_parallel(list(range(20)), 4, square))
+        self.assertTrue(1 < len(threads_seen) <= 4)
+        self.assertEqual([], map_in_parallel([], 4, square))
+
+        def fail(value: int):
+            if value == 7:
+                raise ValueError("bad value")
+            return value
+
+        self.assertRaises(ValueError, lambda: map_in_parallel(list(range(20)), 4, fail))
+
+    def test_single_flight(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return "value"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.call("key", load))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        while flights.hits + flights.misses < 5:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(["value"] * 5, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(4, flights.hits)
+        self.assertEqual(1, flights.misses)
+        self.assertEqual(0, flights.in_flight())
+
+        # Once complete, the next call is made again
+        self.assertEqual("value", flights.call("key", load))
+        self.assertEqual(2, len(calls))
+
+        def fail():
+            raise ValueError("bad")
+
+        self.assertRaises(ValueError, lambda: flights.call("key", fail))
+        self.assertEqual(0, flights.in_flight())